@@ -1,4 +1,5 @@
 import abc
+import os
 import re
 from collections import OrderedDict
 from copy import copy
@@ -7,7 +8,9 @@ from typing import Iterable, List
 
 import pendulum
 import yaml
-from requests import Session
+
+from http_cache import ResponseCache
+from transport import get_session
 
 
 def get_value_in_delim(in_val, start_delim='(', end_delim=')'):
@@ -53,9 +56,25 @@ class PreparedVideoInfo(yaml.YAMLObject):
 
 class VideoProvider(object, metaclass=abc.ABCMeta):
 
-    def __init__(self, provider_url):
+    def __init__(self, provider_url, cache_dir=None):
+        """
+        :param cache_dir: Directory to keep responses and other scraped data in between runs.
+                          If None, nothing is cached on disk.
+        """
         self.provider_url = provider_url
-        self.session = Session()
+        self.session = get_session()
+        self.cache_dir = cache_dir
+        self.http_cache = ResponseCache(os.path.join(cache_dir, 'http')) if cache_dir else None
+
+    def cached_request(self, method, url, ttl, **kwargs):
+        """
+        Send a request, reusing the response of an identical earlier one if it's cached and still fresh.
+
+        :param ttl: Seconds a response stays fresh, or None if it never goes stale.
+        """
+        if self.http_cache is None:
+            return self.session.request(method, url, **kwargs)
+        return self.http_cache.request(self.session, method, url, ttl, **kwargs)
 
     @abc.abstractmethod
     def available_dates(self, start_date: date, end_date: date) -> Iterable[pendulum.Date]:
@@ -66,13 +85,35 @@ class VideoProvider(object, metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def download(self, url, destination_dir):
+    def download(self, url, destination_dir, **kwargs):
         pass
 
     @abc.abstractmethod
     def postprocess(self, video_metadata: VideoMetadata, download_dir, destination_dir, **kwargs) -> PreparedVideoInfo:
         pass
 
+    def postprocess_all(self, video_metadatas: List[VideoMetadata], download_dir, destination_dir,
+                        **kwargs) -> List[PreparedVideoInfo]:
+        """
+        Post-process every video downloaded into one directory.
+        Providers that can share work between the videos, like reading the same source once, override this.
+        """
+        return [self.postprocess(video_metadata, download_dir, destination_dir, **kwargs)
+                for video_metadata in video_metadatas]
+
+
+class SegmentedVideoProvider(VideoProvider):
+    """
+    Provider that serves videos as many short segments, which can be fetched from a pool shared by all videos.
+    """
+
+    @abc.abstractmethod
+    def segment_urls(self, url) -> Iterable[str]:
+        """
+        Resolve a video URL into the URLs of its segments, in timeline order.
+        """
+        pass
+
 
 def timecode_to_seconds(timecode):
     return int(timecode[0:2]) * (60*60) + int(timecode[3:5]) * 60 + int(timecode[6:8])
@@ -96,6 +137,22 @@ def shift_timecodes(timecodes: List[TimeCode], relative_to: str):
         timecode.end_ts = adjust_timecode(timecode.end_ts, -shift_timecode_s)
 
 
+def extended_end(previous: VideoMetadata, current: VideoMetadata):
+    """
+    Check whether a video has grown since its metadata was last fetched, which happens when a meeting is published
+    before its end time is set.
+
+    :return: Previous end time, if ``current`` is the same video with the same start but a later end. Otherwise None.
+    """
+    if previous.video_id != current.video_id or previous.start_ts != current.start_ts:
+        return None
+    if not previous.end_ts or not current.end_ts:
+        return None
+    if pendulum.parse(current.end_ts) > pendulum.parse(previous.end_ts):
+        return previous.end_ts
+    return None
+
+
 def yaml_dump(obj, file_path, width=120):
     with open(file_path, 'w') as outf:
         yaml.dump(obj, outf, width=width)
@@ -0,0 +1,170 @@
+"""
+Adaptive limits on the number of in-flight requests to a host.
+"""
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Status codes that mean the server wants us to slow down.
+THROTTLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AimdController(object):
+    """
+    Additive-increase/multiplicative-decrease controller for concurrent requests to one host.
+
+    The limit grows by about one request per window of completed requests while latency and throughput hold up.
+    It is cut multiplicatively when the server throttles us (429/5xx), when latency climbs well above the best
+    latency among recent responses, or when a larger window did not buy more throughput. After a cut, further cuts
+    are ignored until as many responses as the new limit have come back, throttled or not, so one burst of errors
+    only counts once, but throttling that keeps up keeps cutting.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64, decrease=0.5, latency_tolerance=3.0, latency_samples=100,
+                 base_backoff=0.5, max_backoff=30.0):
+        """
+        :param initial: Starting number of concurrent requests.
+        :param minimum: Lowest the limit may go.
+        :param maximum: Highest the limit may go.
+        :param decrease: Factor to multiply the limit by when backing off.
+        :param latency_tolerance: Back off when latency exceeds the best recent latency by this factor.
+        :param latency_samples: Number of most recent responses whose best latency is the baseline.
+        :param base_backoff: Seconds to wait before retrying the first throttled request.
+        :param max_backoff: Upper bound on the wait before retrying a throttled request.
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._completed = 0
+        self._responses = 0
+        self._cooldown_until = 0
+        self._window_started_at = 0
+        self._consecutive_throttles = 0
+        self._recent_latencies = deque(maxlen=latency_samples)
+        self._window_bytes = 0
+        self._window_elapsed = 0.0
+        self._last_throughput = None
+        self.throughput = 0.0
+        self.num_throttled = 0
+
+    @property
+    def limit(self):
+        """
+        Current number of requests allowed in flight.
+        """
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def try_acquire(self):
+        with self._condition:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record_success(self, latency, size, elapsed=None):
+        """
+        :param latency: Seconds until the response's headers arrived, which doesn't depend on the size of the body.
+        :param size: Bytes received.
+        :param elapsed: Seconds taken by the whole request, including the body. Defaults to ``latency``.
+        """
+        with self._condition:
+            self._completed += 1
+            self._responses += 1
+            self._consecutive_throttles = 0
+            self._recent_latencies.append(latency)
+
+            self._window_bytes += size
+            self._window_elapsed += latency if elapsed is None else elapsed
+            if latency > min(self._recent_latencies) * self.latency_tolerance:
+                self._cut()
+            elif self._completed - self._window_started_at >= self.limit:
+                self._end_window()
+            else:
+                self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def record_throttle(self):
+        """
+        Record a throttled request and cut the limit.
+
+        :return: Seconds to wait before retrying, with jitter so retries don't arrive together.
+        """
+        with self._condition:
+            self.num_throttled += 1
+            self._responses += 1
+            self._consecutive_throttles += 1
+            self._cut()
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self._consecutive_throttles - 1))
+            return random.uniform(backoff / 2, backoff)
+
+    def _end_window(self):
+        # Average bytes per second per request slot over the window, scaled by the limit.
+        throughput = self._window_bytes / self._window_elapsed * self._limit if self._window_elapsed else 0.0
+        self.throughput = throughput
+        if self._last_throughput and throughput < self._last_throughput * 0.9:
+            self._cut()
+        else:
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+            self._last_throughput = throughput
+            self._start_window()
+
+    def _cut(self):
+        if self._responses < self._cooldown_until:
+            return
+        self._limit = max(self.minimum, self._limit * self.decrease)
+        # Responses to requests sent before the cut don't count against the new limit.
+        self._cooldown_until = self._responses + self.limit
+        self._last_throughput = None
+        self._start_window()
+
+    def _start_window(self):
+        self._window_started_at = self._completed
+        self._window_bytes = 0
+        self._window_elapsed = 0.0
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def controller_for(host, **kwargs):
+    """
+    Get the controller shared by all requests to a host with the same settings, creating it with ``kwargs`` if needed.
+    Requests made with other settings, like a different maximum, get a controller of their own.
+    """
+    key = (host, tuple(sorted(kwargs.items())))
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AimdController(**kwargs)
+        return _controllers[key]
@@ -1,9 +1,15 @@
 import json
 import os
 import shutil
+import sys
+import tempfile
+import time
+import traceback
 from collections import namedtuple
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from concurrent.futures import as_completed
+from functools import partial
 from itertools import groupby
 
 import boto3
@@ -14,27 +20,56 @@ import click
 import pendulum
 from tqdm import tqdm
 
-from common import VideoProvider, yaml_dump, yaml_load, build_substitutions_dict, tweak_metadata
+from common import SegmentedVideoProvider, VideoProvider, yaml_dump, yaml_load, build_substitutions_dict, \
+    tweak_metadata, extended_end
 from config import get_config
 from granicus import GranicusScraperApi
 from insinc import InsIncScraperApi
 from neulion import NeulionScraperApi
+from scheduler import DownloadScheduler
+from transport import enable_dns_cache, get_transport
 from oauth import load_client_credentials, obtain_user_code, poll_for_authorization, tokens_file_for_id
 from youtube import YouTubeSession, build_youtube_resource
 
 METADATA_DIR = 'metadata'
 DOWNLOADS_DIR = 'downloads'
 VIDEOS_DIR = 'videos'
+CACHE_DIR = 'cache'
 
 
 def get_provider_obj(config) -> VideoProvider:
     provider = config['provider']
+    cache_dir = os.path.join(CACHE_DIR, config['id'])
     if provider == 'insinc':
-        return InsIncScraperApi(config['url'])
+        return InsIncScraperApi(config['url'], cache_dir=cache_dir)
     elif provider == 'neulion':
-        return NeulionScraperApi(config['url'])
+        return NeulionScraperApi(config['url'], cache_dir=cache_dir)
     elif provider == 'granicus':
-        return GranicusScraperApi(config['url'])
+        return GranicusScraperApi(config['url'], cache_dir=cache_dir)
+
+
+def print_cache_stats(provider):
+    if provider.http_cache:
+        print("Response cache: {hits} hits, {revalidated} revalidated, {misses} misses".format(
+            **provider.http_cache.stats()))
+
+
+def parse_priorities(priorities):
+    """
+    :param priorities: Strings like '1234=4', of a video ID and its share of the download pool.
+    :return: Dict of video ID to share.
+    """
+    parsed = {}
+    for priority in priorities:
+        video_id, _, share = priority.rpartition('=')
+        try:
+            share = float(share)
+        except ValueError:
+            share = 0
+        if not video_id or share <= 0:
+            raise click.BadParameter("{} isn't like VIDEO_ID=SHARE".format(priority), param_hint='--priority')
+        parsed[video_id] = share
+    return parsed
 
 
 def parse_date_range(for_dates):
@@ -51,6 +86,8 @@ def parse_dates(for_dates) -> Iterable[pendulum.Date]:
 @click.pass_context
 def cli(ctx, config):
     ctx.obj = get_config(config)
+    # Downloads open many connections to a few hosts, so looking them up each time is wasted.
+    enable_dns_cache()
 
 
 @cli.command(help='Query for dates with videos available.')
@@ -62,12 +99,14 @@ def dates(config, start_date, end_date):
     provider = get_provider_obj(config)
     dt = provider.available_dates(start_date, end_date)
     print('Available dates:\n' + '\n'.join(d.isoformat() for d in dt))
+    print_cache_stats(provider)
 
 
 @cli.command(help='Download metadata for videos on the given dates.')
 @click.argument('for_dates')
+@click.option('--jobs', default=1, help='Dates to fetch metadata for at the same time.')
 @click.pass_obj
-def metadata(config, for_dates):
+def metadata(config, for_dates, jobs):
     provider = get_provider_obj(config)
     if '..' in for_dates:
         start_date, end_date = parse_date_range(for_dates)
@@ -79,24 +118,57 @@ def metadata(config, for_dates):
     if not os.path.exists(project_metadata_dir):
         os.makedirs(project_metadata_dir)
 
-    for dt in for_dates:
-        print(dt.to_date_string())
-        metadata_path = os.path.join(project_metadata_dir, dt.to_date_string() + '.yaml')
-        date_metadata = list(provider.get_metadata(dt))
-        if not date_metadata:
-            print("No available videos for " + dt.to_date_string())
-            continue
-        yaml_dump(date_metadata, metadata_path)
-        with open(metadata_path) as inf:
-            print(inf.read())
+    def fetch(dt):
+        return dt, list(provider.get_metadata(dt))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Dates are fetched concurrently, but written and printed in order.
+        for dt, date_metadata in executor.map(fetch, for_dates):
+            save_date_metadata(project_metadata_dir, dt, date_metadata)
+    print_cache_stats(provider)
+
+
+def save_date_metadata(project_metadata_dir, dt, date_metadata):
+    print(dt.to_date_string())
+    metadata_path = os.path.join(project_metadata_dir, dt.to_date_string() + '.yaml')
+    if not date_metadata:
+        print("No available videos for " + dt.to_date_string())
+        return
+    yaml_dump(date_metadata, metadata_path)
+    with open(metadata_path) as inf:
+        print(inf.read())
 
 
 @cli.command(help='Download videos for the specified dates. Metadata must be downloaded first.')
 @click.argument('for_dates')
 @click.option('--threads', default=4)
+@click.option('--mms-connections', default=1,
+              help='Download each InsInc stream in this many time ranges at once, and stitch them together.')
+@click.option('--segment-threads', default=16, help='Segment download threads shared by all clips.')
+@click.option('--engine', type=click.Choice(['threads', 'asyncio']), default='threads',
+              help='How to fetch video segments. Not used for InsInc.')
+@click.option('--per-host', default=64, help='Concurrent segment requests per host, for the asyncio engine.')
+@click.option('--stream', is_flag=True, default=False,
+              help='Pipe segments into the finished video while downloading. Granicus only.')
+@click.option('--adaptive', is_flag=True, default=False,
+              help='Adjust concurrent segment requests per host to what the server sustains.')
+@click.option('--max-concurrency', default=64,
+              help='Upper bound on concurrent segment requests per host, with --adaptive.')
+@click.option('--storage', type=click.Choice(['files', 'pack']), default='files',
+              help='Save each segment as its own file, or append segments to one pack file per clip.')
+@click.option('--subclip', default=None,
+              help='Only download the agenda item whose title contains this text. Neulion only.')
+@click.option('--timecode', default=None,
+              help='Only download this range of each root clip, like 01:02:03-01:30:00. Neulion only.')
+@click.option('--priority', multiple=True,
+              help='Give a video a bigger share of segment threads, like 1234=4 for four times the default share. '
+                   'May be given more than once.')
 @click.pass_obj
-def download(config, for_dates, threads):
+def download(config, for_dates, threads, mms_connections, segment_threads, engine, per_host, stream, adaptive,
+             max_concurrency, storage, subclip, timecode, priority):
     provider = get_provider_obj(config)
+    if (subclip or timecode) and config['provider'] != 'neulion':
+        raise click.UsageError("--subclip and --timecode need segments with timestamps, which only Neulion has")
     metadata_dir = os.path.join(METADATA_DIR, config['id'])
     if '..' in for_dates:
         start_date, end_date = parse_date_range(for_dates)
@@ -113,9 +185,17 @@ def download(config, for_dates, threads):
             date_metadata_path = os.path.join(metadata_dir, dt.to_date_string() + '.yaml')
             if not os.path.exists(date_metadata_path):
                 raise ValueError("No metadata downloaded for " + dt.to_date_string())
-            yield yaml_load(date_metadata_path)
-
-    if config['provider'] == 'insinc':
+            date_metadata = yaml_load(date_metadata_path)
+            if subclip or timecode:
+                # Subclips are downloaded to their own directories, as videos of their own.
+                date_metadata = [clip for clip in (provider.subclip(root, subclip, timecode) for root in date_metadata)
+                                 if clip]
+                if not date_metadata:
+                    print("No subclip of {} matches '{}'".format(dt.to_date_string(), subclip))
+            yield date_metadata
+
+    if not isinstance(provider, SegmentedVideoProvider):
+        # Videos that aren't segmented, like InsInc's MMS streams, are downloaded whole.
         futures = []
         with ThreadPoolExecutor(max_workers=threads) as executor:
             for date_metadata in load_date_metadata():
@@ -126,59 +206,195 @@ def download(config, for_dates, threads):
                         os.makedirs(dest)
                     print("Starting task to save {} to {}".format(mms_url, dest))
                     yaml_dump(video_metadatas, os.path.join(dest, '_metadata.yaml'))
-                    futures.append(executor.submit(provider.download, mms_url, dest))
+                    futures.append(executor.submit(provider.download, mms_url, dest, connections=mms_connections))
             progressbar = tqdm(total=len(futures), dynamic_ncols=True)
             for future in as_completed(futures):
                 future.result()
                 progressbar.update()
             progressbar.close()
+    elif engine == 'threads' and not stream:
+        # Segments from every root clip on every date share one pool of download threads.
+        scheduler = DownloadScheduler(workers=max_concurrency if adaptive else segment_threads, adaptive=adaptive,
+                                      storage=storage)
+        priorities = parse_priorities(priority)
+        for date_metadata in load_date_metadata():
+            for root in date_metadata:
+                dest = os.path.join('downloads', config['id'], root.video_id)
+                if not os.path.exists(dest):
+                    os.makedirs(dest)
+                print("Queueing task to save {} to {}".format(root.url, dest))
+                save_root_metadata(root, dest)
+                scheduler.add(root.video_id, partial(provider.segment_urls, root.url), dest,
+                              priorities.get(root.video_id, 1))
+        scheduler.run()
+        print("Segment connections: {connections} opened, {reused} of {requests} requests reused one".format(
+            **get_transport('segments').stats()))
     else:
+        download_kwargs = {}
+        if engine == 'asyncio':
+            download_kwargs.update(engine=engine, workers=per_host)
+        if adaptive:
+            download_kwargs.update(adaptive=True, workers=max_concurrency)
         for date_metadata in load_date_metadata():
             for root in date_metadata:
                 dest = os.path.join('downloads', config['id'], root.video_id)
                 if not os.path.exists(dest):
                     os.makedirs(dest)
                 print("Starting task to save {} to {}".format(root.url, dest))
-                yaml_dump([root], os.path.join(dest, '_metadata.yaml'))
-                provider.download(root.url, dest)
+                save_root_metadata(root, dest)
+                if stream:
+                    if not os.path.exists(VIDEOS_DIR):
+                        os.makedirs(VIDEOS_DIR)
+                    video_path = os.path.join(VIDEOS_DIR, provider.output_filename(root))
+                    provider.download(root.url, dest, stream_to=video_path, mono=config.get('audio_mono', False),
+                                      **download_kwargs)
+                else:
+                    provider.download(root.url, dest, storage=storage, **download_kwargs)
+
+
+def save_root_metadata(root, dest):
+    metadata_path = os.path.join(dest, '_metadata.yaml')
+    if os.path.isfile(metadata_path):
+        previous_end = extended_end(yaml_load(metadata_path)[0], root)
+        if previous_end:
+            # Segments already in the journal are skipped, so only the ones after the previous end are fetched.
+            print("{} now ends at {} instead of {}, downloading the rest".format(
+                root.video_id, root.end_ts, previous_end))
+    yaml_dump([root], metadata_path)
 
 
 @cli.command(help='Do any needed post-processing for downloaded videos.')
 @click.option('--delete-after', default=False)
 @click.option('--startswith', help='Process directories starting with this text.', default=None)
+@click.option('--jobs', default=1, help='Download directories to post-process at the same time.')
+@click.option('--mono-chunks', default=1,
+              help='With audio_mono, encode the audio in this many chunks at the same time. '
+                   '0 for one per CPU core, shared between --jobs.')
+@click.option('--smart-cut', is_flag=True, default=False,
+              help='Start clips exactly on time, re-encoding the frames up to the first keyframe. InsInc only. '
+                   "Usually falls back to cutting from the keyframe before, since ffmpeg's encoders rarely set up "
+                   'the codec the same way as the source.')
 @click.pass_obj
-def process(config, delete_after, startswith):
-    yt_config = config['youtube']
-    provider = get_provider_obj(config)
-
+def process(config, delete_after, startswith, jobs, mono_chunks, smart_cut):
     project_dir = os.path.join(DOWNLOADS_DIR, config['id'])
+    download_dirs = []
     for download_dir in filter(lambda d: not d.startswith('_'), sorted(os.listdir(project_dir))):
         if startswith and not download_dir.startswith(startswith):
             continue
         download_dir = os.path.join(project_dir, download_dir)
-        if not os.path.isdir(download_dir):
-            continue
-
-        metadatas = yaml_load(os.path.join(download_dir, '_metadata.yaml'))
-        mono = config.get('audio_mono', False)
-        for video_metadata in metadatas:
-            prepped_video_info = provider.postprocess(video_metadata, download_dir, VIDEOS_DIR, mono=mono)
-            prepped_video_info.config_id = config['id']
-
-            overrides = tweak_metadata(config['id'], prepped_video_info.video_metadata)
-            subs = build_substitutions_dict(prepped_video_info.video_metadata)
-            subs.update(overrides)
-
-            prepped_video_info.title = yt_config['title'].format(**subs)
-            prepped_video_info.description = yt_config['desc'].format(**subs).strip()
-            prepped_video_info.playlists = [pl.format(**subs) for pl in yt_config['playlists']]
-
-            prepped_video_info_path = os.path.join(VIDEOS_DIR, prepped_video_info.video_filename + '.yaml')
-            yaml_dump(prepped_video_info, prepped_video_info_path)
-            print("Updated " + prepped_video_info_path)
-        if delete_after:
-            print("Deleting " + project_dir)
-            shutil.rmtree(project_dir)
+        if os.path.isdir(download_dir):
+            download_dirs.append(download_dir)
+
+    mono_chunks = job_mono_chunks(mono_chunks, jobs)
+    start_time = time.monotonic()
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as executor:
+        run = partial(process_download_dir_result, config, delete_after=delete_after, mono_chunks=mono_chunks,
+                      smart_cut=smart_cut, capture=executor is not None)
+        # Each directory's output is printed in one piece, in directory order.
+        for result in (executor.map if executor else map)(run, download_dirs):
+            print(result.output, end='', flush=True)
+            results.append(result)
+
+    failed = [result for result in results if result.error]
+    print("Processed {} download directories into {} videos in {:.0f} seconds".format(
+        len(results) - len(failed), sum(len(result.prepared_paths) for result in results),
+        time.monotonic() - start_time))
+    for result in failed:
+        print("Failed to process {}:\n{}".format(result.download_dir, result.error))
+    if failed:
+        raise click.ClickException("{} download directories failed".format(len(failed)))
+
+
+def job_mono_chunks(mono_chunks, jobs):
+    """
+    :param mono_chunks: Chunks to encode audio in at the same time, or 0 for one per CPU core.
+    :return: Chunks for each of ``jobs`` concurrent jobs, so together they start about one encoder per CPU core.
+    """
+    if mono_chunks or jobs < 2:
+        return mono_chunks
+    return max(1, (os.cpu_count() or 1) // jobs)
+
+
+ProcessResult = namedtuple('ProcessResult', ['download_dir', 'prepared_paths', 'output', 'error'])
+
+
+def process_download_dir(config, download_dir, delete_after=False, mono_chunks=1, smart_cut=False):
+    """
+    Post-process the videos in one download directory, and write their prepared metadata.
+
+    :return: Paths of the prepared metadata files.
+    """
+    yt_config = config['youtube']
+    provider = get_provider_obj(config)
+    prepared_paths = []
+
+    metadatas = yaml_load(os.path.join(download_dir, '_metadata.yaml'))
+    mono = config.get('audio_mono', False)
+    for prepped_video_info in provider.postprocess_all(metadatas, download_dir, VIDEOS_DIR, mono=mono,
+                                                       mono_chunks=mono_chunks, smart_cut=smart_cut):
+        prepped_video_info.config_id = config['id']
+
+        overrides = tweak_metadata(config['id'], prepped_video_info.video_metadata)
+        subs = build_substitutions_dict(prepped_video_info.video_metadata)
+        subs.update(overrides)
+
+        prepped_video_info.title = yt_config['title'].format(**subs)
+        prepped_video_info.description = yt_config['desc'].format(**subs).strip()
+        prepped_video_info.playlists = [pl.format(**subs) for pl in yt_config['playlists']]
+
+        prepped_video_info_path = os.path.join(VIDEOS_DIR, prepped_video_info.video_filename + '.yaml')
+        yaml_dump(prepped_video_info, prepped_video_info_path)
+        print("Updated " + prepped_video_info_path)
+        prepared_paths.append(prepped_video_info_path)
+    if delete_after:
+        print("Deleting " + download_dir)
+        shutil.rmtree(download_dir)
+    return prepared_paths
+
+
+def process_download_dir_result(config, download_dir, delete_after=False, mono_chunks=1, smart_cut=False,
+                                capture=False):
+    """
+    Run :func:`process_download_dir`, keeping a failure in the result so the other directories still get processed.
+
+    :param capture: Capture everything it and the ffmpeg processes it starts print, instead of printing it as it goes,
+                    so output from concurrent jobs isn't interleaved.
+    :return: :class:`ProcessResult`, with the traceback as ``error`` if processing failed.
+    """
+    prepared_paths, error = [], None
+    output = []
+    with captured_output(output) if capture else nullcontext():
+        try:
+            prepared_paths = process_download_dir(config, download_dir, delete_after, mono_chunks, smart_cut)
+        except Exception:
+            error = traceback.format_exc()
+    return ProcessResult(download_dir, prepared_paths, ''.join(output), error)
+
+
+@contextmanager
+def captured_output(output):
+    """
+    Send stdout and stderr, including those of child processes, to a temporary file while in this context.
+
+    :param output: List to append what was printed to.
+    """
+    with tempfile.TemporaryFile() as log_file:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = os.dup(1), os.dup(2)
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in enumerate(saved_fds, start=1):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+            log_file.seek(0)
+            output.append(log_file.read().decode('utf8', errors='replace'))
 
 
 @cli.group()
@@ -0,0 +1,168 @@
+"""
+Downmix the audio of a long video to mono in chunks that are encoded at the same time.
+
+The audio is decoded and downmixed once, which is cheap, into uncompressed samples that can be cut anywhere exactly.
+Encoding to AAC is the slow part, so the track is split into chunks whose boundaries fall on the AAC frame grid of
+the whole track, and each chunk is encoded by its own ffmpeg process. A chunk is encoded starting a little before
+its boundaries and ending a little after, and the frames outside it are then cut off. This drops the encoder's
+priming, and the frames on either side of a seam are encoded from the same signal, so they overlap cleanly when
+decoded. The kept frames are joined back to back, so the track has exactly as many samples as the original, and is
+muxed with the video copied from the segments.
+"""
+import codecs
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import check_call
+
+from ffmpeg import AAC_ENCODER_ARGS, MONO_FILTER, ffmpeg_concat, get_temp_destination
+
+AAC_FRAME_SAMPLES = 1024
+# Seconds of audio encoded on either side of a chunk and cut off afterwards.
+CHUNK_OVERLAP = 1.0
+# Audio shorter than this per chunk isn't worth splitting.
+MIN_CHUNK_DURATION = 5 * 60
+
+
+def ffmpeg_concat_mono(concat_file, video_out, chunks=1):
+    """
+    Concatenate segments into one video, downmixing the audio to mono.
+
+    :param chunks: Number of chunks to encode the audio in at the same time, or 0 for one per CPU core.
+    """
+    chunks = chunks or os.cpu_count() or 1
+    if chunks > 1:
+        ffmpeg_concat_mono_chunked(concat_file, video_out, chunks)
+    else:
+        ffmpeg_concat(concat_file, video_out, mono=True)
+
+
+def ffmpeg_concat_mono_chunked(concat_file, video_out, chunks, loglevel='warning'):
+    """
+    Like :func:`ffmpeg.ffmpeg_concat` with ``mono=True``, but encodes the audio in chunks in parallel.
+
+    :param chunks: Number of chunks to encode at the same time.
+    """
+    tmp_video_out = get_temp_destination(video_out)
+    work_dir = tempfile.mkdtemp(prefix='_downmix_', dir=os.path.dirname(os.path.abspath(video_out)))
+    concat_input = ['-protocol_whitelist', 'file,subfile', '-safe', '0', '-f', 'concat', '-i', concat_file]
+    try:
+        # Wave64, since a long meeting's samples can outgrow what WAV can address.
+        pcm_path = os.path.join(work_dir, 'mono.w64')
+        check_call(['ffmpeg', '-loglevel', loglevel] + concat_input +
+                   ['-map', '0:a:0', '-af', MONO_FILTER, '-c:a', 'pcm_f32le', '-f', 'w64', pcm_path])
+        sample_rate, num_samples = probe_samples(pcm_path)
+        audio_start = probe_audio_start(concat_file)
+
+        bounds = chunk_bounds(num_samples, sample_rate, chunks)
+        chunks = len(bounds) - 1
+        overlap_frames = math.ceil(CHUNK_OVERLAP * sample_rate / AAC_FRAME_SAMPLES)
+        chunk_paths = [os.path.join(work_dir, 'chunk{}.aac'.format(i)) for i in range(chunks)]
+
+        print("Encoding {:.0f} seconds of mono audio in {} chunks".format(num_samples / sample_rate, chunks))
+        with ThreadPoolExecutor(max_workers=chunks) as executor:
+            futures = [executor.submit(encode_chunk, pcm_path, sample_rate, start, end, overlap_frames, path,
+                                       loglevel)
+                       for start, end, path in zip(bounds, bounds[1:], chunk_paths)]
+            chunk_frames = [future.result() for future in futures]
+
+        aac_path = os.path.join(work_dir, 'mono.aac')
+        with open(aac_path, 'wb') as aac:
+            for frames in chunk_frames:
+                aac.write(frames)
+
+        # The encoded track starts where the original audio did, relative to the video.
+        check_call(['ffmpeg', '-loglevel', loglevel] + concat_input +
+                   ['-itsoffset', str(audio_start), '-i', aac_path,
+                    '-map', '0:v', '-map', '1:a', '-c', 'copy', tmp_video_out])
+    finally:
+        shutil.rmtree(work_dir)
+    if os.path.exists(video_out):
+        os.remove(video_out)
+    os.rename(tmp_video_out, video_out)
+
+
+def chunk_bounds(num_samples, sample_rate, chunks):
+    """
+    Split a track into chunks on its AAC frame grid, with no chunk shorter than :data:`MIN_CHUNK_DURATION`.
+
+    :param chunks: Number of chunks wanted.
+    :return: Chunk boundaries, in frames from the start of the track. The last is None, for the rest of the track,
+             so its partial last frame stays in the final chunk.
+    """
+    num_frames = num_samples // AAC_FRAME_SAMPLES
+    chunks = max(1, min(chunks, int(num_samples / sample_rate // MIN_CHUNK_DURATION)))
+    return [num_frames * i // chunks for i in range(chunks)] + [None]
+
+
+def encode_chunk(pcm_path, sample_rate, start, end, overlap_frames, chunk_path, loglevel='warning'):
+    """
+    Encode a chunk of audio to AAC, with some audio on either side for the encoder to settle on.
+
+    :param start: First frame of the chunk.
+    :param end: Frame after the last frame of the chunk, or None for the rest of the track.
+    :return: ADTS bytes of the frames that make up the chunk.
+    """
+    preroll = min(start, overlap_frames)
+    cmd = ['ffmpeg', '-loglevel', loglevel]
+    if start - preroll:
+        cmd.extend(['-ss', frames_to_seconds(start - preroll, sample_rate)])
+    cmd.extend(['-i', pcm_path])
+    if end is not None:
+        cmd.extend(['-t', frames_to_seconds(end - start + preroll + overlap_frames, sample_rate)])
+    cmd.extend(AAC_ENCODER_ARGS + ['-f', 'adts', chunk_path])
+    check_call(cmd)
+
+    with open(chunk_path, 'rb') as chunk:
+        frames = list(adts_frames(chunk.read()))
+    # The encoder emits one frame of priming first, so the frame encoding input frame n is frame n + 1.
+    first = preroll + 1
+    last = None if end is None else first + end - start
+    if last is not None and len(frames) < last:
+        raise ValueError("{} has {} frames, but at least {} were expected".format(chunk_path, len(frames), last))
+    return b''.join(frames[first:last])
+
+
+def frames_to_seconds(frames, sample_rate):
+    return '{:.6f}'.format(frames * AAC_FRAME_SAMPLES / sample_rate)
+
+
+def adts_frames(data):
+    """
+    Split raw ADTS AAC into its frames.
+    """
+    offset = 0
+    while offset + 7 <= len(data):
+        if data[offset] != 0xFF or data[offset + 1] & 0xF0 != 0xF0:
+            raise ValueError("Lost ADTS sync at byte {}".format(offset))
+        length = ((data[offset + 3] & 0x03) << 11) | (data[offset + 4] << 3) | (data[offset + 5] >> 5)
+        yield data[offset:offset + length]
+        offset += length
+
+
+def probe_samples(pcm_path):
+    """
+    :return: Tuple of sample rate, and number of samples per channel, of uncompressed audio.
+    """
+    result = subprocess.check_output(['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+                                      '-show_entries', 'stream=sample_rate,duration_ts',
+                                      '-of', 'default=noprint_wrappers=1', pcm_path])
+    values = dict(line.split('=', 1) for line in codecs.decode(result, 'utf8').split())
+    return int(values['sample_rate']), int(values['duration_ts'])
+
+
+def probe_audio_start(concat_file):
+    """
+    :return: Seconds from the start of the concatenated segments to their first audio packet.
+             ffmpeg keeps this offset between the streams when muxing.
+    """
+    result = subprocess.check_output(['ffprobe', '-v', 'error', '-protocol_whitelist', 'file,subfile',
+                                      '-safe', '0', '-f', 'concat', '-select_streams', 'a:0',
+                                      '-show_entries', 'stream=start_time:format=start_time', '-of', 'json',
+                                      concat_file])
+    probed = json.loads(codecs.decode(result, 'utf8'))
+    return float(probed['streams'][0]['start_time']) - float(probed['format']['start_time'])
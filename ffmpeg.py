@@ -1,7 +1,12 @@
 import codecs
+import json
 import os
 import subprocess
-from subprocess import check_call
+import tempfile
+from contextlib import contextmanager
+from subprocess import check_call, CalledProcessError, Popen, PIPE
+
+from media_duration import media_duration
 
 
 def tempfile_suffix(original_path):
@@ -18,48 +23,221 @@ def get_temp_destination(original_path):
     return temp_destination
 
 
-def download_mms(mms_url, destination_path):
-    mms_url = mms_url.replace('mms://', 'mmsh://')
-    temp_path = get_temp_destination(destination_path)
-    check_call(['ffmpeg', '-loglevel', 'error', '-i', mms_url, '-c', 'copy', temp_path])
-    os.rename(temp_path, destination_path)
+# Seconds before a cut to seek the input to. Seeking in some formats, like ASF, lands a little before where was asked.
+SEEK_MARGIN = 10
+
+
+def seek_args(ss):
+    """
+    Input options to skip most of a video before a cut at ``ss`` seconds.
+    Timestamps are kept as they are in the source, so output options can cut at exact positions in it.
+    """
+    return ['-ss', str(max(0, ss - SEEK_MARGIN)), '-copyts']
+
+
+def cut_args(ss, to):
+    """
+    Output options to copy the packets from ``ss`` to ``to`` seconds into the source, with the clip starting at zero.
+    """
+    return ['-map', '0', '-ss', str(ss), '-to', str(to), '-c', 'copy', '-output_ts_offset', str(-ss)]
 
 
 def clip_video(video_path, ss, to, destination_path):
+    """
+    Cut a clip out of a video, copying streams. The clip should start on a keyframe.
+
+    :param ss: Start of the clip in seconds.
+    :param to: End of the clip in seconds.
+    """
     temp_path = get_temp_destination(destination_path)
-    check_call(['ffmpeg', '-loglevel', 'error', '-i', video_path, '-ss', ss, '-c', 'copy', '-to', to, temp_path])
+    check_call(['ffmpeg', '-loglevel', 'error'] + seek_args(ss) + ['-i', video_path] + cut_args(ss, to) + [temp_path])
     os.rename(temp_path, destination_path)
 
 
+def split_video(video_path, clips):
+    """
+    Cut several clips out of one video in a single pass, so the source is only read once.
+
+    :param clips: List of (start seconds, end seconds, destination path).
+    """
+    cmd = ['ffmpeg', '-loglevel', 'error'] + seek_args(min(ss for ss, _, _ in clips)) + ['-i', video_path]
+    temp_paths = []
+    for ss, to, destination_path in clips:
+        temp_path = get_temp_destination(destination_path)
+        temp_paths.append(temp_path)
+        # Output options apply to the output that follows them, so each clip gets its own range.
+        cmd.extend(cut_args(ss, to) + [temp_path])
+    check_call(cmd)
+    for temp_path, (_, _, destination_path) in zip(temp_paths, clips):
+        os.rename(temp_path, destination_path)
+
+
 def ffmpeg_concat(concat_file, video_out, mono=False, loglevel='warning'):
     # http://stackoverflow.com/questions/7333232/concatenate-two-mp4-files-using-ffmpeg
     # http://superuser.com/questions/924364/ffmpeg-how-to-convert-stereo-to-mono-using-audio-pan-filter
-    tmp_video_out = video_out.replace('.mp4', '.tmp.mp4')
-    for check_existing in (tmp_video_out, video_out):
-        if os.path.exists(check_existing):
-            os.remove(check_existing)
+    # Named after the output, so concurrent jobs writing different videos never share a temp file.
+    tmp_video_out = get_temp_destination(video_out)
+    if os.path.exists(video_out):
+        os.remove(video_out)
 
-    cmd = ['ffmpeg', '-loglevel', loglevel, '-safe', '0', '-f', 'concat', '-i', concat_file]
-    if mono:
-        # The encoder 'aac' is experimental but experimental codecs are not enabled, add '-strict -2' if you want to use it.
-        # Must specify AAC encoder or else result is not to spec and will be silent in VLC.
-        cmd.extend(['-c:a', 'aac', '-af', 'pan=mono|c0=c0', '-c:v', 'copy', '-strict', '-2'])
-    else:
-        # '-bsf:a', 'aac_adtstoasc'
-        cmd.extend(['-c', 'copy'])
+    # Segments stored in a pack are listed as subfile URLs, which ffmpeg only follows if whitelisted.
+    cmd = ['ffmpeg', '-loglevel', loglevel, '-protocol_whitelist', 'file,subfile',
+           '-safe', '0', '-f', 'concat', '-i', concat_file]
+    cmd.extend(concat_codec_args(mono))
     cmd.append(tmp_video_out)
     check_call(cmd)
     os.rename(tmp_video_out, video_out)
 
 
+def ffmpeg_append(video_path, tail_path, video_duration, loglevel='warning'):
+    """
+    Append a video to the end of another with the same codecs and parameters, copying streams.
+
+    :param video_duration: Seconds into the result at which ``tail_path`` starts.
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as concat_file:
+        concat_file.write("file '{}'\n".format(os.path.abspath(video_path)))
+        concat_file.write("duration {}\n".format(video_duration))
+        # Anything running past the given duration would overlap the start of the appended video.
+        concat_file.write("outpoint {}\n".format(video_duration))
+        concat_file.write("file '{}'\n".format(os.path.abspath(tail_path)))
+    tmp_video_out = get_temp_destination(video_path)
+    try:
+        check_call(['ffmpeg', '-loglevel', loglevel, '-safe', '0', '-f', 'concat', '-i', concat_file.name,
+                    '-c', 'copy', tmp_video_out])
+    finally:
+        os.remove(concat_file.name)
+    os.replace(tmp_video_out, video_path)
+
+
+# The encoder 'aac' is experimental but experimental codecs are not enabled, add '-strict -2' if you want to use it.
+# Must specify AAC encoder or else result is not to spec and will be silent in VLC.
+AAC_ENCODER_ARGS = ['-c:a', 'aac', '-strict', '-2']
+MONO_FILTER = 'pan=mono|c0=c0'
+
+
+def concat_codec_args(mono):
+    if mono:
+        return AAC_ENCODER_ARGS + ['-af', MONO_FILTER, '-c:v', 'copy']
+    # '-bsf:a', 'aac_adtstoasc'
+    return ['-c', 'copy']
+
+
+@contextmanager
+def ffmpeg_pipe_concat(video_out, input_format='mpegts', mono=False, loglevel='warning'):
+    """
+    Run ffmpeg on a stream written to its stdin, such as MPEG-TS segments joined end to end.
+    The output is only moved into place once ffmpeg has finished successfully.
+
+    :param video_out: Path of the video to produce.
+    :param input_format: ffmpeg format name of the piped stream.
+    :param mono: Downmix audio to mono.
+    :return: Context manager yielding the writable stdin of the ffmpeg process.
+    """
+    tmp_video_out = get_temp_destination(video_out)
+    cmd = ['ffmpeg', '-loglevel', loglevel, '-f', input_format, '-i', 'pipe:0']
+    cmd.extend(concat_codec_args(mono))
+    cmd.append(tmp_video_out)
+    proc = Popen(cmd, stdin=PIPE)
+    try:
+        yield proc.stdin
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        raise
+    proc.stdin.close()
+    return_code = proc.wait()
+    if return_code:
+        raise CalledProcessError(return_code, cmd)
+    if os.path.exists(video_out):
+        os.remove(video_out)
+    os.rename(tmp_video_out, video_out)
+
+
 def ffmpeg_duration(video_path):
     """
-    Get video duration using ffprobe.
+    Get video duration, from the headers of MP4 and MPEG-TS files, or using ffprobe otherwise.
 
     :param video_path: Video to inspect.
     :return: Video duration in float seconds.
     """
+    if os.path.isfile(video_path):
+        duration = media_duration(video_path)
+        if duration is not None:
+            return duration
     result = subprocess.check_output(['ffprobe', '-show_entries', 'format=duration', video_path])
     result = codecs.decode(result, 'utf8')
     result = result[result.find('[FORMAT]'):result.find('[/FORMAT]')]
     return float(result.split('=')[1].strip())
+
+
+def ffprobe_stream_start_times(video_path):
+    """
+    :return: Dict of stream index to the timestamp of its first packet, in float seconds.
+    """
+    result = subprocess.check_output(['ffprobe', '-v', 'error', '-show_entries', 'stream=index,start_time',
+                                      '-of', 'csv=p=0', video_path])
+    start_times = {}
+    for line in codecs.decode(result, 'utf8').split():
+        index, start_time = line.split(',')
+        if start_time != 'N/A':
+            start_times[int(index)] = float(start_time)
+    return start_times
+
+
+def ffprobe_video_stream(video_path):
+    """
+    :return: Dict with the codec name, a hash of the codec's extradata, and the dimensions of the first video stream.
+    """
+    result = subprocess.check_output(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_data_hash', 'CRC32',
+                                      '-show_entries', 'stream=codec_name,extradata_hash,width,height',
+                                      '-of', 'json', video_path])
+    streams = json.loads(codecs.decode(result, 'utf8'))['streams']
+    return streams[0] if streams else {}
+
+
+def ffprobe_keyframe_times(video_path):
+    """
+    Scan every packet of a video's first video stream.
+
+    :return: Timestamps of its keyframes in float seconds, in stream order.
+    """
+    result = subprocess.check_output(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                                      '-show_entries', 'packet=pts_time,dts_time,flags', '-of', 'csv=p=0', video_path])
+    keyframes = []
+    for line in codecs.decode(result, 'utf8').split():
+        pts_time, dts_time, flags = line.split(',')
+        time = pts_time if pts_time != 'N/A' else dts_time
+        if 'K' in flags and time != 'N/A':
+            keyframes.append(float(time))
+    return keyframes
+
+
+def ffprobe_packet_times(video_path, stream_index, start, duration):
+    """
+    :return: Timestamps in float seconds of packets of one stream, read from about ``start`` for ``duration`` seconds.
+    """
+    result = subprocess.check_output(['ffprobe', '-v', 'error', '-select_streams', str(stream_index),
+                                      '-read_intervals', '{}%+{}'.format(start, duration),
+                                      '-show_entries', 'packet=pts_time', '-of', 'csv=p=0', video_path])
+    return [float(line) for line in codecs.decode(result, 'utf8').split() if line != 'N/A']
+
+
+def ffprobe_last_packet_times(video_path):
+    """
+    Scan every packet of a video, including one whose capture was cut off.
+
+    :return: Dict of stream index to the timestamp of its last packet, in float seconds.
+    """
+    result = subprocess.check_output(['ffprobe', '-v', 'error', '-show_entries', 'packet=stream_index,pts_time',
+                                      '-of', 'csv=p=0', video_path])
+    last_times = {}
+    for line in codecs.decode(result, 'utf8').split():
+        stream_index, pts_time = line.split(',')
+        if pts_time != 'N/A':
+            last_times[int(stream_index)] = max(float(pts_time), last_times.get(int(stream_index), 0.0))
+    return last_times
@@ -0,0 +1,94 @@
+"""
+Remember what a video was built from, so post-processing can skip rebuilding it when nothing has changed.
+
+The fingerprint of a build covers the segments that went into it, with their sizes, and the options it was built
+with. It is stored in the download directory along with the size and modification time of the video it produced,
+so a video that was deleted or replaced since is rebuilt too. The number of segments is kept as well, so a video
+whose download has only grown since can be extended instead of rebuilt.
+"""
+import hashlib
+import json
+import os
+
+from segment_tools import segment_ranges
+
+FINGERPRINT_FILENAME = '_fingerprint.json'
+
+
+def fingerprint_inputs(download_dir, **options):
+    """
+    :param options: Anything else the output depends on, like whether audio is downmixed.
+    :return: Hex digest of the downloaded segments and ``options``.
+    """
+    return _digest(segment_ranges(download_dir), options)
+
+
+def streamed_fingerprint(**options):
+    """
+    Fingerprint for a video that was streamed while its segments downloaded, since they may be gone by the time it's
+    post-processed.
+    """
+    return _digest([], dict(options, streamed=True))
+
+
+def _digest(ranges, options):
+    digest = hashlib.sha256()
+    digest.update(json.dumps(options, sort_keys=True).encode('utf8'))
+    for path, offset, length in ranges:
+        digest.update('{}:{}:{}\n'.format(os.path.basename(path), offset, length).encode('utf8'))
+    return digest.hexdigest()
+
+
+def _load(download_dir):
+    path = os.path.join(download_dir, FINGERPRINT_FILENAME)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as inf:
+        return json.load(inf)
+
+
+def _output_stat(video_path):
+    stat = os.stat(video_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def is_up_to_date(download_dir, video_path, fingerprint):
+    """
+    :return: True if ``video_path`` exists, and was built by :func:`record_build` from inputs with this fingerprint.
+    """
+    if not os.path.isfile(video_path):
+        return False
+    build = _load(download_dir).get(os.path.basename(video_path))
+    return _unchanged(build, video_path) and build['inputs'] == fingerprint
+
+
+def built_segments(download_dir, video_path, **options):
+    """
+    :return: Number of segments ``video_path`` was built from with ``options``, if those are still the first segments
+             of the download and the video hasn't changed since. Otherwise 0.
+    """
+    if not os.path.isfile(video_path):
+        return 0
+    build = _load(download_dir).get(os.path.basename(video_path))
+    if not _unchanged(build, video_path) or not build.get('segments'):
+        return 0
+    ranges = segment_ranges(download_dir)[:build['segments']]
+    if len(ranges) < build['segments'] or _digest(ranges, options) != build['inputs']:
+        return 0
+    return build['segments']
+
+
+def _unchanged(build, video_path):
+    return build is not None and {key: build.get(key) for key in ('size', 'mtime_ns')} == _output_stat(video_path)
+
+
+def record_build(download_dir, video_path, fingerprint, num_segments=None):
+    """
+    :param num_segments: Number of segments the video was built from, if it can be extended by appending later ones.
+    """
+    builds = _load(download_dir)
+    builds[os.path.basename(video_path)] = dict(_output_stat(video_path), inputs=fingerprint, segments=num_segments)
+    path = os.path.join(download_dir, FINGERPRINT_FILENAME)
+    with open(path + '.tmp', 'w') as outf:
+        json.dump(builds, outf, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
@@ -1,18 +1,22 @@
+import hashlib
 import json
 import os
 import re
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from datetime import datetime, date
 from urllib.parse import urlparse, parse_qs
 
 import pendulum
 import pytz
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 from typing import Iterable
 
-from common import VideoProvider, VideoMetadata, PreparedVideoInfo
-from ffmpeg import ffmpeg_concat
-from segment_tools import download_clip, write_ffmpeg_concat_file
+from common import SegmentedVideoProvider, VideoMetadata, PreparedVideoInfo
+from downmix import ffmpeg_concat_mono
+from fingerprint import fingerprint_inputs, is_up_to_date, record_build, streamed_fingerprint
+from html_parsing import parse_html
+from journal import DownloadJournal, STREAMED
+from segment_tools import download_clip, write_ffmpeg_concat_file, stream_clip, concat_segments
 
 GranicusVideo = namedtuple('GranicusVideo',
                            ['title', 'date', 'agenda_url', 'minutes_url', 'minutes_url_title', 'video_url'])
@@ -20,6 +24,13 @@ GranicusVideo = namedtuple('GranicusVideo',
 
 Streams = namedtuple('Streams', ['rtmp_url', 'm3u8_url'])
 
+# Seconds to reuse cached responses for. A clip's player page never changes, but where it's streamed from might.
+PLAYER_PAGE_TTL = None
+STREAMS_TTL = 24 * 60 * 60
+
+# The listing page's tables of meetings.
+LISTING_STRAINER = SoupStrainer('table', class_='listingTable')
+
 
 class GranicusVideoMetadata(VideoMetadata):
     def __init__(self, video_id, title, category, start_ts, url, agenda_title, agenda_url, minutes_title, minutes_url):
@@ -30,6 +41,14 @@ class GranicusVideoMetadata(VideoMetadata):
         self.minutes_url = minutes_url
 
 
+def listing_args(video: GranicusVideoMetadata):
+    """
+    :return: Arguments to recreate a video from the listing with.
+    """
+    return [video.video_id, video.title, video.category, video.start_ts, video.url, video.agenda_title,
+            video.agenda_url, video.minutes_title, video.minutes_url]
+
+
 def get_href_parts(td):
     a = td.find('a')
     if not a:
@@ -54,49 +73,131 @@ def uncommented_lines(full_text):
         yield line
 
 
-class GranicusScraperApi(VideoProvider):
+class GranicusScraperApi(SegmentedVideoProvider):
 
-    def __init__(self, site_url, tz='America/Vancouver'):
+    def __init__(self, site_url, tz='America/Vancouver', cache_dir=None):
         """
         :param site_url: The Granicus page with the list of available videos.
+        :param cache_dir: Directory to keep the parsed list of videos and other responses in between runs.
+                          The list is revalidated against the page's ETag or Last-Modified.
+                          If None, the list is only kept for the life of this object.
         """
-        super().__init__(site_url)
+        super().__init__(site_url, cache_dir)
         self.tz = tz
+        self._videos_by_date = None
 
     def available_dates(self, start_date: date, end_date: date) -> Iterable[pendulum.Date]:
-        seen_dates = set()
-        for video in self.get_videos():
-            dt = pendulum.parse(video.start_ts)
-            if start_date <=dt <= end_date and video.start_ts not in seen_dates:
-                seen_dates.add(dt)
+        for videos in self.videos_by_date().values():
+            dt = pendulum.parse(videos[0].start_ts)
+            if start_date <= dt <= end_date:
                 yield dt.date()
 
     def get_metadata(self, for_date) -> Iterable[VideoMetadata]:
-        for video in self.get_videos():
-            if pendulum.parse(video.start_ts).date() != for_date:
-                continue
-            yield video
+        if isinstance(for_date, datetime):
+            for_date = for_date.date()
+        return list(self.videos_by_date().get(for_date, []))
 
-    def download(self, url, destination_dir):
+    def download(self, url, destination_dir, **kwargs):
+        """
+        :param stream_to: If given, pipe segments into this video file while downloading,
+                          instead of keeping them all for :meth:`postprocess`.
+        """
+        stream_to, mono = kwargs.pop('stream_to', None), kwargs.pop('mono', False)
+        segment_urls = self.segment_urls(url)
+        if stream_to:
+            stream_clip(segment_urls, destination_dir, stream_to, kwargs.get('workers', 16), mono=mono,
+                        adaptive=kwargs.get('adaptive', False))
+            record_build(destination_dir, stream_to, streamed_fingerprint(mono=mono))
+        else:
+            download_clip(segment_urls, destination_dir, **kwargs)
+
+    def segment_urls(self, url):
         clip_guid = self.get_clip_id(url)
         streams = self.get_streams(clip_guid)
-        download_clip(self.get_video_piece_urls(streams.m3u8_url), destination_dir, 16)
+        # Resolve the whole playlist now, so this can run ahead of the download that consumes it.
+        return list(self.get_video_piece_urls(streams.m3u8_url))
+
+    def output_filename(self, video_metadata: VideoMetadata):
+        return video_metadata.video_id + '.ts'
 
     def postprocess(self, video_metadata: VideoMetadata, download_dir, destination_dir, **kwargs) -> PreparedVideoInfo:
-        concat_file_path = write_ffmpeg_concat_file(download_dir, None)
-        video_filename = video_metadata.video_id + '.ts'
+        video_filename = self.output_filename(video_metadata)
         video_path = os.path.join(destination_dir, video_filename)
-        ffmpeg_concat(concat_file_path, video_path, mono=kwargs.get('mono', False))
+        mono = kwargs.get('mono', False)
+        if is_up_to_date(download_dir, video_path, streamed_fingerprint(mono=mono)):
+            print(video_path + " was streamed during download")
+            return PreparedVideoInfo(video_metadata, video_filename)
+        if DownloadJournal.exists(download_dir):
+            with DownloadJournal(download_dir) as journal:
+                if journal.count(STREAMED):
+                    raise ValueError("Streaming {} was interrupted, so it has to be downloaded again".format(
+                        video_path))
+
+        fingerprint = fingerprint_inputs(download_dir, mono=mono)
+        if is_up_to_date(download_dir, video_path, fingerprint):
+            print(video_path + " is up to date")
+        else:
+            if mono:
+                concat_file_path = write_ffmpeg_concat_file(download_dir, None)
+                ffmpeg_concat_mono(concat_file_path, video_path, kwargs.get('mono_chunks', 1))
+            else:
+                # MPEG-TS segments join by plain concatenation, so ffmpeg is only needed to re-encode audio.
+                concat_segments(download_dir, video_path)
+            record_build(download_dir, video_path, fingerprint)
 
         return PreparedVideoInfo(video_metadata, video_filename)
 
-    def _parse_html(self, url):
-        resp = self.session.get(url)
-        resp.raise_for_status()
-        return BeautifulSoup(resp.text, 'html.parser')
-
     def get_videos(self):
-        parsed_html = self._parse_html(self.provider_url)
+        for videos in self.videos_by_date().values():
+            yield from videos
+
+    def videos_by_date(self):
+        """
+        The ViewPublisher listing covers years of meetings, so it is fetched and parsed once, and indexed by date.
+
+        :return: Ordered dict of local date to the videos on that date, in listing order.
+        """
+        if self._videos_by_date is None:
+            videos_by_date = OrderedDict()
+            for video in self._load_listing():
+                videos_by_date.setdefault(pendulum.parse(video.start_ts).date(), []).append(video)
+            # Only published once complete, for concurrent callers.
+            self._videos_by_date = videos_by_date
+        return self._videos_by_date
+
+    def _listing_cache_path(self):
+        url_hash = hashlib.sha1(self.provider_url.encode('utf8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, 'granicus_listing_{}.json'.format(url_hash))
+
+    def _load_listing(self):
+        cached = {}
+        if self.cache_dir and os.path.isfile(self._listing_cache_path()):
+            with open(self._listing_cache_path()) as inf:
+                cached = json.load(inf)
+
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        resp = self.session.get(self.provider_url, headers=headers)
+        if resp.status_code == 304 and cached:
+            print("Video listing hasn't changed since it was cached")
+            return [GranicusVideoMetadata(*args) for args in cached['videos']]
+        resp.raise_for_status()
+        videos = list(self._parse_listing(parse_html(resp.text, LISTING_STRAINER)))
+
+        validators = {'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+        if self.cache_dir and any(validators.values()):
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            path = self._listing_cache_path()
+            with open(path + '.tmp', 'w') as outf:
+                json.dump(dict(validators, videos=[listing_args(video) for video in videos]), outf)
+            os.replace(path + '.tmp', path)
+        return videos
+
+    def _parse_listing(self, parsed_html):
         # The second table is the useful one.
         previous_meetings_table = parsed_html.select('table.listingTable')[1]
         for row in previous_meetings_table.find_all('tr'):
@@ -128,7 +229,7 @@ class GranicusScraperApi(VideoProvider):
             )
 
     def get_clip_id(self, video_url):
-        resp = self.session.get(video_url)
+        resp = self.cached_request('GET', video_url, PLAYER_PAGE_TTL)
         resp.raise_for_status()
         match = re.search(r"\s+clipId:\s*'([\w\-]+)',", resp.text)
         return match.group(1)
@@ -136,7 +237,7 @@ class GranicusScraperApi(VideoProvider):
     def get_streams(self, clip_id):
         parsed_site = urlparse(self.provider_url)
         streams_url = '{}://{}/player/GetStreams.php'.format(parsed_site.scheme, parsed_site.netloc)
-        resp = self.session.get(streams_url, params={'clip_id': clip_id})
+        resp = self.cached_request('GET', streams_url, STREAMS_TTL, params={'clip_id': clip_id})
         js_text = resp.text.replace('\/', '/')
         js = json.loads(js_text)
         return Streams(js[0], js[1])
@@ -0,0 +1,22 @@
+"""
+Parse vendor pages with lxml if it's installed, falling back to Python's own, much slower, html.parser.
+
+Scrapers only look at a few elements of each page, so they pass a :class:`bs4.SoupStrainer` to build just those
+elements, instead of a tree of the whole page.
+"""
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+def parse_html(markup, parse_only: SoupStrainer = None, parser=None):
+    """
+    :param parse_only: Only build the elements this matches, and their contents.
+    :param parser: Tree builder to use instead of :data:`HTML_PARSER`.
+    :return: :class:`bs4.BeautifulSoup`.
+    """
+    return BeautifulSoup(markup, parser or HTML_PARSER, parse_only=parse_only)
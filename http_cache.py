@@ -0,0 +1,161 @@
+"""
+On-disk cache of scraper responses, so repeated runs don't fetch pages that haven't changed.
+
+A cached response is reused without asking the server until its time to live runs out. After that, it's revalidated
+with If-None-Match or If-Modified-Since if the server sent an ETag or Last-Modified, and a 304 reply keeps it for
+another time to live. The cache is bounded in size, evicting the least recently used responses first.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+# Bytes of responses to keep on disk.
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class ResponseCache(object):
+
+    def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES):
+        """
+        :param cache_dir: Directory to keep responses in. Created when the first response is stored.
+        :param max_bytes: Size the cache is trimmed to after storing a response.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Cache key to size of its file, least recently used first. Read from the cache directory when first needed.
+        self._entries = None
+
+    def request(self, session, method, url, ttl, **kwargs):
+        """
+        Send a request through ``session``, or answer it from the cache.
+
+        :param ttl: Seconds to reuse a response without asking the server, or None to reuse it until it's evicted.
+        :param kwargs: Arguments to :meth:`requests.Session.request`. ``params`` and ``data`` are part of the cache key.
+        :return: :class:`requests.Response`. Only successful responses are cached.
+        """
+        key = cache_key(method, url, kwargs.get('params'), kwargs.get('data'))
+        entry = self._load(key)
+        now = time.time()
+        if entry and (ttl is None or now - entry['fetched'] < ttl):
+            self._used(key, 'hits')
+            return to_response(entry)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry:
+            if entry['headers'].get('ETag'):
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if entry['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        resp = session.request(method, url, headers=headers, **kwargs)
+        if resp.status_code == 304 and entry:
+            entry['fetched'] = now
+            self._store(key, entry)
+            self._used(key, 'revalidated')
+            return to_response(entry)
+
+        with self._lock:
+            self.misses += 1
+        if resp.status_code == 200:
+            self._store(key, {
+                'url': resp.url,
+                'status': resp.status_code,
+                'headers': dict(resp.headers),
+                'encoding': resp.encoding,
+                # Latin-1 maps every byte to a character, so the body survives the trip through JSON unchanged.
+                'content': resp.content.decode('latin1'),
+                'fetched': now,
+            })
+        return resp
+
+    def stats(self):
+        """
+        :return: Dict with the number of responses reused without a request, revalidated with a 304, and fetched.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _load(self, key):
+        try:
+            with open(self._path(key)) as inf:
+                return json.load(inf)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, entry):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'w') as outf:
+            json.dump(entry, outf)
+        os.replace(temp_path, path)
+        with self._lock:
+            entries = self._get_entries()
+            entries[key] = os.path.getsize(path)
+            entries.move_to_end(key)
+            self._evict(entries)
+
+    def _used(self, key, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            entries = self._get_entries()
+            if key in entries:
+                entries.move_to_end(key)
+        # The modification time orders entries by last use for later runs.
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _get_entries(self):
+        if self._entries is None:
+            files = []
+            if os.path.isdir(self.cache_dir):
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, entry.name[:-len('.json')], stat.st_size))
+            self._entries = OrderedDict((key, size) for _, key, size in sorted(files))
+        return self._entries
+
+    def _evict(self, entries):
+        total = sum(entries.values())
+        while total > self.max_bytes and len(entries) > 1:
+            key, size = entries.popitem(last=False)
+            total -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+def cache_key(method, url, params=None, data=None):
+    request = json.dumps([method.upper(), url, params, data], sort_keys=True, default=str)
+    return hashlib.sha1(request.encode('utf8')).hexdigest()
+
+
+def to_response(entry):
+    """
+    Rebuild a :class:`requests.Response` from a cached entry.
+    """
+    resp = Response()
+    resp.url = entry['url']
+    resp.status_code = entry['status']
+    resp.reason = 'OK'
+    resp.headers = CaseInsensitiveDict(entry['headers'])
+    resp.encoding = entry['encoding']
+    resp._content = entry['content'].encode('latin1')
+    return resp
@@ -1,16 +1,35 @@
 import os
 import re
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
 from itertools import groupby, chain
 
 import pendulum
 import yaml
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 
 from common import VideoProvider, VideoMetadata, TimeCode, adjust_timecode, timecode_to_seconds, PreparedVideoInfo, \
     is_root_clip, group_root_and_subclips, shift_timecodes
-from ffmpeg import download_mms, clip_video
+from ffmpeg import clip_video, ffmpeg_duration, split_video
+from html_parsing import parse_html
+from keyframe_index import KeyframeIndex
+from smart_cut import smart_clip_video
+from mms_capture import download_mms
+
+
+# Seconds to reuse cached search results for. Recordings are published some time after a meeting.
+CALENDAR_TTL = 60 * 60
+CLIPS_TTL = 60 * 60
+# Days after the end of a month that recordings from it may still be published. After that, its calendar is final.
+PUBLISHING_DELAY = 7
+# Months of calendars to fetch at once.
+MONTH_SCAN_THREADS = 8
+
+# Rows of search results.
+CLIPS_STRAINER = SoupStrainer('tr')
+# Suffix of the file next to a clip that records where in its stream the clip starts.
+CLIP_START_SUFFIX = '.start'
 
 
 class InsIncVideoClip(object):
@@ -26,14 +45,52 @@ class InsIncVideoClip(object):
         return "{}: '{} ({:%Y-%m-%d} at {})'".format(self.category, self.title, self.for_date, self.start_time)
 
 
+def existing_clip_start(video_path, clip_start, clip_end, dest_file):
+    """
+    Find where a clip cut by an earlier run starts in its stream.
+    A smart cut that fell back, or a clip from before smart cuts were named apart, starts on the keyframe before
+    ``clip_start``. Clips from before their start was recorded are measured to tell which.
+
+    :param clip_start: Where the clip was asked to start, in seconds.
+    :return: Where the clip starts, in seconds.
+    """
+    recorded = read_clip_start(dest_file)
+    if recorded is not None:
+        return recorded
+    keyframe_start = KeyframeIndex.for_video(video_path).at_or_before(clip_start)
+    measured_start = clip_end - ffmpeg_duration(dest_file)
+    clip_start = min((clip_start, keyframe_start), key=lambda start: abs(start - measured_start))
+    write_clip_start(dest_file, clip_start)
+    return clip_start
+
+
+def read_clip_start(dest_file):
+    """
+    :return: Where a clip starts in its stream in seconds, as recorded by :func:`write_clip_start`, or None.
+    """
+    try:
+        with open(dest_file + CLIP_START_SUFFIX) as inf:
+            return float(inf.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_clip_start(dest_file, clip_start):
+    with open(dest_file + CLIP_START_SUFFIX, 'w') as outf:
+        outf.write(repr(float(clip_start)))
+
+
 def timestamp_to_timedelta(val):
     return timedelta(hours=int(val[0:2]), minutes=int(val[3:5]), seconds=int(val[6:]))
 
 
 class InsIncScraperApi(VideoProvider):
 
-    def __init__(self, search_url, tz='America/Vancouver'):
-        super().__init__(search_url)
+    def __init__(self, search_url, tz='America/Vancouver', cache_dir=None):
+        """
+        :param cache_dir: Directory to cache search results in between runs. If None, they aren't cached.
+        """
+        super().__init__(search_url, cache_dir)
         self.tz = tz
 
     def available_dates(self, start_date: date, end_date: date):
@@ -45,13 +102,23 @@ class InsIncScraperApi(VideoProvider):
         for that date, but it's grouped under some nearby previous date.
         There may also not actually be any recordings for that date, but a clip was mis-dated on the server.
         """
-        first_of_month = pendulum.Date.instance(start_date).replace(day=1)
+        months = []
+        first_of_month = pendulum.Date(start_date.year, start_date.month, 1)
         while first_of_month < end_date:
-            for available_date in self.get_available_dates(first_of_month.year, first_of_month.month):
-                if available_date < start_date or available_date > end_date:
-                    continue
-                yield available_date
+            months.append(first_of_month)
             first_of_month = first_of_month.add(months=1)
+        if not months:
+            return
+
+        def month_dates(month):
+            return list(self.get_available_dates(month.year, month.month))
+
+        with ThreadPoolExecutor(max_workers=min(MONTH_SCAN_THREADS, len(months))) as executor:
+            for available_dates in executor.map(month_dates, months):
+                for available_date in available_dates:
+                    if available_date < start_date or available_date > end_date:
+                        continue
+                    yield available_date
 
     def get_metadata(self, for_date):
         """
@@ -89,7 +156,11 @@ class InsIncScraperApi(VideoProvider):
                     timecodes=timecodes,
                 )
 
-    def download(self, mms_url, destination_dir):
+    def download(self, mms_url, destination_dir, connections=1, **kwargs):
+        """
+        :param connections: Download the stream in this many time ranges at once, instead of over one connection.
+                            Interrupted downloads resume from where they stopped either way.
+        """
         dest_file_path = os.path.join(destination_dir, os.path.basename(mms_url))
         if os.path.exists(dest_file_path):
             print("Already exists: " + dest_file_path)
@@ -97,13 +168,74 @@ class InsIncScraperApi(VideoProvider):
 
         start_time = datetime.now()
         print("Starting download of {} on {}".format(mms_url, start_time.isoformat()))
-        download_mms(mms_url, dest_file_path)
+        download_mms(mms_url, dest_file_path, connections)
         end_time = datetime.now()
         elapsed = end_time - start_time
         print("Download of {} completed on {} in {} seconds".format(
             mms_url, end_time.isoformat(), elapsed.total_seconds()))
 
     def postprocess(self, video_metadata, download_dir, destination_dir, **kwargs):
+        """
+        :param smart_cut: Start the clip exactly at the meeting's start, re-encoding the frames up to the next
+                          keyframe, instead of on the keyframe before.
+        """
+        smart_cut = kwargs.get('smart_cut', False)
+        video_path, clip_start, clip_end, dest_file, prepped_video_info = self._prepare_clip(
+            video_metadata, download_dir, destination_dir, smart_cut)
+        if os.path.exists(dest_file):
+            print(dest_file + " already exists")
+            clip_start = existing_clip_start(video_path, clip_start, clip_end, dest_file)
+        elif smart_cut:
+            clip_start = smart_clip_video(video_path, clip_start, clip_end, dest_file,
+                                          KeyframeIndex.for_video(video_path))
+            write_clip_start(dest_file, clip_start)
+        else:
+            clip_start = KeyframeIndex.for_video(video_path).at_or_before(clip_start)
+            clip_video(video_path, clip_start, clip_end, dest_file)
+            write_clip_start(dest_file, clip_start)
+
+        self._write_prepared_info(prepped_video_info, clip_start, dest_file)
+        return prepped_video_info
+
+    def postprocess_all(self, video_metadatas, download_dir, destination_dir, **kwargs):
+        if kwargs.get('smart_cut'):
+            # Each clip's start is re-encoded on its own.
+            return super().postprocess_all(video_metadatas, download_dir, destination_dir, **kwargs)
+
+        prepped_video_infos = []
+        clips_by_source = OrderedDict()
+        keyframes = {}
+        for video_metadata in video_metadatas:
+            video_path, clip_start, clip_end, dest_file, prepped_video_info = self._prepare_clip(
+                video_metadata, download_dir, destination_dir)
+            prepped_video_infos.append(prepped_video_info)
+            if os.path.exists(dest_file):
+                print(dest_file + " already exists")
+                clip_start = existing_clip_start(video_path, clip_start, clip_end, dest_file)
+            else:
+                # Stream-copied clips have to start on a keyframe. Starting on the one before the meeting loses nothing.
+                if video_path not in keyframes:
+                    keyframes[video_path] = KeyframeIndex.for_video(video_path)
+                clip_start = keyframes[video_path].at_or_before(clip_start)
+                clips_by_source.setdefault(video_path, []).append((clip_start, clip_end, dest_file))
+            self._write_prepared_info(prepped_video_info, clip_start, dest_file)
+
+        # Meetings that share a stream are all cut from one read of it.
+        for video_path, clips in clips_by_source.items():
+            print("Splitting {} clips out of {}".format(len(clips), video_path))
+            split_video(video_path, clips)
+            for clip_start, _, dest_file in clips:
+                write_clip_start(dest_file, clip_start)
+
+        return prepped_video_infos
+
+    def _prepare_clip(self, video_metadata, download_dir, destination_dir, smart_cut=False):
+        """
+        Work out where a video is clipped from its downloaded stream.
+
+        :return: Tuple of source path, start and end of the meeting in seconds, destination path,
+                 and :class:`PreparedVideoInfo`. Cuts that must start on a keyframe start before the meeting.
+        """
         filename_from_video_url = os.path.basename(video_metadata.url)
         video_path = os.path.join(download_dir, filename_from_video_url)
         if not os.path.exists(video_path):
@@ -111,29 +243,29 @@ class InsIncScraperApi(VideoProvider):
         start_timestamp = pendulum.parse(video_metadata.start_ts)
         start_timecode = min(chain([m.start_ts for m in video_metadata.timecodes], [start_timestamp.to_time_string()]))
         end_timecode = max(chain([m.end_ts for m in video_metadata.timecodes], [video_metadata.end_ts]))
-        start_timecode = adjust_timecode(start_timecode, -2)
-        end_timecode = adjust_timecode(end_timecode, 2)
-
-        shift_timecodes(video_metadata.timecodes, start_timecode)
+        clip_start = timecode_to_seconds(start_timecode)
+        clip_end = timecode_to_seconds(end_timecode)
 
         filename_parts = filename_from_video_url.split('.')
-        filename_parts.insert(len(filename_parts)-1, '{}_{}'.format(
-            start_timecode.replace(':', ''), end_timecode.replace(':', '')))
+        # Smart cuts are named apart, so a clip cut on a keyframe is never taken for one that starts exactly on time.
+        filename_parts.insert(len(filename_parts)-1, '{}_{}{}'.format(
+            start_timecode.replace(':', ''), end_timecode.replace(':', ''), '_exact' if smart_cut else ''))
         final_video_filename = '.'.join(filename_parts)
         dest_file = os.path.join(destination_dir, final_video_filename)
         prepped_video_info = PreparedVideoInfo(video_metadata, final_video_filename)
+        return video_path, clip_start, clip_end, dest_file, prepped_video_info
+
+    @staticmethod
+    def _write_prepared_info(prepped_video_info, clip_start, dest_file):
+        """
+        Make the video's timecodes relative to where its clip starts, and write its prepared metadata.
+        """
+        shift_timecodes(prepped_video_info.video_metadata.timecodes, adjust_timecode('00:00:00', int(clip_start)))
         with open(dest_file + '.yaml', 'w') as outf:
             yaml.dump(prepped_video_info, outf)
 
-        if os.path.exists(dest_file):
-            print(dest_file + " already exists")
-        else:
-            clip_video(video_path, start_timecode, end_timecode, dest_file)
-
-        return prepped_video_info
-
-    def _search(self, url, rs, rsargs):
-        resp = self.session.post(url, data={
+    def _search(self, url, rs, rsargs, ttl):
+        resp = self.cached_request('POST', url, ttl, data={
             'rs': rs,
             'rsargs[]': rsargs,
         })
@@ -145,7 +277,10 @@ class InsIncScraperApi(VideoProvider):
         Get dates for which videos are available. Dates are in local time.
         """
         print("Getting available dates in {}-{}".format(year, month))
-        resp = self._search(self.provider_url + '/meeting_search.php', 'show_calendar', [year, str(month).zfill(2)])
+        # Calendars of months that ended a while ago are final, so they never need to be fetched again.
+        final = pendulum.Date(year, month, 1).add(months=1, days=PUBLISHING_DELAY) <= pendulum.today(self.tz).date()
+        resp = self._search(self.provider_url + '/meeting_search.php', 'show_calendar', [year, str(month).zfill(2)],
+                            None if final else CALENDAR_TTL)
         for match in re.finditer(r"javascript: write_date_string\(\\'(\d+)-(\d+)-(\d+)\\'\)", resp.text):
             y, m, d = int(match.group(1)), int(match.group(2)), int(match.group(3))
             dt = pendulum.Date(y, m, d)
@@ -157,11 +292,11 @@ class InsIncScraperApi(VideoProvider):
         """
         # The '_sl' suffix yields mms:// URLs.
         resp = self._search(self.provider_url + '/meeting_search_sl.php',
-                            'search_clips_sl', ['', for_date.strftime('%Y-%m-%d'), ''])
+                            'search_clips_sl', ['', for_date.strftime('%Y-%m-%d'), ''], CLIPS_TTL)
         start_bit, end_bit = "+:var res = { \"result\": '", "'}; res;"
         body = '"{}"'.format(resp.text[len(start_bit):-1 - len(end_bit)])
         body = body.replace("\\n", "\n").replace("\\'", "'").replace('\\"', '"')
-        parsed_html = BeautifulSoup(body, 'html.parser')
+        parsed_html = parse_html(body, CLIPS_STRAINER)
         category = None
         for element in parsed_html.select('td.gameDate'):
             strong, a_link = element.find('strong'), element.find('a')
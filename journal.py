@@ -0,0 +1,113 @@
+"""
+Durable record of the segments planned for, and downloaded into, a download directory.
+Resuming a download and listing its segments reads this instead of scanning the filesystem.
+"""
+import os
+import sqlite3
+
+JOURNAL_FILENAME = '_journal.sqlite'
+
+PENDING = 'pending'
+DONE = 'done'
+MISSING = 'missing'
+# Written into a video while downloading, and deleted since.
+STREAMED = 'streamed'
+
+
+class DownloadJournal(object):
+    # Commit after this many segment updates, so an interrupted run loses little without committing per segment.
+    COMMIT_EVERY = 100
+
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        self.path = os.path.join(download_dir, JOURNAL_FILENAME)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS segments ('
+                         'idx INTEGER PRIMARY KEY, url TEXT NOT NULL, filename TEXT NOT NULL, '
+                         'state TEXT NOT NULL, size INTEGER)')
+        self._uncommitted = 0
+
+    @staticmethod
+    def exists(download_dir):
+        return os.path.isfile(os.path.join(download_dir, JOURNAL_FILENAME))
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+
+    def plan_segment(self, index, url, filename):
+        """
+        Record a segment that makes up the download. A segment already in the journal keeps its state.
+
+        :return: State of the segment.
+        """
+        self._db.execute(
+            'INSERT INTO segments (idx, url, filename, state) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (idx) DO UPDATE SET url = excluded.url, filename = excluded.filename',
+            (index, url, filename, PENDING))
+        self._count_update()
+        return self._db.execute('SELECT state FROM segments WHERE idx = ?', (index,)).fetchone()[0]
+
+    def mark_done(self, index, size):
+        self._update(index, DONE, size)
+
+    def mark_missing(self, index):
+        self._update(index, MISSING, None)
+
+    def mark_streamed(self, index):
+        self._db.execute('UPDATE segments SET state = ? WHERE idx = ?', (STREAMED, index))
+        self._count_update()
+
+    def reset(self, state):
+        """
+        Mark every segment in ``state`` as pending again, so it's downloaded again.
+        """
+        self._db.execute('UPDATE segments SET state = ?, size = NULL WHERE state = ?', (PENDING, state))
+        self.commit()
+
+    def _update(self, index, state, size):
+        self._db.execute('UPDATE segments SET state = ?, size = ? WHERE idx = ?', (state, size, index))
+        self._count_update()
+
+    def _count_update(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self._db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def count(self, state):
+        return self._db.execute('SELECT COUNT(*) FROM segments WHERE state = ?', (state,)).fetchone()[0]
+
+    def segment_files(self):
+        """
+        :return: Filenames of downloaded segments, in timeline order.
+        """
+        return [row[0] for row in self._db.execute(
+            'SELECT filename FROM segments WHERE state = ? ORDER BY idx', (DONE,))]
+
+    def segment_sizes(self):
+        """
+        :return: List of (filename, size) of downloaded segments, in timeline order.
+        """
+        return self._db.execute(
+            'SELECT filename, size FROM segments WHERE state = ? ORDER BY idx', (DONE,)).fetchall()
+
+    def missing_urls(self):
+        return [row[0] for row in self._db.execute(
+            'SELECT url FROM segments WHERE state = ? ORDER BY idx', (MISSING,))]
+
+    def total_size(self):
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM segments WHERE state = ?', (DONE,)).fetchone()[0]
@@ -0,0 +1,61 @@
+"""
+Index of where a downloaded video's keyframes are, so clips can be cut on them without probing the video each time.
+
+Stream-copied cuts can only start on a keyframe. The index is built from one scan of the video's packets, and
+cached next to the video along with its size and modification time, so it is rebuilt only if the video changes.
+"""
+import json
+import os
+from bisect import bisect_left, bisect_right
+
+from ffmpeg import ffprobe_keyframe_times
+
+INDEX_SUFFIX = '.keyframes.json'
+
+
+class KeyframeIndex(object):
+
+    def __init__(self, keyframes):
+        """
+        :param keyframes: Sorted keyframe timestamps in float seconds.
+        """
+        self.keyframes = keyframes
+
+    @classmethod
+    def for_video(cls, video_path):
+        """
+        Load the cached index of a video, scanning the video if there is none or the video has changed since.
+        """
+        index_path = video_path + INDEX_SUFFIX
+        stat = os.stat(video_path)
+        source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if os.path.isfile(index_path):
+            with open(index_path) as inf:
+                cached = json.load(inf)
+            if cached['source'] == source:
+                return cls(cached['keyframes'])
+
+        print("Indexing keyframes of " + video_path)
+        keyframes = sorted(ffprobe_keyframe_times(video_path))
+        with open(index_path + '.tmp', 'w') as outf:
+            json.dump({'source': source, 'keyframes': keyframes}, outf)
+        os.replace(index_path + '.tmp', index_path)
+        return cls(keyframes)
+
+    def __len__(self):
+        return len(self.keyframes)
+
+    def at_or_before(self, seconds):
+        """
+        :return: Time of the last keyframe at or before ``seconds``, or ``seconds`` if the video has no keyframes
+                 before it, like audio-only streams.
+        """
+        i = bisect_right(self.keyframes, seconds)
+        return self.keyframes[i - 1] if i else seconds
+
+    def at_or_after(self, seconds):
+        """
+        :return: Time of the first keyframe at or after ``seconds``, or None if there are none.
+        """
+        i = bisect_left(self.keyframes, seconds)
+        return self.keyframes[i] if i < len(self.keyframes) else None
@@ -0,0 +1,305 @@
+"""
+Read the duration of MP4 and MPEG-TS segments from their headers, without starting ffprobe.
+
+MP4 track durations come from each track's ``mdhd`` box, or for fragmented MP4, from the ``tfdt`` decode time and
+``trun`` sample durations of each fragment, with ``mvhd`` as a fallback. MPEG-TS durations come from the first and
+last presentation timestamps of each elementary stream. Files are memory-mapped, and only headers and the packets
+at either end of a transport stream are looked at, so sample data is never read.
+"""
+import mmap
+import os
+import struct
+
+VIDEO = 'video'
+AUDIO = 'audio'
+
+_HANDLER_KINDS = {b'vide': VIDEO, b'soun': AUDIO}
+_MP4_TOP_LEVEL_BOXES = {b'ftyp', b'styp', b'moov', b'moof', b'sidx', b'free', b'skip', b'mdat', b'wide'}
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# Timestamps to collect per stream at each end of a transport stream.
+TS_TIMESTAMPS_PER_END = 8
+# Packets to look through at the start of a transport stream for streams other than those already found.
+TS_SCAN_PACKETS = 2048
+PTS_CLOCK = 90000
+_PTS_WRAP = 1 << 33
+
+
+def media_duration(path):
+    """
+    :return: Duration of the longest stream in an MP4 or MPEG-TS file in float seconds, or None if it can't be read.
+    """
+    durations = read_durations(path)
+    return max(durations.values()) if durations else None
+
+
+def read_durations(path, offset=0, length=None):
+    """
+    :param offset: Position of the segment in the file, for segments stored in a pack.
+    :param length: Length of the segment, or None for the rest of the file.
+    :return: Dict of stream kind (:data:`VIDEO`, :data:`AUDIO` or a handler type) to duration in float seconds.
+             Empty if the file isn't MP4 or MPEG-TS, or its headers are incomplete.
+    """
+    with _MappedFile(path) as data:
+        end = len(data) if length is None else offset + length
+        return buffer_durations(data, offset, end)
+
+
+def segment_durations(ranges):
+    """
+    Read the duration of many segments, mapping each file only once.
+
+    :param ranges: Iterable of (path, offset, length), like :func:`segment_tools.segment_ranges` returns.
+    :return: Generator of each segment's video duration in float seconds, or its longest stream's if it has no
+             video, or None if it can't be read.
+    """
+    mapped_path, mapped = None, None
+    try:
+        for path, offset, length in ranges:
+            if path != mapped_path:
+                if mapped is not None:
+                    mapped.close()
+                mapped_path, mapped = path, _MappedFile(path)
+            durations = buffer_durations(mapped.data, offset, offset + length)
+            yield durations.get(VIDEO, max(durations.values())) if durations else None
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def buffer_durations(data, start=0, end=None):
+    """
+    Like :func:`read_durations`, for a segment held in ``data[start:end]``.
+    """
+    end = len(data) if end is None else end
+    if end - start >= TS_PACKET_SIZE and data[start] == TS_SYNC_BYTE and \
+            (end - start < 2 * TS_PACKET_SIZE or data[start + TS_PACKET_SIZE] == TS_SYNC_BYTE):
+        return ts_durations(data, start, end)
+    if end - start >= 8 and bytes(data[start + 4:start + 8]) in _MP4_TOP_LEVEL_BOXES:
+        return mp4_durations(data, start, end)
+    return {}
+
+
+class _MappedFile(object):
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        # Empty files can't be mapped.
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self.data
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _boxes(data, start, end):
+    """
+    :return: Generator of (box type, payload start, box end) for the boxes in ``data[start:end]``.
+    """
+    while start + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, start)
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', data, start + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - start
+        if size < header_size:
+            return
+        yield box_type, start + header_size, min(start + size, end)
+        start += size
+
+
+def _child(data, start, end, box_type):
+    for child_type, child_start, child_end in _boxes(data, start, end):
+        if child_type == box_type:
+            return child_start, child_end
+    return None
+
+
+def _read_time_header(data, start):
+    """
+    Read the timescale and duration of an ``mvhd`` or ``mdhd`` box.
+    """
+    if data[start] == 1:
+        return struct.unpack_from('>IQ', data, start + 20)
+    return struct.unpack_from('>II', data, start + 12)
+
+
+def mp4_durations(data, start=0, end=None):
+    end = len(data) if end is None else end
+    movie_duration = None
+    # Track ID to [kind, timescale, duration from mdhd, default sample duration from trex].
+    tracks = {}
+    # Track ID to [decode time of the first fragment, decode time at the end of the last fragment].
+    fragments = {}
+
+    for box_type, box_start, box_end in _boxes(data, start, end):
+        if box_type == b'moov':
+            for child_type, child_start, child_end in _boxes(data, box_start, box_end):
+                if child_type == b'mvhd':
+                    timescale, duration = _read_time_header(data, child_start)
+                    if timescale and duration not in (0, 0xffffffff, 0xffffffffffffffff):
+                        movie_duration = duration / timescale
+                elif child_type == b'trak':
+                    track_id, track = _read_trak(data, child_start, child_end)
+                    if track_id is not None:
+                        # Keep the default sample duration if mvex came first.
+                        track[3] = tracks.get(track_id, track)[3]
+                        tracks[track_id] = track
+                elif child_type == b'mvex':
+                    for trex_type, trex_start, _ in _boxes(data, child_start, child_end):
+                        if trex_type == b'trex':
+                            track_id, _, default_duration = struct.unpack_from('>III', data, trex_start + 4)
+                            tracks.setdefault(track_id, [None, None, 0, 0])[3] = default_duration
+        elif box_type == b'moof':
+            for traf_type, traf_start, traf_end in _boxes(data, box_start, box_end):
+                if traf_type == b'traf':
+                    _read_traf(data, traf_start, traf_end, tracks, fragments)
+
+    durations = {}
+    for track_id, (kind, timescale, duration, _) in sorted(tracks.items()):
+        if not timescale or kind in durations:
+            continue
+        if track_id in fragments:
+            first, last = fragments[track_id]
+            duration = last - first
+        if duration and duration not in (0xffffffff, 0xffffffffffffffff):
+            durations[kind] = duration / timescale
+    if not durations and movie_duration:
+        durations['movie'] = movie_duration
+    return durations
+
+
+def _read_trak(data, start, end):
+    tkhd = _child(data, start, end, b'tkhd')
+    mdia = _child(data, start, end, b'mdia')
+    if not tkhd or not mdia:
+        return None, None
+    track_id, = struct.unpack_from('>I', data, tkhd[0] + (20 if data[tkhd[0]] == 1 else 12))
+    mdhd = _child(data, mdia[0], mdia[1], b'mdhd')
+    hdlr = _child(data, mdia[0], mdia[1], b'hdlr')
+    if not mdhd or not hdlr:
+        return None, None
+    timescale, duration = _read_time_header(data, mdhd[0])
+    handler_type = bytes(data[hdlr[0] + 8:hdlr[0] + 12])
+    kind = _HANDLER_KINDS.get(handler_type, handler_type.decode('latin1'))
+    return track_id, [kind, timescale, duration, 0]
+
+
+def _read_traf(data, start, end, tracks, fragments):
+    track_id, default_duration, decode_time, total_duration = None, None, None, 0
+    for box_type, box_start, _ in _boxes(data, start, end):
+        flags = int.from_bytes(data[box_start + 1:box_start + 4], 'big')
+        if box_type == b'tfhd':
+            track_id, = struct.unpack_from('>I', data, box_start + 4)
+            position = box_start + 8
+            if flags & 0x1:
+                position += 8
+            if flags & 0x2:
+                position += 4
+            if flags & 0x8:
+                default_duration, = struct.unpack_from('>I', data, position)
+        elif box_type == b'tfdt':
+            decode_time, = struct.unpack_from('>Q' if data[box_start] == 1 else '>I', data, box_start + 4)
+        elif box_type == b'trun':
+            sample_count, = struct.unpack_from('>I', data, box_start + 4)
+            position = box_start + 8
+            if flags & 0x1:
+                position += 4
+            if flags & 0x4:
+                position += 4
+            if flags & 0x100:
+                stride = 4 * bin(flags & 0xf00).count('1')
+                for i in range(sample_count):
+                    total_duration += struct.unpack_from('>I', data, position + i * stride)[0]
+            else:
+                if default_duration is None:
+                    default_duration = tracks.get(track_id, [None, None, 0, 0])[3]
+                total_duration += sample_count * default_duration
+    if track_id is None:
+        return
+    if track_id not in fragments:
+        first = decode_time if decode_time is not None else 0
+        fragments[track_id] = [first, first]
+    if decode_time is None:
+        decode_time = fragments[track_id][1]
+    fragments[track_id][1] = max(fragments[track_id][1], decode_time + total_duration)
+
+
+def _pes_timestamp(data, packet):
+    """
+    :return: (PID, stream kind, PTS) if the transport stream packet at ``packet`` starts a PES packet with a PTS.
+    """
+    if data[packet] != TS_SYNC_BYTE or not data[packet + 1] & 0x40:
+        return None
+    pid = (data[packet + 1] & 0x1f) << 8 | data[packet + 2]
+    adaptation_field_control = data[packet + 3] >> 4 & 0x3
+    if not adaptation_field_control & 0x1:
+        return None
+    payload = packet + 4
+    if adaptation_field_control & 0x2:
+        payload += 1 + data[packet + 4]
+    if payload + 14 > packet + TS_PACKET_SIZE or bytes(data[payload:payload + 3]) != b'\x00\x00\x01':
+        return None
+    stream_id = data[payload + 3]
+    if 0xe0 <= stream_id <= 0xef:
+        kind = VIDEO
+    elif 0xc0 <= stream_id <= 0xdf or stream_id == 0xbd:
+        kind = AUDIO
+    else:
+        return None
+    if not data[payload + 7] & 0x80:
+        return None
+    b = data[payload + 9:payload + 14]
+    pts = (b[0] >> 1 & 0x7) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1
+    return pid, kind, pts
+
+
+def ts_durations(data, start=0, end=None):
+    end = len(data) if end is None else end
+    num_packets = (end - start) // TS_PACKET_SIZE
+    # PID to (kind, timestamps), from the packets at the start and end of the stream.
+    heads, tails = {}, {}
+
+    for i in range(num_packets):
+        timestamp = _pes_timestamp(data, start + i * TS_PACKET_SIZE)
+        if timestamp:
+            pid, kind, pts = timestamp
+            heads.setdefault(pid, (kind, []))[1].append(pts)
+        # Frames can be out of order, so a few are needed from each stream to find the earliest.
+        if all(len(pts) >= TS_TIMESTAMPS_PER_END for _, pts in heads.values()) and \
+                (len({kind for kind, _ in heads.values()}) > 1 or i >= TS_SCAN_PACKETS):
+            break
+    for i in range(num_packets - 1, -1, -1):
+        timestamp = _pes_timestamp(data, start + i * TS_PACKET_SIZE)
+        if timestamp:
+            pid, kind, pts = timestamp
+            tails.setdefault(pid, (kind, []))[1].append(pts)
+        if all(len(tails.get(pid, (None, ()))[1]) >= TS_TIMESTAMPS_PER_END for pid in heads):
+            break
+
+    durations = {}
+    for pid, (kind, head) in sorted(heads.items()):
+        if kind in durations:
+            continue
+        base = head[0]
+        # Relative to the first timestamp seen, allowing for the 33-bit clock wrapping around.
+        relative = sorted(_pts_difference(pts, base) for pts in head + tails.get(pid, (kind, []))[1])
+        steps = [b - a for a, b in zip(relative, relative[1:]) if b > a]
+        # The last frame lasts as long as the frames before it.
+        frame_duration = min(steps) if steps else 0
+        durations[kind] = (relative[-1] - relative[0] + frame_duration) / PTS_CLOCK
+    return durations
+
+
+def _pts_difference(pts, base):
+    difference = (pts - base) % _PTS_WRAP
+    return difference - _PTS_WRAP if difference > _PTS_WRAP // 2 else difference
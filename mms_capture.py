@@ -0,0 +1,208 @@
+"""
+Capture an MMS stream over several connections at once.
+
+The stream is split into time ranges, and each is pulled by its own ffmpeg process that seeks on the server
+(``-ss`` before ``-i``). Timestamps are kept as they are in the source (``-copyts``), so parts line up on one
+timeline. A part starts at the keyframe at or before its range and runs a little past the end of its range,
+so neighbouring parts overlap. Parts are stitched by taking each stream of a part up to the first packet of that
+stream in the next part, which leaves no gap and no duplicated packet at the seams.
+
+Captures are resumable the same way. An interrupted capture is kept as a checkpoint, and the next attempt only
+fetches the stream from where the checkpoint ends, then stitches the checkpoints together.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from subprocess import check_call, CalledProcessError
+
+from ffmpeg import ffmpeg_duration, ffprobe_last_packet_times, ffprobe_packet_times, ffprobe_stream_start_times, \
+    get_temp_destination, tempfile_suffix
+
+# Seconds a part keeps capturing past the end of its range, to reach the keyframe the next part starts at.
+SEAM_OVERLAP = 30
+# Streams shorter than this per connection aren't worth splitting.
+MIN_PART_DURATION = 10 * 60
+# Largest difference in seconds allowed between the stitched video and the source stream.
+DURATION_TOLERANCE = 1.0
+
+
+class StitchError(ValueError):
+    pass
+
+
+def download_mms(mms_url, destination_path, connections=1):
+    """
+    Download an MMS stream, resuming from where an earlier attempt was interrupted.
+
+    :param connections: Number of time ranges to download at the same time. The parts are stitched losslessly.
+                        Falls back to a single connection if the stream doesn't report its duration,
+                        or is too short to split.
+    """
+    mms_url = mms_url.replace('mms://', 'mmsh://')
+    try:
+        duration = ffmpeg_duration(mms_url)
+    except (ValueError, CalledProcessError):
+        duration = None
+    if connections < 2 or not duration or duration < connections * MIN_PART_DURATION:
+        capture_range(mms_url, None, None, destination_path, duration)
+        return
+
+    bounds = [duration * i / connections for i in range(connections)] + [None]
+    part_paths = [part_path(destination_path, i) for i in range(connections)]
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = [executor.submit(capture_range, mms_url, start, end, path)
+                   for start, end, path in zip(bounds, bounds[1:], part_paths)]
+        for future in futures:
+            future.result()
+
+    stitch_parts(part_paths, destination_path, duration)
+    for path in part_paths:
+        os.remove(path)
+
+
+def part_path(destination_path, index):
+    return tempfile_suffix(destination_path).replace('.tmp.', '.part{}.'.format(index))
+
+
+def checkpoint_path(destination_path, index):
+    return tempfile_suffix(destination_path).replace('.tmp.', '.checkpoint{}.'.format(index))
+
+
+def capture_range(url, start, end, destination_path, expected_duration=None):
+    """
+    Capture part of a stream with its original timestamps.
+    If an earlier attempt was interrupted, only the rest of the range is fetched.
+
+    :param start: Seconds into the stream to seek to before reading. The part starts at the keyframe before this.
+    :param end: Seconds into the stream of the end of the range, or None to capture until the stream ends.
+    :param expected_duration: Duration of the stream in seconds, if known, to check a resumed capture against.
+    """
+    if os.path.exists(destination_path):
+        print("Already captured: " + destination_path)
+        return
+    stop = None if end is None else end + SEAM_OVERLAP
+
+    checkpoints = list(existing_checkpoints(destination_path))
+    temp_path = tempfile_suffix(destination_path)
+    last_packet_times = None
+    if os.path.exists(temp_path):
+        # Keep whatever an interrupted attempt managed to capture.
+        last_packet_times = ffprobe_last_packet_times_or_none(temp_path)
+        if last_packet_times:
+            checkpoints.append(checkpoint_path(destination_path, len(checkpoints)))
+            os.rename(temp_path, checkpoints[-1])
+        else:
+            os.remove(temp_path)
+    if checkpoints:
+        if not last_packet_times:
+            last_packet_times = ffprobe_last_packet_times(checkpoints[-1])
+        # Every stream must reach the seam, so resume from the stream that got the least far.
+        reached = min(last_packet_times.values())
+        print("Resuming capture of {} from {:.1f}s, where {} ends".format(url, reached, checkpoints[-1]))
+        start = reached
+
+    if stop is None or not start or start < stop:
+        cmd = ['ffmpeg', '-loglevel', 'error']
+        if start:
+            cmd.extend(['-ss', str(start)])
+        cmd.extend(['-i', url, '-copyts', '-map', '0', '-c', 'copy'])
+        if stop is not None:
+            # With -copyts, -to is a timestamp on the source timeline.
+            cmd.extend(['-to', str(stop)])
+        cmd.append(temp_path)
+        check_call(cmd)
+        if not checkpoints:
+            os.rename(temp_path, destination_path)
+            return
+        checkpoints.append(checkpoint_path(destination_path, len(checkpoints)))
+        os.rename(temp_path, checkpoints[-1])
+
+    if len(checkpoints) == 1:
+        os.rename(checkpoints[0], destination_path)
+    else:
+        stitch_parts(checkpoints, destination_path, expected_duration)
+        for path in checkpoints:
+            os.remove(path)
+
+
+def existing_checkpoints(destination_path):
+    for i in count():
+        path = checkpoint_path(destination_path, i)
+        if not os.path.exists(path):
+            return
+        yield path
+
+
+def ffprobe_last_packet_times_or_none(video_path):
+    try:
+        return ffprobe_last_packet_times(video_path)
+    except CalledProcessError:
+        return None
+
+
+def find_seams(part_paths):
+    """
+    Work out where each stream switches from one part to the next, and check the parts cover the stream
+    without a gap.
+
+    :return: List with a dict of stream index to seam timestamp for each part after the first.
+    """
+    seams = []
+    previous_starts = ffprobe_stream_start_times(part_paths[0])
+    for previous_path, path in zip(part_paths, part_paths[1:]):
+        starts = ffprobe_stream_start_times(path)
+        if set(starts) != set(previous_starts):
+            raise StitchError("{} and {} have different streams".format(previous_path, path))
+        for stream_index, seam in starts.items():
+            if seam <= previous_starts[stream_index]:
+                raise StitchError("Stream {} of {} starts at {}, which is not after where {} starts. "
+                                  "Did the server ignore seeking?".format(stream_index, path, seam, previous_path))
+            # The previous part must reach the seam, or the stitched video would skip ahead.
+            if not any(t >= seam for t in ffprobe_packet_times(previous_path, stream_index, seam, SEAM_OVERLAP)):
+                raise StitchError("Stream {} of {} ends before {} starts at {}".format(
+                    stream_index, previous_path, path, seam))
+        seams.append(starts)
+        previous_starts = starts
+    return seams
+
+
+def write_stream_concat_file(part_paths, seams, stream_index, concat_file_path):
+    with open(concat_file_path, 'w') as concat_file:
+        for i, path in enumerate(part_paths):
+            concat_file.write("file '{}'\n".format(os.path.abspath(path)))
+            if i > 0:
+                concat_file.write("inpoint {}\n".format(seams[i - 1][stream_index]))
+            if i < len(seams):
+                concat_file.write("outpoint {}\n".format(seams[i][stream_index]))
+
+
+def stitch_parts(part_paths, destination_path, expected_duration):
+    """
+    Join parts captured by :func:`capture_range` without re-encoding, and check the result is as long as the source.
+
+    Each stream is concatenated separately, since the streams of a part don't start at the same timestamp.
+
+    :param expected_duration: Duration of the source in seconds, or None if it isn't known.
+    """
+    seams = find_seams(part_paths)
+    stream_indexes = sorted(seams[0])
+    cmd = ['ffmpeg', '-loglevel', 'error']
+    concat_file_paths = []
+    for stream_index in stream_indexes:
+        concat_file_path = '{}.stream{}.txt'.format(destination_path, stream_index)
+        write_stream_concat_file(part_paths, seams, stream_index, concat_file_path)
+        concat_file_paths.append(concat_file_path)
+        cmd.extend(['-safe', '0', '-f', 'concat', '-i', concat_file_path])
+    for input_index, stream_index in enumerate(stream_indexes):
+        cmd.extend(['-map', '{}:{}'.format(input_index, stream_index)])
+    temp_path = get_temp_destination(destination_path)
+    cmd.extend(['-c', 'copy', temp_path])
+    check_call(cmd)
+    for concat_file_path in concat_file_paths:
+        os.remove(concat_file_path)
+
+    stitched_duration = ffmpeg_duration(temp_path)
+    if expected_duration and abs(stitched_duration - expected_duration) > DURATION_TOLERANCE:
+        raise StitchError("Stitched {} is {:.1f}s long, but the stream is {:.1f}s long".format(
+            temp_path, stitched_duration, expected_duration))
+    os.rename(temp_path, destination_path)
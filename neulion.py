@@ -10,16 +10,29 @@ from urllib.parse import urlparse
 
 import pendulum
 import pytz
-from bs4 import BeautifulSoup
-from requests import Session
+from bs4 import SoupStrainer
 
-from common import VideoProvider, VideoMetadata, group_root_and_subclips, TimeCode, PreparedVideoInfo, shift_timecodes
-from ffmpeg import ffmpeg_concat
-from segment_tools import download_clip, write_ffmpeg_concat_file
+from common import SegmentedVideoProvider, VideoMetadata, group_root_and_subclips, TimeCode, PreparedVideoInfo, \
+    shift_timecodes
+from downmix import ffmpeg_concat_mono
+from ffmpeg import ffmpeg_append, ffmpeg_concat
+from fingerprint import built_segments, fingerprint_inputs, is_up_to_date, record_build
+from html_parsing import parse_html
+from segment_tools import concat_durations, download_clip, segment_ranges, write_ffmpeg_concat_file
 
 Project = namedtuple('Project', ['id', 'name'])
 NeulionClip = namedtuple('Clip', ['url', 'title', 'rank', 'descr', 'start_utc', 'project', 'id', 'duration'])
 
+# Seconds of video in each segment.
+SEGMENT_DURATION = 2
+# Seconds to reuse cached responses for. The site lists newly published meetings, and meetings can be extended.
+SITE_HTML_TTL = 60 * 60
+CLIPS_TTL = 60 * 60
+
+# Parts of the site page with the projects and the dates that have videos, and the rows of clips.
+SITE_STRAINER = SoupStrainer(['select', 'script'])
+CLIPS_STRAINER = SoupStrainer('tr')
+
 
 class NeulionClipMetadata(VideoMetadata):
     def __init__(self, clip_id, project_id, rank, title, descr, clip_start_utc, url,
@@ -40,19 +53,19 @@ class NeulionClipMetadata(VideoMetadata):
         self.duration = duration
 
 
-class NeulionScraperApi(VideoProvider):
+class NeulionScraperApi(SegmentedVideoProvider):
     """
     Methods for discovering available videos.
     """
 
-    def __init__(self, site_url, tz='America/Vancouver'):
+    def __init__(self, site_url, tz='America/Vancouver', cache_dir=None):
         """
         :param site_url: URL of the Neulion Civic Streaming page to scrape.
+        :param cache_dir: Directory to cache responses in between runs. If None, they aren't cached.
         """
-        super().__init__(site_url)
+        super().__init__(site_url, cache_dir)
         self.tz = tz
         self._site_soup = None
-        self.session = Session()
 
     def available_dates(self, start_date: date, end_date: date) -> Iterable[pendulum.Date]:
         for available_date in self.allowed_dates():
@@ -75,23 +88,77 @@ class NeulionScraperApi(VideoProvider):
             root.timecodes = timecodes
             yield root
 
-    def download(self, url, destination_dir):
-        download_clip(adaptive_url_to_segment_urls(url), destination_dir, 16)
+    def subclip(self, root: VideoMetadata, title=None, timecode=None):
+        """
+        Describe part of a root clip as a clip of its own, so only the segments in its time range are downloaded.
+
+        :param root: Metadata of the root clip.
+        :param title: Text in the title of one of the root clip's time codes, to take that agenda item.
+        :param timecode: Range to take instead, as offsets into the root clip like '01:02:03-01:30:00'.
+        :return: Metadata for the subclip, or None if ``title`` matches none of the root clip's time codes.
+        """
+        root_start, root_end, _ = parse_time_range_from_url(root.url)
+        if timecode:
+            start_offset, end_offset = timecode.split('-')
+            start = root_start + timedelta(seconds=timecode_to_duration(start_offset))
+            end = root_start + timedelta(seconds=timecode_to_duration(end_offset))
+            title = root.title
+        else:
+            matches = [tc for tc in root.timecodes if title.lower() in tc.title.lower()]
+            if not matches:
+                return None
+            if len(matches) > 1:
+                raise ValueError("'{}' matches more than one subclip of {}: {}".format(
+                    title, root.video_id, ', '.join(tc.title for tc in matches)))
+            start = time_of_day_after(root_start, matches[0].start_ts)
+            end = time_of_day_after(start, matches[0].end_ts) if matches[0].end_ts else root_end
+            title = matches[0].title
+        end = min(end, root_end)
+        if start >= end:
+            raise ValueError("Subclip of {} from {} to {} is empty".format(root.video_id, start, end))
+
+        timecodes = [tc for tc in root.timecodes if start <= time_of_day_after(root_start, tc.start_ts) < end]
+        return NeulionClipMetadata('{}-{:%H%M%S}'.format(root.video_id, start), root.project_id, root.rank, title,
+                                   root.descr, root.clip_start_utc, subclip_url(root.url, start, end),
+                                   root.category, timecodes)
+
+    def download(self, url, destination_dir, **kwargs):
+        if kwargs.get('stream_to'):
+            raise ValueError("Neulion segments are standalone MP4 files and can't be streamed into ffmpeg")
+        download_clip(self.segment_urls(url), destination_dir, **kwargs)
+
+    def segment_urls(self, url):
+        return adaptive_url_to_segment_urls(url)
+
+    def output_filename(self, video_metadata: VideoMetadata):
+        return video_metadata.video_id + '.mp4'
 
     def postprocess(self, video_metadata: VideoMetadata, download_dir, destination_dir, **kwargs) -> PreparedVideoInfo:
-        concat_file_path = write_ffmpeg_concat_file(download_dir, 2)
-        video_filename = video_metadata.video_id + '.mp4'
+        video_filename = self.output_filename(video_metadata)
         video_path = os.path.join(destination_dir, video_filename)
-        ffmpeg_concat(concat_file_path, video_path, mono=kwargs.get('mono', False))
+        mono = kwargs.get('mono', False)
+        mono_chunks = kwargs.get('mono_chunks', 1)
+        fingerprint = fingerprint_inputs(download_dir, mono=mono, segment_duration=SEGMENT_DURATION)
+        if is_up_to_date(download_dir, video_path, fingerprint):
+            print(video_path + " is up to date")
+        else:
+            # A meeting published before its end time was set has grown since its video was built.
+            num_built = built_segments(download_dir, video_path, mono=mono, segment_duration=SEGMENT_DURATION)
+            if num_built:
+                append_segments(download_dir, video_path, num_built, mono, mono_chunks)
+            else:
+                concat_file_path = write_ffmpeg_concat_file(download_dir, SEGMENT_DURATION)
+                concat_video(concat_file_path, video_path, mono, mono_chunks)
+            record_build(download_dir, video_path, fingerprint, len(segment_ranges(download_dir)))
 
         shift_timecodes(video_metadata.timecodes, pendulum.parse(video_metadata.start_ts).strftime('%H:%M:%S'))
         return PreparedVideoInfo(video_metadata, video_filename)
 
     def _get_site_html(self):
         if not self._site_soup:
-            resp = self.session.get(self.provider_url)
+            resp = self.cached_request('GET', self.provider_url, SITE_HTML_TTL)
             resp.raise_for_status()
-            self._site_soup = BeautifulSoup(resp.text, 'html.parser')
+            self._site_soup = parse_html(resp.text, SITE_STRAINER)
         return self._site_soup
 
     def projects(self):
@@ -130,7 +197,7 @@ class NeulionScraperApi(VideoProvider):
         """
         if not isinstance(project_ids, str):
             project_ids = ','.join(project_ids)
-        resp = self.session.get('http://civic.neulion.com/api/clipmanager.php', params={
+        resp = self.cached_request('GET', 'http://civic.neulion.com/api/clipmanager.php', CLIPS_TTL, params={
             'f': 'getClips',
             'device': 'desktop',
             'prid': project_ids,
@@ -138,7 +205,9 @@ class NeulionScraperApi(VideoProvider):
             'tz': self.tz,
         })
         resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, 'html.parser')
+        return self._parse_clips(parse_html(resp.text, CLIPS_STRAINER))
+
+    def _parse_clips(self, soup):
         for tr in soup.find_all('tr'):
             a = tr.find('a')
             url = a['onclick']
@@ -187,6 +256,29 @@ def parse_time_range_from_url(adaptive_url):
     return start_ts, end_ts, duration
 
 
+def subclip_url(adaptive_url, start, end):
+    """
+    Build the URL of a clip covering part of another clip's time range.
+    """
+    clip_start, _, duration = parse_time_range_from_url(adaptive_url)
+    old_range = '{:%Y%m%d%H%M%S}_{}'.format(clip_start, duration_to_timecode(duration).replace(':', ''))
+    new_range = '{:%Y%m%d%H%M%S}_{}'.format(start, duration_to_timecode(end - start).replace(':', ''))
+    return adaptive_url.replace(old_range, new_range)
+
+
+def time_of_day_after(after, code):
+    """
+    Resolve a time code from clip metadata, which only has the time of day in UTC, to the first such time from
+    ``after`` on. Times slightly before ``after`` are taken to mean ``after``, as subclips can start a little
+    before their root clip.
+    """
+    hours, minutes, seconds = map(int, code.split(':'))
+    resolved = after.replace(hour=hours, minute=minutes, second=seconds, microsecond=0)
+    if resolved < after - timedelta(minutes=1):
+        resolved += timedelta(days=1)
+    return max(resolved, after)
+
+
 def group_video_clips(clips):
     """
     Group a set of video clips for a given date into root clips, and subclips within these root clips (if any).
@@ -266,6 +358,29 @@ def calculate_timecodes(root_clip, subclips):
     return timecodes
 
 
+def concat_video(concat_file_path, video_out, mono, mono_chunks):
+    if mono:
+        ffmpeg_concat_mono(concat_file_path, video_out, mono_chunks)
+    else:
+        ffmpeg_concat(concat_file_path, video_out)
+
+
+def append_segments(download_dir, video_path, num_built, mono=False, mono_chunks=1):
+    """
+    Extend a video with the segments downloaded after the ones it was built from.
+    Only the new segments are joined, and downmixed if needed, before being appended to the video.
+
+    :param num_built: Number of segments the video was built from.
+    """
+    print("Appending segments after the first {} to {}".format(num_built, video_path))
+    concat_file_path = write_ffmpeg_concat_file(download_dir, SEGMENT_DURATION, num_built)
+    tail_path = os.path.join(download_dir, '_tail.mp4')
+    concat_video(concat_file_path, tail_path, mono, mono_chunks)
+    # The new segments start where they would have if the whole video were rebuilt.
+    ffmpeg_append(video_path, tail_path, sum(concat_durations(download_dir, SEGMENT_DURATION)[:num_built]))
+    os.remove(tail_path)
+
+
 def adaptive_url_to_segment_urls(adaptive_url):
     parsed = urlparse(adaptive_url)
     quality_placeholder = 'pc_'
@@ -274,7 +389,7 @@ def adaptive_url_to_segment_urls(adaptive_url):
     start_ts, end_ts, _ = parse_time_range_from_url(adaptive_url)
     if start_ts.second % 2 == 1:
         start_ts -= timedelta(seconds=1)
-    clip_length = timedelta(seconds=2)
+    clip_length = timedelta(seconds=SEGMENT_DURATION)
     current_time = start_ts
     while current_time < end_ts:
         yield '{}/{:%Y%m%d/%H/%M%S}.mp4'.format(url, current_time)
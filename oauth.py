@@ -1,10 +1,11 @@
 import json
 import os
-import requests
 import time
 from datetime import datetime, timedelta
 from requests import Session
 
+from transport import get_session
+
 
 TOKENS_DIR = 'auth'
 
@@ -22,7 +23,7 @@ def load_client_credentials(cred_file=os.path.join(TOKENS_DIR, 'client_id.json')
 
 
 def obtain_user_code(client_id):
-    resp = requests.post('https://accounts.google.com/o/oauth2/device/code', params={
+    resp = get_session().post('https://accounts.google.com/o/oauth2/device/code', params={
         'client_id': client_id,
         'scope': 'https://www.googleapis.com/auth/youtube https://www.googleapis.com/auth/youtube.upload'
     })
@@ -46,7 +47,7 @@ def _get_oauth_token(client_id, client_secret, grant_type, extra=None):
     }
     if extra:
         params.update(extra)
-    resp = requests.post('https://www.googleapis.com/oauth2/v4/token', params=params)
+    resp = get_session().post('https://www.googleapis.com/oauth2/v4/token', params=params)
     return resp.json()
 
 
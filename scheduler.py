@@ -0,0 +1,174 @@
+"""
+Download the segments of many clips through one shared worker pool.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tqdm import tqdm
+
+from journal import DownloadJournal
+from segment_tools import MissingSegmentError, download_segment, open_pack, plan_segments, prepare_destination, \
+    report_download_size, segment_controller
+from transport import segment_session
+
+
+class ClipDownload(object):
+    """
+    Bookkeeping for one clip while its segments are downloaded by a :class:`DownloadScheduler`.
+    """
+
+    def __init__(self, name, resolve, destination, priority, storage):
+        self.name = name
+        self.resolve = resolve
+        self.destination = destination
+        self.priority = priority
+        self.storage = storage
+        self.in_flight = 0
+        self.num_skipped = 0
+        self.num_missing_segments = 0
+        self.exhausted = False
+        self._journal = None
+        self._pack = None
+        self._to_fetch = None
+        self._missing_segments = None
+
+    def start(self, segment_urls, on_skip):
+        prepare_destination(self.destination)
+        self._journal = DownloadJournal(self.destination)
+        self._pack = open_pack(self.destination, self.storage)
+        self._missing_segments = open(os.path.join(self.destination, '_missing_segments.txt'), 'w')
+
+        def skipped(i, dest):
+            self.num_skipped += 1
+            on_skip()
+
+        self._to_fetch = plan_segments(segment_urls, self._journal, skipped, self._pack)
+
+    def next_segment(self):
+        """
+        :return: Next (index, segment URL, destination path) to download, or None if there are no more.
+        """
+        segment = next(self._to_fetch, None)
+        if segment is None:
+            self.exhausted = True
+        else:
+            self.in_flight += 1
+        return segment
+
+    def completed(self, index, size):
+        self.in_flight -= 1
+        self._journal.mark_done(index, size)
+
+    def missing(self, index, clip_url):
+        self.in_flight -= 1
+        self._missing_segments.write(clip_url + '\n')
+        self._journal.mark_missing(index)
+        self.num_missing_segments += 1
+
+    @property
+    def finished(self):
+        return self.exhausted and not self.in_flight
+
+    def close(self):
+        self._missing_segments.close()
+        print("{}: {} segments were previously downloaded".format(self.name, self.num_skipped))
+        report_download_size(self._journal, self.num_missing_segments)
+        self._journal.close()
+        if self._pack is not None:
+            self._pack.close()
+
+
+class DownloadScheduler(object):
+    """
+    Queues the segments of every added clip into one shared pool of download threads.
+
+    Clips share the pool in proportion to their priority: the next segment always comes from the clip with the
+    fewest in-flight requests relative to its priority. Segment URLs for upcoming clips are resolved in the
+    background while earlier clips download, so the pool doesn't go idle between clips.
+    """
+
+    def __init__(self, workers=16, adaptive=False, resolvers=2, storage='files'):
+        """
+        :param workers: Number of download threads shared by all clips.
+        :param adaptive: Adjust concurrent requests per host to what the server sustains, up to ``workers``.
+        :param resolvers: Number of clips whose segment URLs may be resolved at the same time.
+        :param storage: 'files' to save one file per segment, or 'pack' to append segments to a single pack file.
+        """
+        self.workers = workers
+        self.adaptive = adaptive
+        self.resolvers = resolvers
+        self.storage = storage
+        self._clips = []
+
+    def add(self, name, resolve, destination, priority=1):
+        """
+        :param name: Name of the clip, for log messages.
+        :param resolve: Callable taking no arguments that returns the clip's segment URLs in timeline order.
+        :param destination: Directory to save the clip's segments into.
+        :param priority: Share of the pool this clip gets, relative to other clips.
+        """
+        self._clips.append(ClipDownload(name, resolve, destination, priority, self.storage))
+
+    def run(self):
+        session = segment_session(self.workers)
+        progressbar = tqdm(dynamic_ncols=True)
+
+        def fetch(segment_url, dest):
+            controller = segment_controller(segment_url, self.workers) if self.adaptive else None
+            return download_segment(session, segment_url, dest, controller)
+
+        resolver_pool = ThreadPoolExecutor(max_workers=self.resolvers)
+        download_pool = ThreadPoolExecutor(max_workers=self.workers)
+        active = []
+        downloading = {}
+        try:
+            resolving = {resolver_pool.submit(clip.resolve): clip for clip in self._clips}
+            while resolving or active:
+                # Keep a few segments queued per thread, so threads never wait on this loop.
+                while len(downloading) < self.workers * 4:
+                    candidates = [clip for clip in active if not clip.exhausted]
+                    if not candidates:
+                        break
+                    clip = min(candidates, key=lambda c: c.in_flight / c.priority)
+                    segment = clip.next_segment()
+                    if segment:
+                        i, segment_url, dest = segment
+                        downloading[download_pool.submit(fetch, segment_url, dest)] = clip, i, segment_url
+                for clip in [clip for clip in active if clip.finished]:
+                    clip.close()
+                    active.remove(clip)
+
+                if not resolving and not downloading:
+                    continue
+                done, _ = wait(list(resolving) + list(downloading), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in resolving:
+                        clip = resolving.pop(future)
+                        segment_urls = future.result()
+                        print("Starting download of {} to {}".format(clip.name, clip.destination))
+                        clip.start(segment_urls, progressbar.update)
+                        active.append(clip)
+                        continue
+
+                    clip, i, segment_url = downloading.pop(future)
+                    record_result(clip, i, future)
+                    progressbar.set_postfix(clips=len(active), refresh=False)
+                    progressbar.update()
+        finally:
+            # Segments already being saved are allowed to finish before their clips are closed.
+            resolver_pool.shutdown(cancel_futures=True)
+            download_pool.shutdown(cancel_futures=True)
+            for future, (clip, i, _) in downloading.items():
+                # Keep what finished in the meantime, so it isn't downloaded again when resuming.
+                if not future.cancelled() and isinstance(future.exception(), (type(None), MissingSegmentError)):
+                    record_result(clip, i, future)
+            for clip in active:
+                clip.close()
+            progressbar.close()
+
+
+def record_result(clip, index, future):
+    try:
+        clip.completed(index, future.result())
+    except MissingSegmentError as e:
+        clip.missing(index, e.clip_url)
@@ -0,0 +1,135 @@
+"""
+Store the segments of a download in one pack file with a compact index, instead of one file per segment.
+
+``_segments.pack`` holds segment data back to back. ``_segments.idx`` holds a fixed-size record per segment with
+its position in the timeline, offset, length, timestamp and CRC. A segment is committed once its index record has
+been written in full. Both files are synced to disk in batches rather than per segment, so after a power loss an
+index record may have reached the disk without its data. When a pack is opened, a partial index record, a record
+whose data doesn't match its CRC, or data without a record (left by a crash mid-append) is cut off, along with
+everything after it, so resuming only ever sees whole segments.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from datetime import timezone
+
+PACK_FILENAME = '_segments.pack'
+INDEX_FILENAME = '_segments.idx'
+
+# Segment index, offset, length, POSIX timestamp (-1 if unknown), CRC-32 of the data.
+_RECORD = struct.Struct('<IQIqI')
+
+PackEntry = namedtuple('PackEntry', ['index', 'offset', 'length', 'timestamp', 'crc'])
+PackSlot = namedtuple('PackSlot', ['pack', 'index', 'timestamp'])
+
+
+class SegmentPack(object):
+    # Sync to disk after this many appends, as often as the download journal commits.
+    SYNC_EVERY = 100
+
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        self.pack_path = os.path.join(download_dir, PACK_FILENAME)
+        self.index_path = os.path.join(download_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._unsynced = 0
+        self._recover()
+        self._pack = open(self.pack_path, 'ab')
+        self._index = open(self.index_path, 'ab')
+
+    @staticmethod
+    def exists(download_dir):
+        return os.path.isfile(os.path.join(download_dir, INDEX_FILENAME))
+
+    def _recover(self):
+        for path in (self.pack_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+
+        pack_size = os.path.getsize(self.pack_path)
+        committed_index_size, committed_pack_size = 0, 0
+        with open(self.index_path, 'rb') as index, open(self.pack_path, 'rb') as pack:
+            data = mmap.mmap(pack.fileno(), 0, access=mmap.ACCESS_READ) if pack_size else b''
+            try:
+                while True:
+                    record = index.read(_RECORD.size)
+                    if len(record) < _RECORD.size:
+                        break
+                    entry = PackEntry(*_RECORD.unpack(record))
+                    if entry.offset + entry.length > pack_size or \
+                            zlib.crc32(data[entry.offset:entry.offset + entry.length]) != entry.crc:
+                        break
+                    # Later entries for the same segment replace earlier ones.
+                    self._entries[entry.index] = entry
+                    committed_index_size += _RECORD.size
+                    committed_pack_size = max(committed_pack_size, entry.offset + entry.length)
+            finally:
+                if pack_size:
+                    data.close()
+
+        if os.path.getsize(self.index_path) != committed_index_size:
+            os.truncate(self.index_path, committed_index_size)
+        if pack_size != committed_pack_size:
+            os.truncate(self.pack_path, committed_pack_size)
+
+    def append(self, index, data, timestamp=None):
+        """
+        Append a segment and commit it to the index.
+
+        :param index: Position of the segment in the timeline.
+        :param data: Segment bytes.
+        :param timestamp: Segment start time as a datetime, if known.
+        :return: The new :class:`PackEntry`.
+        """
+        ts = -1 if timestamp is None else int(timestamp.replace(tzinfo=timestamp.tzinfo or timezone.utc).timestamp())
+        with self._lock:
+            offset = self._pack.tell()
+            self._pack.write(data)
+            entry = PackEntry(index, offset, len(data), ts, zlib.crc32(data))
+            self._index.write(_RECORD.pack(*entry))
+            # Flushed, so a crash of this process alone loses nothing. Only a power loss can cost unsynced segments.
+            self._pack.flush()
+            self._index.flush()
+            self._entries[index] = entry
+            self._unsynced += 1
+            if self._unsynced >= self.SYNC_EVERY:
+                self._sync()
+        return entry
+
+    def _sync(self):
+        for f in (self._pack, self._index):
+            os.fsync(f.fileno())
+        self._unsynced = 0
+
+    def __contains__(self, index):
+        return index in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self):
+        """
+        :return: List of :class:`PackEntry`, in timeline order.
+        """
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda entry: entry.index)
+
+    def total_size(self):
+        return sum(entry.length for entry in self._entries.values())
+
+    def close(self):
+        with self._lock:
+            self._sync()
+        self._pack.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
@@ -1,13 +1,35 @@
+import asyncio
+import errno
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from contextlib import nullcontext
 from datetime import datetime
+from itertools import chain, count, islice
+from urllib.parse import urlparse
 
 import logging
-from requests import Session
 from tqdm import tqdm
 
+from concurrency import THROTTLE_STATUS_CODES, controller_for
+from ffmpeg import ffmpeg_pipe_concat, get_temp_destination
+from journal import DownloadJournal, DONE, PENDING, STREAMED
+from media_duration import segment_durations
+from segment_pack import SegmentPack, PackSlot
+from transport import segment_session, async_session
+
 log = logging.getLogger()
 SEGMENT_FILE_PATTERN = '%Y%m%d%H%M%S.mp4'
+# Retries for a segment that keeps getting throttled, when fetching with an adaptive controller.
+MAX_THROTTLE_RETRIES = 8
+# Responses meaning the segment doesn't exist, rather than that it couldn't be fetched.
+MISSING_STATUS_CODES = {404, 410}
+
+# What to do with the response to a segment request.
+SAVE = 'save'
+RETRY = 'retry'
+MISSING = 'missing'
 
 
 class MissingSegmentError(ValueError):
@@ -16,23 +38,161 @@ class MissingSegmentError(ValueError):
         self.clip_url = clip_url
 
 
-def download_segment(session, clip_url, dest):
-    resp = session.get(clip_url, stream=True)
-    resp.raise_for_status()
-    tmp_dest = dest + '.tmp'
-    with open(tmp_dest, 'wb') as outvid:
-        for chunk in resp.iter_content(chunk_size=2048):
-            outvid.write(chunk)
-    if os.path.getsize(tmp_dest):
+def segment_response_action(status_code, controller, attempt):
+    """
+    Decide what to do with the response to a segment request. Both download engines go by this.
+
+    :param controller: The request's :class:`concurrency.AimdController`, if it's throttled adaptively.
+    :param attempt: Number of times the segment was requested before.
+    :return: :data:`MISSING` if the segment doesn't exist, :data:`RETRY` to back off and request it again,
+             or :data:`SAVE` to save it, or raise if the response is an error.
+    """
+    if status_code in MISSING_STATUS_CODES:
+        return MISSING
+    if controller and status_code in THROTTLE_STATUS_CODES and attempt < MAX_THROTTLE_RETRIES:
+        return RETRY
+    return SAVE
+
+
+def download_segment(session, clip_url, dest, controller=None):
+    """
+    :param dest: Path to save the segment to, or a :class:`segment_pack.PackSlot` to append it to a pack.
+    :param controller: Optional :class:`concurrency.AimdController` that limits concurrent requests,
+                       and decides how long to back off when throttled.
+    :return: Size of the segment in bytes.
+    """
+    for attempt in count():
+        with controller.slot() if controller else nullcontext():
+            start = time.monotonic()
+            # With stream=True, this returns once the headers are in.
+            resp = session.get(clip_url, stream=True)
+            latency = time.monotonic() - start
+            action = segment_response_action(resp.status_code, controller, attempt)
+            if action == MISSING:
+                resp.close()
+                raise MissingSegmentError(clip_url)
+            if action == SAVE:
+                resp.raise_for_status()
+                if isinstance(dest, PackSlot):
+                    size = commit_to_pack(clip_url, resp.content, dest)
+                else:
+                    tmp_dest = dest + '.tmp'
+                    with open(tmp_dest, 'wb') as outvid:
+                        for chunk in resp.iter_content(chunk_size=2048):
+                            outvid.write(chunk)
+                    size = commit_segment(clip_url, tmp_dest, dest)
+                if controller:
+                    controller.record_success(latency, size, time.monotonic() - start)
+                return size
+            resp.close()
+            backoff = controller.record_throttle()
+        time.sleep(backoff)
+
+
+async def download_segment_async(http, clip_url, dest, gate=None):
+    """
+    :param gate: Optional :class:`AsyncGate` that limits concurrent requests, and decides how long to back off.
+    :return: Size of the segment in bytes.
+    """
+    for attempt in count():
+        async with gate or AsyncGate(None):
+            start = time.monotonic()
+            async with http.get(clip_url) as resp:
+                latency = time.monotonic() - start
+                action = segment_response_action(resp.status, gate and gate.controller, attempt)
+                if action == MISSING:
+                    raise MissingSegmentError(clip_url)
+                if action == SAVE:
+                    resp.raise_for_status()
+                    if isinstance(dest, PackSlot):
+                        # Appending may sync the pack to disk, which mustn't hold up the event loop.
+                        size = await asyncio.get_running_loop().run_in_executor(
+                            None, commit_to_pack, clip_url, await resp.read(), dest)
+                    else:
+                        tmp_dest = dest + '.tmp'
+                        with open(tmp_dest, 'wb') as outvid:
+                            async for chunk in resp.content.iter_chunked(64 * 1024):
+                                outvid.write(chunk)
+                        size = commit_segment(clip_url, tmp_dest, dest)
+                    if gate:
+                        gate.controller.record_success(latency, size, time.monotonic() - start)
+                    return size
+            backoff = gate.controller.record_throttle()
+        await asyncio.sleep(backoff)
+
+
+class AsyncGate(object):
+    """
+    Lets an asyncio task wait for a free slot in an :class:`concurrency.AimdController` without blocking the loop.
+    A gate without a controller never waits.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self._condition = asyncio.Condition() if controller else None
+
+    async def __aenter__(self):
+        if self.controller:
+            async with self._condition:
+                await self._condition.wait_for(self.controller.try_acquire)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.controller:
+            self.controller.release()
+            async with self._condition:
+                # The limit may have grown, so wake as many waiters as there are free slots.
+                self._condition.notify(max(1, self.controller.limit - self.controller.in_flight))
+
+
+def segment_controller(segment_url, maximum):
+    return controller_for(urlparse(segment_url).hostname, maximum=maximum)
+
+
+def commit_segment(clip_url, tmp_dest, dest):
+    """
+    Move a fully downloaded segment into place, or raise :class:`MissingSegmentError` if it came back empty.
+
+    :return: Size of the segment in bytes.
+    """
+    size = os.path.getsize(tmp_dest)
+    if size:
         if os.path.exists(dest):
             os.remove(dest)
         os.rename(tmp_dest, dest)
+        return size
     else:
         os.remove(tmp_dest)
         raise MissingSegmentError(clip_url)
 
 
-def download_clip(segment_urls, destination, workers):
+def commit_to_pack(clip_url, data, slot):
+    """
+    Append a downloaded segment to a pack, or raise :class:`MissingSegmentError` if it came back empty.
+
+    :return: Size of the segment in bytes.
+    """
+    if not data:
+        raise MissingSegmentError(clip_url)
+    slot.pack.append(slot.index, data, slot.timestamp)
+    return len(data)
+
+
+def segment_timestamp(segment_url):
+    try:
+        return segment_url_to_timestamp(segment_url)
+    except ValueError:
+        return None
+
+
+def segment_filename(index, segment_url):
+    try:
+        timestamp = segment_url_to_timestamp(segment_url)
+        return timestamp.strftime(SEGMENT_FILE_PATTERN)
+    except ValueError:
+        return str(index).zfill(5) + '.' + os.path.basename(segment_url).split('.')[-1]
+
+
+def prepare_destination(destination):
     if not os.path.isdir(destination):
         raise ValueError("destination must be directory")
 
@@ -40,72 +200,462 @@ def download_clip(segment_urls, destination, workers):
         print("Deleting incomplete segment {}".format(incomplete_file))
         os.remove(os.path.join(destination, incomplete_file))
 
-    session = Session()
-    num_skipped_because_already_exists, num_missing_segments = 0, 0
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        futures = []
 
-        for i, segment_url in enumerate(segment_urls):
-            try:
-                timestamp = segment_url_to_timestamp(segment_url)
-                filename = timestamp.strftime(SEGMENT_FILE_PATTERN)
-            except ValueError:
-                filename = str(i).zfill(5) + '.' + os.path.basename(segment_url).split('.')[-1]
+def plan_segments(segment_urls, journal, on_skip, pack=None):
+    """
+    Record the segments of a clip in the journal as they are generated, yielding those that still need downloading.
+    Segment URLs are consumed lazily, so long clips are never held in memory all at once.
+
+    :param segment_urls: Segment URLs, in timeline order.
+    :param journal: :class:`journal.DownloadJournal` for the destination directory.
+    :param on_skip: Called with the index and destination of each segment that was previously downloaded.
+    :param pack: :class:`segment_pack.SegmentPack` to store segments in, instead of one file per segment.
+    :return: Generator of (index, segment URL, destination path or :class:`segment_pack.PackSlot`).
+    """
+    destination = journal.download_dir
+    # Directories downloaded before the journal existed are adopted with a single listdir.
+    on_disk = set(os.listdir(destination)) if not len(journal) and not pack else ()
+    for i, segment_url in enumerate(segment_urls):
+        filename = segment_filename(i, segment_url)
+        state = journal.plan_segment(i, segment_url, filename)
+        if state != DONE and filename in on_disk:
+            size = os.path.getsize(os.path.join(destination, filename))
+            if size:
+                journal.mark_done(i, size)
+                state = DONE
+        if state == DONE and pack is not None and i not in pack:
+            # The journal is committed in batches, but the pack may have lost its tail in a crash.
+            state = PENDING
+        if pack is not None:
+            dest = PackSlot(pack, i, segment_timestamp(segment_url))
+        else:
             dest = os.path.join(destination, filename)
-            if os.path.exists(dest) and os.path.getsize(dest):
-                # print("{} Already exists - skipping".format(dest))
-                num_skipped_because_already_exists += 1
-                continue
-
-            future = executor.submit(download_segment, session, segment_url, dest)
-            futures.append(future)
-
-        print("{} segments were previously downloaded".format(num_skipped_because_already_exists))
-        progressbar = tqdm(total=num_skipped_because_already_exists + len(futures),
-                           initial=num_skipped_because_already_exists, dynamic_ncols=True)
-        with open(os.path.join(destination, '_missing_segments.txt'), 'w') as missing_segments:
-            for future in as_completed(futures):
+        if state == DONE:
+            on_skip(i, dest)
+        else:
+            yield i, segment_url, dest
+
+
+def open_pack(destination, storage):
+    """
+    :param storage: 'files' to save one file per segment, or 'pack' to append segments to a single pack file.
+    :return: The destination's :class:`segment_pack.SegmentPack`, or None if segments are saved as files.
+    """
+    if storage == 'pack':
+        return SegmentPack(destination)
+    elif storage != 'files':
+        raise ValueError("Unknown segment storage: " + storage)
+    return None
+
+
+def bounded_as_completed(executor, fn, items, window, admit=None):
+    """
+    Submit ``fn(item)`` for each item, keeping no more than ``window`` futures outstanding.
+    Items are pulled from the iterable only as room frees up.
+
+    :param admit: Optional callable taking an item, that returns False while the item has to wait for outstanding
+                  futures to complete before it's submitted.
+    :return: Generator of (item, future) in order of completion.
+    """
+    pending = {}
+    for item in items:
+        while len(pending) >= window or (pending and admit and not admit(item)):
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+        pending[executor.submit(fn, item)] = item
+    for future in as_completed(pending):
+        yield pending[future], future
+
+
+class ClipBookkeeping(object):
+    """
+    Records what became of each segment of a clip: in its journal, its missing segments file and a progress bar.
+    Both download engines keep their books with this, so they resume and report the same way.
+    """
+
+    def __init__(self, journal):
+        self.journal = journal
+        # The journal knows how many segments there are if this clip was planned before.
+        self.progressbar = tqdm(total=len(journal) or None, dynamic_ncols=True)
+        self.num_skipped = 0
+        self.num_missing_segments = 0
+        self._missing_segments = open(os.path.join(journal.download_dir, '_missing_segments.txt'), 'w')
+
+    def skipped(self, index, dest):
+        """
+        Count a segment that was downloaded before. Meant as the ``on_skip`` of :func:`plan_segments`.
+        """
+        self.num_skipped += 1
+        self.progressbar.update()
+
+    def completed(self, index, size):
+        self.journal.mark_done(index, size)
+        self.progressbar.update()
+
+    def missing(self, index, clip_url):
+        self._missing_segments.write(clip_url + '\n')
+        self.journal.mark_missing(index)
+        self.num_missing_segments += 1
+        self.progressbar.update()
+
+    def record(self, index, fetch_result):
+        """
+        :param fetch_result: Callable that returns the segment's size, or raises :class:`MissingSegmentError`.
+        """
+        try:
+            self.completed(index, fetch_result())
+        except MissingSegmentError as e:
+            self.missing(index, e.clip_url)
+
+    def close(self):
+        self.progressbar.close()
+        self._missing_segments.close()
+        print("{} segments were previously downloaded".format(self.num_skipped))
+        report_download_size(self.journal, self.num_missing_segments)
+
+
+def report_download_size(journal, num_missing_segments):
+    if num_missing_segments:
+        log.warning("{} segments were empty and omitted".format(num_missing_segments))
+
+    print("Downloaded {:.1f} MB".format(journal.total_size() / 1024 / 1024))
+
+
+def download_clip(segment_urls, destination, workers=16, engine='threads', adaptive=False, storage='files'):
+    """
+    Download all segments of a clip into a directory, skipping segments that were previously downloaded.
+
+    :param segment_urls: Segment URLs, in timeline order.
+    :param destination: Directory to save segments into.
+    :param workers: Number of download threads, or for the asyncio engine, concurrent requests per host.
+    :param engine: 'threads' for a pool of blocking requests, or 'asyncio' for a single event loop.
+    :param adaptive: Adjust concurrent requests per host to what the server sustains, up to ``workers``.
+    :param storage: 'files' to save one file per segment, or 'pack' to append segments to a single pack file.
+    """
+    if engine == 'asyncio':
+        return download_clip_async(segment_urls, destination, per_host=workers, adaptive=adaptive, storage=storage)
+    elif engine != 'threads':
+        raise ValueError("Unknown download engine: " + engine)
+
+    prepare_destination(destination)
+
+    session = segment_session(workers)
+    pack = open_pack(destination, storage)
+    with DownloadJournal(destination) as journal, pack if pack is not None else nullcontext(), \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        books = ClipBookkeeping(journal)
+
+        def fetch(segment):
+            i, segment_url, dest = segment
+            controller = segment_controller(segment_url, workers) if adaptive else None
+            return download_segment(session, segment_url, dest, controller)
+
+        try:
+            to_fetch = plan_segments(segment_urls, journal, books.skipped, pack)
+            for (i, segment_url, dest), future in bounded_as_completed(executor, fetch, to_fetch, workers * 4):
+                if adaptive:
+                    books.progressbar.set_postfix(concurrency=segment_controller(segment_url, workers).limit,
+                                                  refresh=False)
+                books.record(i, future.result)
+        finally:
+            books.close()
+
+
+def download_clip_async(segment_urls, destination, per_host=64, max_in_flight=2048, adaptive=False,
+                        storage='files'):
+    """
+    Download all segments of a clip from a single asyncio event loop.
+    Resuming, ``.tmp`` files and missing segment handling behave the same as with :func:`download_clip`.
+
+    :param segment_urls: Segment URLs, in timeline order.
+    :param destination: Directory to save segments into.
+    :param per_host: Maximum number of concurrent requests to any one host.
+    :param max_in_flight: Maximum number of concurrent requests overall.
+    :param adaptive: Adjust concurrent requests per host to what the server sustains, up to ``per_host``.
+    :param storage: 'files' to save one file per segment, or 'pack' to append segments to a single pack file.
+    """
+    prepare_destination(destination)
+    pack = open_pack(destination, storage)
+    with DownloadJournal(destination) as journal, pack if pack is not None else nullcontext():
+        books = ClipBookkeeping(journal)
+        try:
+            to_fetch = plan_segments(segment_urls, journal, books.skipped, pack)
+            asyncio.run(_fetch_segments_async(to_fetch, books, per_host, max_in_flight, adaptive))
+        finally:
+            books.close()
+
+
+async def _fetch_segments_async(to_fetch, books, per_host, max_in_flight, adaptive):
+    # Every worker pulls from the same generator, so each segment is fetched exactly once,
+    # and no more than max_in_flight segments have been pulled from it but not yet finished.
+    to_fetch = iter(to_fetch)
+    gates = {}
+
+    async with async_session(per_host, max_in_flight) as http:
+        async def worker(first):
+            for i, segment_url, dest in chain([first], to_fetch):
+                gate = None
+                if adaptive:
+                    controller = segment_controller(segment_url, per_host)
+                    gate = gates.setdefault(controller, AsyncGate(controller))
+                    books.progressbar.set_postfix(concurrency=controller.limit, refresh=False)
                 try:
-                    future.result()
+                    books.completed(i, await download_segment_async(http, segment_url, dest, gate))
                 except MissingSegmentError as e:
-                    missing_segments.write(e.clip_url + '\n')
-                    num_missing_segments += 1
-                except Exception as e:
-                    print(e)
-                    raise
-                progressbar.update()
-        progressbar.close()
+                    books.missing(i, e.clip_url)
+
+        # A worker is started for each segment pulled until there are max_in_flight of them,
+        # so a clip with only a few segments left to fetch doesn't get thousands of idle workers.
+        workers = [asyncio.ensure_future(worker(segment)) for segment in islice(to_fetch, max_in_flight)]
+        try:
+            await asyncio.gather(*workers)
+        except Exception:
+            for task in workers:
+                task.cancel()
+            raise
+
+
+class SegmentStreamer(object):
+    """
+    Writes downloaded segments to a stream in timeline order.
+    Segments may be added in any order; each one is written as soon as every segment before it has been added.
+    """
+
+    def __init__(self, stream, keep_segments=False, journal=None):
+        """
+        :param stream: Writable binary file object, such as ffmpeg's stdin.
+        :param keep_segments: Keep segment files after writing them, instead of deleting them.
+        :param journal: :class:`journal.DownloadJournal` to mark deleted segments as streamed in.
+        """
+        self.stream = stream
+        self.keep_segments = keep_segments
+        self.journal = journal
+        self.next_index = 0
+        self._buffered = {}
+
+    def add(self, index, segment_path):
+        """
+        :param index: Position of the segment in the timeline.
+        :param segment_path: Path of the downloaded segment, or None if the segment is missing.
+        """
+        self._buffered[index] = segment_path
+        while self.next_index in self._buffered:
+            segment_path = self._buffered.pop(self.next_index)
+            if segment_path:
+                with open(segment_path, 'rb') as segment:
+                    shutil.copyfileobj(segment, self.stream)
+                if not self.keep_segments:
+                    os.remove(segment_path)
+                    if self.journal:
+                        self.journal.mark_streamed(self.next_index)
+            self.next_index += 1
+
+    def __len__(self):
+        return len(self._buffered)
+
+
+def stream_clip(segment_urls, destination, video_out, workers, buffer_size=64, mono=False, keep_segments=False,
+                adaptive=False):
+    """
+    Download the segments of a clip and pipe them into ffmpeg while the download is still in progress.
+    Only works for segments that can be joined end to end, such as MPEG-TS.
+
+    At most ``buffer_size`` segments past the first one not yet written are downloaded at any time,
+    and segments are deleted once written, so the destination never needs to hold the whole clip.
+
+    :param segment_urls: Segment URLs, in timeline order.
+    :param destination: Directory to save segments into while they wait to be written.
+    :param video_out: Path of the video to produce.
+    :param workers: Number of download threads.
+    :param buffer_size: Maximum number of segments downloaded ahead of the next one to be written.
+    :param mono: Downmix audio to mono.
+    :param keep_segments: Keep segment files after they have been written.
+    :param adaptive: Adjust concurrent requests per host to what the server sustains, up to ``workers``.
+    """
+    prepare_destination(destination)
+
+    session = segment_session(workers)
+    num_missing_segments = 0
+
+    def fetch(segment):
+        i, segment_url, dest = segment
+        controller = segment_controller(segment_url, workers) if adaptive else None
+        return download_segment(session, segment_url, dest, controller)
+
+    with DownloadJournal(destination) as journal, ffmpeg_pipe_concat(video_out, mono=mono) as ffmpeg_stdin, \
+            ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(os.path.join(destination, '_missing_segments.txt'), 'w') as missing_segments:
+        # The video is written from the start again, so segments deleted once streamed by an earlier run are needed.
+        journal.reset(STREAMED)
+        progressbar = tqdm(total=len(journal) or None, dynamic_ncols=True)
+        streamer = SegmentStreamer(ffmpeg_stdin, keep_segments, journal)
+
+        def skipped(i, dest):
+            streamer.add(i, dest)
+            progressbar.update()
+
+        def admit(segment):
+            return segment[0] < streamer.next_index + buffer_size
+
+        to_fetch = plan_segments(segment_urls, journal, skipped)
+        for (i, segment_url, dest), future in bounded_as_completed(executor, fetch, to_fetch, buffer_size, admit):
+            try:
+                journal.mark_done(i, future.result())
+            except MissingSegmentError as e:
+                missing_segments.write(e.clip_url + '\n')
+                journal.mark_missing(i)
+                num_missing_segments += 1
+                dest = None
+            streamer.add(i, dest)
+            progressbar.update()
+    progressbar.close()
 
     if num_missing_segments:
         log.warning("{} segments were empty and omitted".format(num_missing_segments))
-
-    total_size = sum(os.path.getsize(os.path.join(destination, f)) for f in os.listdir(destination))
-    print("Downloaded {:.1f} MB".format(total_size / 1024 / 1024))
+    print("Wrote {:.1f} MB to {}".format(os.path.getsize(video_out) / 1024 / 1024, video_out))
 
 
 def segment_url_to_timestamp(segment_url):
     return datetime.strptime(''.join(segment_url.split('/')[-3:])[:-4], '%Y%m%d%H%M%S')
 
 
-def write_ffmpeg_concat_file(segments_dir, segment_duration):
+def write_ffmpeg_concat_file(segments_dir, segment_duration, first_segment=0):
+    """
+    :param segment_duration: Duration of segments whose duration can't be read from their headers,
+                             or None to let ffmpeg work it out.
+    :param first_segment: Number of leading segments to leave out.
+    """
     concat_file_path = os.path.join(segments_dir, '_concat.txt')
     print("Writing ffmpeg concat file to " + concat_file_path)
     tmp_out = concat_file_path + '.tmp'
+    sources = concat_sources(segments_dir)[first_segment:]
+    durations = concat_durations(segments_dir, segment_duration)[first_segment:]
     with open(tmp_out, 'w') as concat_file:
-        for filename in segment_files(segments_dir):
-            # Windows ffmpeg needs paths relative to ffmpeg binary.
-            # Linux ffmpeg needs paths relative to the concat file.
-            segment_path = os.path.join(segments_dir, filename) if os.name == 'nt' else filename
+        for segment_path, duration in zip(sources, durations):
             concat_file.write("file '{}'\n".format(segment_path))
             # Be explicit about duration instead of letting ffmpeg infer it.
-            # Otherwise, error accumulates and video lengthens over time.
-            if segment_duration:
-                concat_file.write("duration {}\n".format(segment_duration))
+            # Otherwise, ffmpeg takes the longest stream's duration, error accumulates and video lengthens over time.
+            if duration:
+                concat_file.write("duration {}\n".format(duration))
     if os.path.isfile(concat_file_path):
         os.remove(concat_file_path)
     os.rename(tmp_out, concat_file_path)
     return concat_file_path
 
 
+def concat_durations(segments_dir, segment_duration):
+    """
+    :param segment_duration: Duration of segments whose duration can't be read from their headers.
+    :return: Duration in seconds of each downloaded segment's video, in timeline order.
+    """
+    return [duration or segment_duration for duration in segment_durations(segment_ranges(segments_dir))]
+
+
+def segment_ranges(segments_dir):
+    """
+    :return: List of (path, offset, length) of each downloaded segment's bytes, in timeline order.
+    """
+    if SegmentPack.exists(segments_dir):
+        with SegmentPack(segments_dir) as pack:
+            return [(pack.pack_path, entry.offset, entry.length) for entry in pack.entries()]
+    if DownloadJournal.exists(segments_dir):
+        # The journal knows each segment's size, so the files don't need to be looked at.
+        with DownloadJournal(segments_dir) as journal:
+            return [(os.path.join(segments_dir, filename), 0, size) for filename, size in journal.segment_sizes()]
+    paths = [os.path.join(segments_dir, filename) for filename in segment_files(segments_dir)]
+    return [(path, 0, os.path.getsize(path)) for path in paths]
+
+
+# Errors meaning the kernel can't copy between these two files, rather than that the copy failed.
+_KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+def _kernel_copies():
+    if hasattr(os, 'copy_file_range'):
+        yield lambda src_fd, dst_fd, offset, count: os.copy_file_range(src_fd, dst_fd, count, offset)
+    if hasattr(os, 'sendfile'):
+        yield lambda src_fd, dst_fd, offset, count: os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def append_file_range(src_fd, dst_fd, offset, length):
+    """
+    Append bytes of one file to another without passing them through Python where the platform allows,
+    using ``copy_file_range`` or ``sendfile``, and falling back to reads and writes otherwise.
+
+    :param src_fd: File descriptor to copy from.
+    :param dst_fd: File descriptor to append to, at its current position.
+    :param offset: Position in the source to start copying from.
+    :param length: Number of bytes to copy.
+    """
+    for copy in _kernel_copies():
+        try:
+            while length:
+                copied = copy(src_fd, dst_fd, offset, length)
+                if not copied:
+                    raise EOFError("Source file ended {} bytes early".format(length))
+                offset += copied
+                length -= copied
+            return
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                raise
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    while length:
+        chunk = os.read(src_fd, min(length, 1024 * 1024))
+        if not chunk:
+            raise EOFError("Source file ended {} bytes early".format(length))
+        os.write(dst_fd, chunk)
+        length -= len(chunk)
+
+
+def concat_segments(segments_dir, video_out):
+    """
+    Join downloaded segments into one video by concatenating their bytes.
+    Only valid for formats that can be joined this way, like MPEG-TS, and when nothing needs re-encoding.
+
+    :return: Size of the video in bytes.
+    """
+    print("Concatenating segments in {} to {}".format(segments_dir, video_out))
+    tmp_video_out = get_temp_destination(video_out)
+    dst_fd = os.open(tmp_video_out, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+    src_path, src_fd = None, None
+    try:
+        for path, offset, length in segment_ranges(segments_dir):
+            # All segments in a pack come from the same file, so it is only opened once.
+            if path != src_path:
+                if src_fd is not None:
+                    os.close(src_fd)
+                src_path, src_fd = path, os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            append_file_range(src_fd, dst_fd, offset, length)
+        size = os.lseek(dst_fd, 0, os.SEEK_CUR)
+    finally:
+        if src_fd is not None:
+            os.close(src_fd)
+        os.close(dst_fd)
+    os.replace(tmp_video_out, video_out)
+    return size
+
+
+def concat_sources(segments_dir):
+    """
+    :return: Paths or URLs of downloaded segments as ffmpeg's concat demuxer should read them, in timeline order.
+    """
+    if SegmentPack.exists(segments_dir):
+        # Segments in a pack are read in place, as byte ranges of the pack file.
+        with SegmentPack(segments_dir) as pack:
+            pack_path = os.path.abspath(pack.pack_path)
+            return ['subfile,,start,{},end,{},,:{}'.format(entry.offset, entry.offset + entry.length, pack_path)
+                    for entry in pack.entries()]
+    # Windows ffmpeg needs paths relative to ffmpeg binary.
+    # Linux ffmpeg needs paths relative to the concat file.
+    if os.name == 'nt':
+        return [os.path.join(segments_dir, filename) for filename in segment_files(segments_dir)]
+    return segment_files(segments_dir)
+
+
 def segment_files(segments_dir):
+    if DownloadJournal.exists(segments_dir):
+        with DownloadJournal(segments_dir) as journal:
+            return journal.segment_files()
     return sorted(filter(lambda filename: not filename.startswith('_'), os.listdir(segments_dir)))
@@ -0,0 +1,83 @@
+"""
+Frame-accurate clipping that only re-encodes the start of a clip.
+
+A stream-copied clip has to start on a keyframe. To start exactly where asked instead, the frames from there up to
+the next keyframe are re-encoded with the source's codec, everything from that keyframe on is copied, and the two
+parts are joined. The end of a clip needs no re-encoding: frames before a cut never depend on frames after it in
+the codecs InsInc serves, which have no B-frames.
+
+Joined parts only decode as one stream if the encoder sets the codec up the same way as the source's encoder did.
+If it doesn't, or ffmpeg can't encode the source's codec at all (like WMV9), the clip falls back to a copy cut
+starting on the keyframe before.
+"""
+import os
+from subprocess import check_call
+
+from ffmpeg import clip_video, cut_args, ffmpeg_append, ffprobe_video_stream, get_temp_destination, seek_args
+
+# ffmpeg encoder for each video codec that can be re-encoded.
+ENCODERS = {
+    'wmv1': 'wmv1',
+    'wmv2': 'wmv2',
+    'msmpeg4v2': 'msmpeg4v2',
+    'msmpeg4v3': 'msmpeg4',
+}
+# Quality of the re-encoded frames, on ffmpeg's -q:v scale where lower is better.
+HEAD_QUALITY = 2
+
+
+def smart_clip_video(video_path, ss, to, destination_path, keyframes):
+    """
+    Cut a clip out of a video starting exactly at ``ss``.
+
+    :param ss: Start of the clip in seconds.
+    :param to: End of the clip in seconds.
+    :param keyframes: :class:`keyframe_index.KeyframeIndex` of the video.
+    :return: Where the clip starts in the video, in seconds. This is ``ss``, unless the clip had to be copy-cut from
+             the keyframe before.
+    """
+    next_keyframe = keyframes.at_or_after(ss)
+    if next_keyframe == ss or not len(keyframes):
+        clip_video(video_path, ss, to, destination_path)
+        return ss
+
+    source = ffprobe_video_stream(video_path)
+    encoder = ENCODERS.get(source.get('codec_name'))
+    if encoder:
+        head_end = to if next_keyframe is None else min(next_keyframe, to)
+        head_path = part_path(destination_path, 'head')
+        encode_range(video_path, ss, head_end, encoder, head_path)
+        if head_end == to:
+            # The whole clip is within one group of pictures.
+            os.replace(head_path, destination_path)
+            return ss
+        if ffprobe_video_stream(head_path) == source:
+            body_path = part_path(destination_path, 'body')
+            clip_video(video_path, head_end, to, body_path)
+            ffmpeg_append(head_path, body_path, head_end - ss)
+            os.remove(body_path)
+            os.replace(head_path, destination_path)
+            return ss
+        os.remove(head_path)
+        print("Re-encoded {} video doesn't match the source's codec setup".format(source['codec_name']))
+
+    clip_start = keyframes.at_or_before(ss)
+    print("Cutting {} from the keyframe at {:.3f} instead of {:.3f}".format(destination_path, clip_start, ss))
+    clip_video(video_path, clip_start, to, destination_path)
+    return clip_start
+
+
+def encode_range(video_path, ss, to, encoder, destination_path):
+    """
+    Cut a range out of a video, re-encoding its video with ``encoder`` and copying its other streams.
+    """
+    temp_path = get_temp_destination(destination_path)
+    cmd = ['ffmpeg', '-loglevel', 'error'] + seek_args(ss) + ['-i', video_path] + cut_args(ss, to)
+    cmd.extend(['-c:v', encoder, '-q:v', str(HEAD_QUALITY), temp_path])
+    check_call(cmd)
+    os.replace(temp_path, destination_path)
+
+
+def part_path(destination_path, part):
+    root, ext = os.path.splitext(destination_path)
+    return '{}.{}{}'.format(root, part, ext)
@@ -0,0 +1,70 @@
+import importlib.util
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class SegmentServer(object):
+    """
+    Local HTTP server that answers GET requests with canned responses, and records the paths requested.
+    """
+
+    def __init__(self):
+        # Path to a list of (status, body) to answer with in turn. The last one answers any further requests.
+        self.responses = {}
+        self.requested = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requested.append(self.path)
+                    answers = server.responses.get(self.path, [(404, b'')])
+                    status, body = answers.pop(0) if len(answers) > 1 else answers[0]
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve(self, path, *answers):
+        self.responses[path] = list(answers)
+        return self.url(path)
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self._httpd.server_address[1], path)
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def segment_server():
+    server = SegmentServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(scope='session')
+def cli_module():
+    """
+    The councillor-party.py script, imported as a module.
+    It's registered in :data:`sys.modules` so worker processes can find the functions it sends them.
+    """
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'councillor-party.py')
+    spec = importlib.util.spec_from_file_location('councillor_party', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,88 @@
+import os
+import threading
+
+import click
+import pytest
+
+
+def fake_process_download_dir(config, download_dir, delete_after, mono_chunks, smart_cut):
+    name = os.path.basename(download_dir)
+    # Written straight to the file descriptor, like the output of ffmpeg, since pytest swaps out sys.stdout.
+    os.write(1, "Processing {}\n".format(name).encode('utf8'))
+    if name == 'b':
+        raise ValueError("Bad video in " + name)
+    return [name + '.yaml']
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_process_reports_every_failure(tmpdir, monkeypatch, capfd, cli_module, jobs):
+    project_dir = tmpdir.mkdir('council')
+    for name in ['a', 'b', 'c', '_cache']:
+        project_dir.mkdir(name)
+    monkeypatch.setattr(cli_module, 'DOWNLOADS_DIR', str(tmpdir))
+    monkeypatch.setattr(cli_module, 'process_download_dir', fake_process_download_dir)
+
+    with pytest.raises(click.ClickException, match='1 download directories failed'):
+        cli_module.process.callback.__wrapped__({'id': 'council'}, False, None, jobs, 1, False)
+
+    out = capfd.readouterr().out
+    assert out.index("Processing a") < out.index("Processing b") < out.index("Processing c")
+    assert "Processed 2 download directories into 2 videos" in out
+    assert "Failed to process {}".format(project_dir.join('b')) in out
+    assert "ValueError: Bad video in b" in out
+
+
+class FakeProvider(object):
+    """
+    Provider whose first date can't be fetched until the last one has been, so dates must be fetched concurrently.
+    """
+    http_cache = None
+
+    def __init__(self, dates, failing_date=None):
+        self.dates = dates
+        self.failing_date = failing_date
+        self.last_fetched = threading.Event()
+
+    def get_metadata(self, dt):
+        # Dates are parsed from the command line as datetimes.
+        day = dt.to_date_string()
+        if day == self.dates[0]:
+            assert self.last_fetched.wait(5)
+        if day == self.dates[-1]:
+            self.last_fetched.set()
+        if day == self.failing_date:
+            raise ValueError("No metadata for " + day)
+        return [{'date': day}]
+
+
+def run_metadata(tmpdir, monkeypatch, cli_module, provider):
+    monkeypatch.setattr(cli_module, 'METADATA_DIR', str(tmpdir))
+    monkeypatch.setattr(cli_module, 'get_provider_obj', lambda config: provider)
+    for_dates = ','.join(provider.dates)
+    cli_module.metadata.callback.__wrapped__({'id': 'council'}, for_dates, 3)
+
+
+def test_metadata_jobs_saves_dates_in_order(tmpdir, monkeypatch, capsys, cli_module):
+    provider = FakeProvider(['2017-01-03', '2017-01-04', '2017-01-05'])
+    run_metadata(tmpdir, monkeypatch, cli_module, provider)
+
+    out = capsys.readouterr().out
+    assert out.index('2017-01-03') < out.index('2017-01-04') < out.index('2017-01-05')
+    assert sorted(os.listdir(str(tmpdir.join('council')))) == ['2017-01-03.yaml', '2017-01-04.yaml', '2017-01-05.yaml']
+
+
+def test_metadata_jobs_stops_at_a_failed_date(tmpdir, monkeypatch, cli_module):
+    provider = FakeProvider(['2017-01-03', '2017-01-04', '2017-01-05'], failing_date='2017-01-04')
+    with pytest.raises(ValueError, match='No metadata for 2017-01-04'):
+        run_metadata(tmpdir, monkeypatch, cli_module, provider)
+
+    # The date before the failure was saved, and none after it, though it was fetched.
+    assert os.listdir(str(tmpdir.join('council'))) == ['2017-01-03.yaml']
+
+
+def test_automatic_mono_chunks_are_shared_between_jobs(monkeypatch, cli_module):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    assert cli_module.job_mono_chunks(0, 1) == 0
+    assert cli_module.job_mono_chunks(0, 3) == 2
+    assert cli_module.job_mono_chunks(0, 16) == 1
+    assert cli_module.job_mono_chunks(4, 3) == 4
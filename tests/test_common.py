@@ -1,7 +1,10 @@
 import pytest
 
-from common import adjust_timecode
+from common import adjust_timecode, extended_end, SegmentedVideoProvider, VideoMetadata
 from ffmpeg import tempfile_suffix
+from granicus import GranicusScraperApi
+from insinc import InsIncScraperApi
+from neulion import NeulionScraperApi
 
 
 @pytest.mark.parametrize('timecode,adjustment,expected', [
@@ -15,3 +18,20 @@ def test_adjust_timecode(timecode, adjustment, expected):
 def test_tempfile_suffix():
     assert tempfile_suffix('/a/b/c.wmv') == '/a/b/c.tmp.wmv'
     assert tempfile_suffix('/a/b/c.mp4') == '/a/b/c.tmp.mp4'
+
+
+@pytest.mark.parametrize('start_ts,end_ts,expected', [
+    ('2017-01-01T19:00:00+00:00', '2017-01-01T21:00:00+00:00', '2017-01-01T20:00:00+00:00'),
+    ('2017-01-01T19:00:00+00:00', '2017-01-01T20:00:00+00:00', None),
+    ('2017-01-01T19:30:00+00:00', '2017-01-01T21:00:00+00:00', None),
+])
+def test_extended_end(start_ts, end_ts, expected):
+    previous = VideoMetadata('1', start_ts='2017-01-01T19:00:00+00:00', end_ts='2017-01-01T20:00:00+00:00')
+    assert extended_end(previous, VideoMetadata('1', start_ts=start_ts, end_ts=end_ts)) == expected
+
+
+def test_only_segmented_providers_resolve_segments():
+    assert issubclass(GranicusScraperApi, SegmentedVideoProvider)
+    assert issubclass(NeulionScraperApi, SegmentedVideoProvider)
+    assert not issubclass(InsIncScraperApi, SegmentedVideoProvider)
+    assert not hasattr(InsIncScraperApi, 'segment_urls')
@@ -0,0 +1,55 @@
+from concurrency import AimdController, controller_for
+
+
+def test_grows_while_healthy():
+    controller = AimdController(initial=4, maximum=8)
+    for _ in range(200):
+        controller.record_success(0.1, 1000)
+    assert controller.limit == 8
+
+
+def test_throttle_cuts_once_per_window():
+    controller = AimdController(initial=16, maximum=16)
+    backoff = controller.record_throttle()
+    assert controller.limit == 8
+    assert 0 < backoff <= controller.base_backoff
+    # A burst of throttled responses from requests already in flight only counts once.
+    controller.record_throttle()
+    assert controller.limit == 8
+
+
+def test_slow_responses_cut_limit():
+    controller = AimdController(initial=16, maximum=16)
+    controller.record_success(0.1, 1000)
+    controller.record_success(1.0, 1000)
+    assert controller.limit == 8
+
+
+def test_slots():
+    controller = AimdController(initial=2, maximum=2)
+    assert controller.try_acquire()
+    assert controller.try_acquire()
+    assert not controller.try_acquire()
+    controller.release()
+    assert controller.in_flight == 1
+
+
+def test_one_fast_response_does_not_set_the_baseline_for_good():
+    controller = AimdController(initial=16, maximum=16, latency_samples=10)
+    controller.record_success(0.01, 1000)
+    for _ in range(200):
+        controller.record_success(0.1, 1000)
+    # Once the fast response is out of the recent ones, normal responses let the limit grow back.
+    assert controller.limit == 16
+
+
+def test_sustained_throttling_keeps_cutting():
+    controller = AimdController(initial=16, maximum=16)
+    for _ in range(20):
+        controller.record_throttle()
+    assert controller.limit == 1
+
+
+def test_hosts_with_different_settings_get_their_own_controllers():
+    assert controller_for('example.com', maximum=4) is controller_for('example.com', maximum=4)
+    assert controller_for('example.com', maximum=8).maximum == 8
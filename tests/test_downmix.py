@@ -0,0 +1,82 @@
+import pytest
+
+import downmix
+from downmix import adts_frames, chunk_bounds, encode_chunk
+
+
+def adts_frame(payload):
+    length = 7 + len(payload)
+    header = bytes([0xFF, 0xF1, 0x4C, 0x40 | (length >> 11), (length >> 3) & 0xFF, ((length & 0x7) << 5) | 0x1F,
+                    0xFC])
+    return header + payload
+
+
+def test_adts_frames():
+    frames = [adts_frame(b'a' * 10), adts_frame(b''), adts_frame(b'c' * 300)]
+    assert list(adts_frames(b''.join(frames))) == frames
+
+
+def test_adts_frames_lost_sync():
+    with pytest.raises(ValueError):
+        list(adts_frames(adts_frame(b'a') + b'\x00' * 7))
+
+
+def test_chunk_bounds_fall_on_the_frame_grid():
+    # An hour at 48 kHz, plus a partial frame.
+    num_samples = 3600 * 48000 + 100
+    bounds = chunk_bounds(num_samples, 48000, 4)
+    assert bounds == [0, 42187, 84375, 126562, None]
+
+
+def test_chunk_bounds_keep_chunks_long_enough():
+    # Twelve minutes only makes two chunks of at least five minutes.
+    assert chunk_bounds(12 * 60 * 44100, 44100, 8) == [0, 15503, None]
+    assert chunk_bounds(60 * 44100, 44100, 8) == [0, None]
+
+
+def fake_encoder(monkeypatch, total_frames):
+    """
+    Stand in for ffmpeg encoding a chunk of a 48 kHz track of ``total_frames`` frames, writing a priming frame,
+    then one numbered frame per input frame.
+
+    :return: List of the commands run.
+    """
+    commands = []
+
+    def check_call(cmd):
+        commands.append(cmd)
+        start = float(cmd[cmd.index('-ss') + 1]) if '-ss' in cmd else 0
+        duration = float(cmd[cmd.index('-t') + 1]) if '-t' in cmd else total_frames * 1024 / 48000 - start
+        first = round(start * 48000 / 1024)
+        last = min(first + round(duration * 48000 / 1024), total_frames)
+        frames = [adts_frame(b'priming')] + [adts_frame(str(n).encode('utf8')) for n in range(first, last)]
+        with open(cmd[-1], 'wb') as outf:
+            outf.write(b''.join(frames))
+    monkeypatch.setattr(downmix, 'check_call', check_call)
+    return commands
+
+
+def frame_numbers(data):
+    return [int(frame[7:]) for frame in adts_frames(data)]
+
+
+def test_encode_chunk_keeps_only_its_own_frames(tmpdir, monkeypatch):
+    commands = fake_encoder(monkeypatch, 1000)
+    chunk_path = str(tmpdir.join('chunk.aac'))
+
+    assert frame_numbers(encode_chunk('mono.w64', 48000, 300, 600, 47, chunk_path)) == list(range(300, 600))
+    # Encoded from 47 frames before the chunk to 47 frames after it.
+    assert commands[0][3:7] == ['-ss', '{:.6f}'.format(253 * 1024 / 48000), '-i', 'mono.w64']
+    assert commands[0][7:9] == ['-t', '{:.6f}'.format(394 * 1024 / 48000)]
+
+    # The first chunk has nothing before it to preroll, and the last runs to the end of the track.
+    assert frame_numbers(encode_chunk('mono.w64', 48000, 0, 300, 47, chunk_path)) == list(range(0, 300))
+    assert '-ss' not in commands[1]
+    assert frame_numbers(encode_chunk('mono.w64', 48000, 600, None, 47, chunk_path)) == list(range(600, 1000))
+    assert '-t' not in commands[2]
+
+
+def test_encode_chunk_rejects_a_short_encode(tmpdir, monkeypatch):
+    fake_encoder(monkeypatch, 500)
+    with pytest.raises(ValueError, match='frames'):
+        encode_chunk('mono.w64', 48000, 300, 600, 47, str(tmpdir.join('chunk.aac')))
@@ -0,0 +1,33 @@
+import os
+
+import ffmpeg
+from ffmpeg import split_video
+
+
+def test_split_video_gives_each_clip_its_own_range(tmpdir, monkeypatch):
+    commands = []
+
+    def check_call(cmd):
+        commands.append(cmd)
+        for arg in cmd:
+            if '.tmp.' in arg:
+                open(arg, 'wb').close()
+    monkeypatch.setattr(ffmpeg, 'check_call', check_call)
+    clips = [(125.5, 600, str(tmpdir.join('a.wmv'))),
+             (30, 125.5, str(tmpdir.join('b.wmv'))),
+             (4000, 4100.25, str(tmpdir.join('c.wmv')))]
+
+    split_video('meeting.wmv', clips)
+
+    [cmd] = commands
+    # The input is seeked once, to before the earliest clip, keeping source timestamps to cut at.
+    assert cmd[:8] == ['ffmpeg', '-loglevel', 'error', '-ss', '20', '-copyts', '-i', 'meeting.wmv']
+    assert cmd[8:] == [
+        '-map', '0', '-ss', '125.5', '-to', '600', '-c', 'copy', '-output_ts_offset', '-125.5',
+        str(tmpdir.join('a.tmp.wmv')),
+        '-map', '0', '-ss', '30', '-to', '125.5', '-c', 'copy', '-output_ts_offset', '-30',
+        str(tmpdir.join('b.tmp.wmv')),
+        '-map', '0', '-ss', '4000', '-to', '4100.25', '-c', 'copy', '-output_ts_offset', '-4000',
+        str(tmpdir.join('c.tmp.wmv')),
+    ]
+    assert sorted(os.listdir(str(tmpdir))) == ['a.wmv', 'b.wmv', 'c.wmv']
@@ -0,0 +1,59 @@
+import os
+
+from fingerprint import built_segments, fingerprint_inputs, is_up_to_date, record_build, streamed_fingerprint
+
+
+def test_rebuild_only_when_inputs_or_output_change(tmpdir):
+    download_dir = tmpdir.mkdir('segments')
+    for i in range(3):
+        download_dir.join('{:05d}.ts'.format(i)).write_binary(b'segment')
+    download_dir = str(download_dir)
+    video_path = str(tmpdir.join('video.ts'))
+
+    fingerprint = fingerprint_inputs(download_dir, mono=False)
+    assert not is_up_to_date(download_dir, video_path, fingerprint)
+    with open(video_path, 'wb') as video:
+        video.write(b'video')
+    record_build(download_dir, video_path, fingerprint)
+    assert is_up_to_date(download_dir, video_path, fingerprint_inputs(download_dir, mono=False))
+
+    assert not is_up_to_date(download_dir, video_path, fingerprint_inputs(download_dir, mono=True))
+    with open(os.path.join(download_dir, '00003.ts'), 'wb') as segment:
+        segment.write(b'segment')
+    assert not is_up_to_date(download_dir, video_path, fingerprint_inputs(download_dir, mono=False))
+
+    os.remove(video_path)
+    assert not is_up_to_date(download_dir, video_path, fingerprint)
+
+
+def test_built_segments_only_counts_unchanged_prefix(tmpdir):
+    download_dir = tmpdir.mkdir('segments')
+    for i in range(3):
+        download_dir.join('{:05d}.mp4'.format(i)).write_binary(b'segment')
+    download_dir = str(download_dir)
+    video_path = str(tmpdir.join('video.mp4'))
+    with open(video_path, 'wb') as video:
+        video.write(b'video')
+    record_build(download_dir, video_path, fingerprint_inputs(download_dir, mono=False), 3)
+
+    with open(os.path.join(download_dir, '00003.mp4'), 'wb') as segment:
+        segment.write(b'segment')
+    assert built_segments(download_dir, video_path, mono=False) == 3
+    assert built_segments(download_dir, video_path, mono=True) == 0
+
+    with open(os.path.join(download_dir, '00001.mp4'), 'wb') as segment:
+        segment.write(b'replaced segment')
+    assert built_segments(download_dir, video_path, mono=False) == 0
+
+
+def test_streamed_video_is_recorded_explicitly(tmpdir):
+    download_dir = str(tmpdir.mkdir('segments'))
+    video_path = str(tmpdir.join('video.ts'))
+    with open(video_path, 'wb') as video:
+        video.write(b'streamed')
+    assert not is_up_to_date(download_dir, video_path, streamed_fingerprint(mono=False))
+
+    record_build(download_dir, video_path, streamed_fingerprint(mono=False))
+    assert is_up_to_date(download_dir, video_path, streamed_fingerprint(mono=False))
+    assert not is_up_to_date(download_dir, video_path, streamed_fingerprint(mono=True))
+    assert not is_up_to_date(download_dir, video_path, fingerprint_inputs(download_dir, mono=False))
@@ -1,3 +1,4 @@
+import pendulum
 import requests
 
 from granicus import GranicusScraperApi
@@ -33,3 +34,40 @@ def test_get_video_piece_urls():
         assert url.startswith('http')
         if i < 3:
             assert requests.head(url).ok
+
+
+LISTING = """<table class="listingTable"></table><table class="listingTable">
+<tr><td>Regular Council (Jan. 9, 2017)</td><td>Jan. 9, 2017</td><td></td><td></td>
+<td><a onclick="window.open('http://x/MediaPlayer.php?view_id=1&clip_id=101','player','')">Video</a></td></tr>
+<tr><td>Public Hearing (Jan. 9, 2017)</td><td>Jan. 9, 2017</td><td></td><td></td>
+<td><a onclick="window.open('http://x/MediaPlayer.php?view_id=1&clip_id=102','player','')">Video</a></td></tr>
+</table>"""
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        status_code = 304 if headers and headers.get('If-None-Match') == '"v1"' else 200
+        return FakeResponse(status_code, LISTING, {'ETag': '"v1"'})
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, text, headers):
+        self.status_code, self.text, self.headers = status_code, text, headers
+
+    def raise_for_status(self):
+        pass
+
+
+def test_listing_is_parsed_once_and_revalidated(tmpdir):
+    for run in range(2):
+        cached_api = GranicusScraperApi(SURREY_URL, cache_dir=str(tmpdir))
+        cached_api.session = FakeSession()
+        assert [video.video_id for video in cached_api.get_metadata(pendulum.Date(2017, 1, 9))] == ['101', '102']
+        assert list(cached_api.available_dates(pendulum.parse('2017-01-01'), pendulum.parse('2017-02-01'))) == \
+            [pendulum.Date(2017, 1, 9)]
+        assert len(cached_api.session.requests) == 1
+    assert cached_api.session.requests == [{'If-None-Match': '"v1"'}]
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+import yaml
+from bs4 import SoupStrainer
+
+import neulion
+from html_parsing import parse_html
+from neulion import NeulionScraperApi
+
+CLIPS = """<div class="results">
+<tr><td>2016-07-25</td><td class="gameDate"><a onclick="initClip('x.mp4')">Regular Council</a></td>
+<input type="hidden" name="clip_id" value="1"></tr>
+<tr><td>2016-07-25</td><td class="gameDate"><a onclick="initClip('y.mp4')">Delegation</a></td>
+<input type="hidden" name="clip_id" value="2"></tr>
+</div>"""
+
+
+def rows(soup):
+    return [([td.text for td in tr.find_all('td')], [inp['value'] for inp in tr.find_all('input')])
+            for tr in soup.find_all('tr')]
+
+
+@pytest.mark.parametrize('parser', ['html.parser', 'lxml'])
+def test_strained_rows_match_full_parse(parser):
+    pytest.importorskip(parser.split('.')[0])
+    strained = parse_html(CLIPS, SoupStrainer('tr'), parser)
+    assert strained.find('div') is None
+    assert rows(strained) == rows(parse_html(CLIPS, parser='html.parser'))
+    assert rows(strained)[1] == (['2016-07-25', 'Delegation'], ['2'])
+
+
+CASSETTES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cassettes')
+
+
+def recorded_pages(cassette_name):
+    """
+    :return: Dict of URL to the body of each page recorded in a cassette.
+    """
+    with open(os.path.join(CASSETTES_DIR, cassette_name + '.yaml')) as inf:
+        interactions = yaml.safe_load(inf)['interactions']
+    return {interaction['request']['uri']: interaction['response']['body']['string']
+            for interaction in interactions}
+
+
+def neulion_metadata(pages, parser):
+    """
+    Scrape recorded Neulion pages the way :class:`neulion.NeulionScraperApi` does, with the given parser.
+    """
+    site_url = next(url for url in pages if 'clipmanager' not in url)
+    api = NeulionScraperApi(site_url)
+    api._site_soup = parse_html(pages[site_url], neulion.SITE_STRAINER, parser)
+    clips = [vars(clip) for url, page in pages.items() if 'clipmanager' in url
+             for clip in api._parse_clips(parse_html(page, neulion.CLIPS_STRAINER, parser))]
+    return list(api.projects()), list(api.allowed_dates()), clips
+
+
+@pytest.mark.parametrize('cassette_name', sorted(name[:-len('.yaml')] for name in os.listdir(CASSETTES_DIR)))
+def test_lxml_scrapes_recorded_pages_like_html_parser(cassette_name):
+    pytest.importorskip('lxml')
+    pages = recorded_pages(cassette_name)
+    projects, allowed_dates, clips = neulion_metadata(pages, 'lxml')
+    assert projects and allowed_dates
+    assert clips or not any('clipmanager' in url for url in pages)
+    assert (projects, allowed_dates, clips) == neulion_metadata(pages, 'html.parser')
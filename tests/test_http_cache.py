@@ -0,0 +1,56 @@
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from http_cache import ResponseCache
+
+
+class FakeSession(object):
+    def __init__(self, etag='"v1"'):
+        self.etag = etag
+        self.requests = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url, headers))
+        resp = Response()
+        resp.url = url
+        resp.encoding = 'utf-8'
+        resp.headers = CaseInsensitiveDict({'ETag': self.etag})
+        if headers.get('If-None-Match') == self.etag:
+            resp.status_code, resp._content = 304, b''
+        else:
+            resp.status_code, resp._content = 200, 'Café {}'.format(kwargs).encode('utf8')
+        return resp
+
+
+def test_fresh_responses_are_reused(tmpdir):
+    cache, session = ResponseCache(str(tmpdir)), FakeSession()
+    first = cache.request(session, 'POST', 'http://x/search', 60, data={'rsargs[]': ['2017', '01']})
+    second = cache.request(session, 'POST', 'http://x/search', 60, data={'rsargs[]': ['2017', '01']})
+    assert second.text == first.text and second.text.startswith('Café')
+    cache.request(session, 'POST', 'http://x/search', 60, data={'rsargs[]': ['2017', '02']})
+    assert len(session.requests) == 2
+    assert ResponseCache(str(tmpdir)).request(session, 'POST', 'http://x/search', 60,
+                                              data={'rsargs[]': ['2017', '02']}).ok
+    assert cache.stats() == {'hits': 1, 'revalidated': 0, 'misses': 2}
+
+
+def test_stale_responses_are_revalidated(tmpdir):
+    cache, session = ResponseCache(str(tmpdir)), FakeSession()
+    first = cache.request(session, 'GET', 'http://x/page', 0)
+    assert cache.request(session, 'GET', 'http://x/page', 0).text == first.text
+    assert session.requests[1][2] == {'If-None-Match': '"v1"'}
+
+    session.etag = '"v2"'
+    assert cache.request(session, 'GET', 'http://x/page', 0).status_code == 200
+    assert cache.stats() == {'hits': 0, 'revalidated': 1, 'misses': 2}
+
+
+def test_least_recently_used_responses_are_evicted(tmpdir):
+    cache, session = ResponseCache(str(tmpdir), max_bytes=400), FakeSession()
+    for page in ('a', 'b', 'a', 'c'):
+        cache.request(session, 'GET', 'http://x/' + page, None)
+    assert [url for _, url, _ in session.requests] == ['http://x/a', 'http://x/b', 'http://x/c']
+    assert len(tmpdir.listdir()) == 2
+    cache.request(session, 'GET', 'http://x/a', None)
+    cache.request(session, 'GET', 'http://x/b', None)
+    assert session.requests[-1][1] == 'http://x/b'
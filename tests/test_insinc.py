@@ -1,7 +1,15 @@
+import os
+
+import pendulum
+import pytest
 import vcr
 from datetime import date
+from requests import Response
 
+import insinc
+from common import TimeCode, VideoMetadata
 from insinc import InsIncScraperApi, group_clips
+from keyframe_index import KeyframeIndex
 
 api = InsIncScraperApi('http://coquitlam.insinc.com')
 
@@ -20,3 +28,97 @@ def test_get_clips():
         print(clip)
     grouped = group_clips(clips)
     assert len(grouped) == 2
+
+
+class FakeCalendarSession(object):
+    def __init__(self):
+        self.months = []
+
+    def request(self, method, url, headers=None, data=None):
+        year, month = data['rsargs[]']
+        self.months.append((year, month))
+        resp = Response()
+        resp.status_code, resp.url, resp.encoding = 200, url, 'utf-8'
+        resp._content = "javascript: write_date_string(\\'{}-{}-15\\')".format(year, month).encode('utf8')
+        return resp
+
+
+def test_available_dates_memoizes_past_months(tmpdir):
+    end_date = pendulum.today().date()
+    start_date = end_date.subtract(months=11)
+    for run in range(2):
+        cached_api = InsIncScraperApi('http://coquitlam.insinc.com', cache_dir=str(tmpdir))
+        cached_api.session = FakeCalendarSession()
+        dates = list(cached_api.available_dates(start_date, end_date))
+        assert dates == sorted(dates)
+        assert len(dates) in (11, 12)
+    # Only months that may still have recordings published are fetched again.
+    assert len(cached_api.session.months) <= 2
+
+
+def meeting():
+    return VideoMetadata(video_id='meeting', title='Council', category='Council', start_ts='2017-01-03T00:10:00',
+                         end_ts='00:40:00', url='mms://example.com/meeting.wmv',
+                         timecodes=[TimeCode('00:10:00', 'Call to order', '00:12:00')])
+
+
+def fake_cutting(monkeypatch, smart_cut_start):
+    """
+    Stand in for ffmpeg, with keyframes at 595 and 610 seconds, and smart cuts starting at ``smart_cut_start``.
+
+    :return: List of the cuts made, by name.
+    """
+    cuts = []
+
+    def cut(name, start, destination_path):
+        cuts.append((name, os.path.basename(destination_path)))
+        open(destination_path, 'wb').close()
+        return start
+    monkeypatch.setattr(KeyframeIndex, 'for_video', classmethod(lambda cls, video_path: cls([0.0, 595.0, 610.0])))
+    monkeypatch.setattr(insinc, 'smart_clip_video',
+                        lambda video_path, ss, to, path, keyframes: cut('smart', smart_cut_start, path))
+    monkeypatch.setattr(insinc, 'clip_video', lambda video_path, ss, to, path: cut('copy', ss, path))
+    monkeypatch.setattr(insinc, 'split_video',
+                        lambda video_path, clips: [cut('copy', ss, path) for ss, _, path in clips])
+    return cuts
+
+
+def postprocess(tmpdir, smart_cut):
+    download_dir = tmpdir.ensure_dir('downloads')
+    download_dir.ensure('meeting.wmv')
+    [info] = api.postprocess_all([meeting()], str(download_dir), str(tmpdir.ensure_dir('videos')), smart_cut=smart_cut)
+    return info
+
+
+def test_smart_cut_rerun_keeps_the_start_of_a_fallback_cut(tmpdir, monkeypatch):
+    cuts = fake_cutting(monkeypatch, smart_cut_start=595.0)
+    for run in range(2):
+        info = postprocess(tmpdir, smart_cut=True)
+        # The smart cut fell back to the keyframe five seconds before the meeting.
+        assert info.video_metadata.timecodes[0].start_ts == '00:00:05'
+    assert cuts == [('smart', 'meeting.001000_004000_exact.wmv')]
+
+
+def test_cut_modes_are_named_apart(tmpdir, monkeypatch):
+    cuts = fake_cutting(monkeypatch, smart_cut_start=600.0)
+    assert postprocess(tmpdir, smart_cut=True).video_metadata.timecodes[0].start_ts == '00:00:00'
+    assert postprocess(tmpdir, smart_cut=False).video_metadata.timecodes[0].start_ts == '00:00:05'
+    assert cuts == [('smart', 'meeting.001000_004000_exact.wmv'), ('copy', 'meeting.001000_004000.wmv')]
+
+
+@pytest.mark.parametrize('duration, start', [(1800.0, '00:00:00'), (1805.0, '00:00:05')])
+def test_clip_without_a_recorded_start_is_measured(tmpdir, monkeypatch, duration, start):
+    cuts = fake_cutting(monkeypatch, smart_cut_start=None)
+    monkeypatch.setattr(insinc, 'ffmpeg_duration', lambda video_path: duration)
+    tmpdir.ensure('videos', 'meeting.001000_004000_exact.wmv')
+
+    assert postprocess(tmpdir, smart_cut=True).video_metadata.timecodes[0].start_ts == start
+    assert cuts == []
+    assert tmpdir.join('videos', 'meeting.001000_004000_exact.wmv.start').check()
+
+
+def test_existing_clips_are_not_indexed(tmpdir, monkeypatch):
+    fake_cutting(monkeypatch, smart_cut_start=600.0)
+    postprocess(tmpdir, smart_cut=False)
+    monkeypatch.setattr(KeyframeIndex, 'for_video', None)
+    assert postprocess(tmpdir, smart_cut=False).video_metadata.timecodes[0].start_ts == '00:00:05'
@@ -0,0 +1,22 @@
+from journal import DownloadJournal, PENDING, DONE, MISSING
+
+
+def test_plan_and_resume(tmpdir):
+    download_dir = str(tmpdir)
+    with DownloadJournal(download_dir) as journal:
+        for i in range(3):
+            assert journal.plan_segment(i, 'http://a/{}.ts'.format(i), '{:05d}.ts'.format(i)) == PENDING
+        journal.mark_done(1, 100)
+        journal.mark_missing(2)
+
+    assert DownloadJournal.exists(download_dir)
+    with DownloadJournal(download_dir) as journal:
+        # Planning again must not forget what was already downloaded.
+        states = [journal.plan_segment(i, 'http://a/{}.ts'.format(i), '{:05d}.ts'.format(i)) for i in range(4)]
+        assert states == [PENDING, DONE, MISSING, PENDING]
+        assert len(journal) == 4
+        assert journal.count(DONE) == 1
+        assert journal.count(MISSING) == 1
+        assert journal.segment_files() == ['00001.ts']
+        assert journal.missing_urls() == ['http://a/2.ts']
+        assert journal.total_size() == 100
@@ -0,0 +1,30 @@
+import keyframe_index
+from keyframe_index import KeyframeIndex
+
+
+def test_lookups():
+    index = KeyframeIndex([0.046, 2.046, 4.046])
+    assert index.at_or_before(3) == 2.046
+    assert index.at_or_before(2.046) == 2.046
+    assert index.at_or_before(0) == 0
+    assert index.at_or_after(3) == 4.046
+    assert index.at_or_after(5) is None
+
+
+def test_index_is_cached_until_video_changes(tmpdir, monkeypatch):
+    scans = []
+
+    def scan(video_path):
+        scans.append(video_path)
+        return [2.0, 0.0]
+
+    monkeypatch.setattr(keyframe_index, 'ffprobe_keyframe_times', scan)
+    video = tmpdir.join('video.wmv')
+    video.write_binary(b'video')
+    assert KeyframeIndex.for_video(str(video)).keyframes == [0.0, 2.0]
+    assert KeyframeIndex.for_video(str(video)).keyframes == [0.0, 2.0]
+    assert len(scans) == 1
+
+    video.write_binary(b'longer video')
+    KeyframeIndex.for_video(str(video))
+    assert len(scans) == 2
@@ -0,0 +1,72 @@
+import struct
+
+from media_duration import AUDIO, VIDEO, buffer_durations, segment_durations
+
+
+def box(box_type, *payloads):
+    payload = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload, version=0, flags=0):
+    return box(box_type, struct.pack('>I', version << 24 | flags) + payload)
+
+
+def trak(track_id, handler, timescale, duration):
+    return box(b'trak',
+               full_box(b'tkhd', struct.pack('>III', 0, 0, track_id) + bytes(68)),
+               box(b'mdia',
+                   full_box(b'mdhd', struct.pack('>IIIIHH', 0, 0, timescale, duration, 0, 0)),
+                   full_box(b'hdlr', struct.pack('>I4s', 0, handler) + bytes(13))))
+
+
+def test_mp4_track_durations():
+    mp4 = box(b'ftyp', b'isom') + box(b'moov',
+                                      full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 2022) + bytes(80)),
+                                      trak(1, b'vide', 10240, 20480),
+                                      trak(2, b'soun', 48000, 97056)) + box(b'mdat', bytes(1000))
+    assert buffer_durations(mp4) == {VIDEO: 2.0, AUDIO: 2.022}
+
+
+def test_fragmented_mp4_durations():
+    init = box(b'ftyp', b'iso5') + box(b'moov', trak(1, b'vide', 90000, 0),
+                                        box(b'mvex', full_box(b'trex', struct.pack('>IIIII', 1, 1, 3000, 0, 0))))
+    fragments = b''
+    for decode_time in (180000, 270000):
+        # 30 samples using the default duration from trex.
+        fragments += box(b'moof', box(b'traf', full_box(b'tfhd', struct.pack('>I', 1)),
+                                      full_box(b'tfdt', struct.pack('>Q', decode_time), version=1),
+                                      full_box(b'trun', struct.pack('>I', 30))))
+        fragments += box(b'mdat', bytes(100))
+    assert buffer_durations(init + fragments) == {VIDEO: 2.0}
+
+
+def ts_packet(pid, stream_id=None, pts=None):
+    header = struct.pack('>BHB', 0x47, (0x4000 if pts is not None else 0) | pid, 0x10)
+    payload = b''
+    if pts is not None:
+        pts_bytes = bytes([0x21 | (pts >> 29) & 0xe, (pts >> 22) & 0xff, 0x1 | (pts >> 14) & 0xfe,
+                           (pts >> 7) & 0xff, 0x1 | (pts << 1) & 0xfe])
+        payload = b'\x00\x00\x01' + bytes([stream_id]) + b'\x00\x00\x80\x80\x05' + pts_bytes
+    return (header + payload).ljust(188, b'\xff')
+
+
+def test_ts_durations_across_timestamp_wraparound():
+    start = (1 << 33) - 90000
+    packets = []
+    for frame in range(60):
+        packets.append(ts_packet(0x100, 0xe0, (start + frame * 3000) % (1 << 33)))
+        packets.append(ts_packet(0x100))
+        if frame % 2 == 0:
+            packets.append(ts_packet(0x101, 0xc0, (start + frame * 3000) % (1 << 33)))
+    durations = buffer_durations(b''.join(packets))
+    assert durations[VIDEO] == 2.0
+    assert durations[AUDIO] == 2.0
+
+
+def test_segment_durations_of_pack(tmpdir):
+    mp4 = box(b'ftyp', b'isom') + box(b'moov', trak(1, b'vide', 1000, 2000))
+    pack = tmpdir.join('pack')
+    pack.write_binary(mp4 + b'not a segment' + mp4)
+    ranges = [(str(pack), 0, len(mp4)), (str(pack), len(mp4), 13), (str(pack), len(mp4) + 13, len(mp4))]
+    assert list(segment_durations(ranges)) == [2.0, None, 2.0]
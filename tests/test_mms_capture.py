@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+import mms_capture
+from mms_capture import StitchError, find_seams, stitch_parts, write_stream_concat_file
+
+
+class FakeTimelines(object):
+    """
+    Stands in for ffprobe on captured parts, with packet timestamps of each stream of each part made up by the test.
+    """
+
+    def __init__(self, monkeypatch, timelines):
+        """
+        :param timelines: Dict of part path to a dict of stream index to the part's packet timestamps.
+        """
+        self.timelines = timelines
+        monkeypatch.setattr(mms_capture, 'ffprobe_stream_start_times', self.start_times)
+        monkeypatch.setattr(mms_capture, 'ffprobe_packet_times', self.packet_times)
+
+    def start_times(self, path):
+        return {stream_index: times[0] for stream_index, times in self.timelines[path].items()}
+
+    def packet_times(self, path, stream_index, start, duration):
+        return [t for t in self.timelines[path][stream_index] if start <= t <= start + duration]
+
+
+def packets(start, end, step):
+    return [round(start + i * step, 3) for i in range(int((end - start) / step) + 1)]
+
+
+def three_parts(tmpdir):
+    paths = [str(tmpdir.join('video.part{}.wmv'.format(i))) for i in range(3)]
+    # Each part starts at the keyframe before its range, and runs on past the start of the next part.
+    return paths, {
+        paths[0]: {0: packets(0, 50, 0.5), 1: packets(0.02, 50, 0.25)},
+        paths[1]: {0: packets(18.0, 90, 0.5), 1: packets(17.97, 90, 0.25)},
+        paths[2]: {0: packets(40.5, 60, 0.5), 1: packets(40.47, 60, 0.25)},
+    }
+
+
+def test_find_seams_at_the_start_of_each_stream_of_the_next_part(tmpdir, monkeypatch):
+    paths, timelines = three_parts(tmpdir)
+    FakeTimelines(monkeypatch, timelines)
+    assert find_seams(paths) == [{0: 18.0, 1: 17.97}, {0: 40.5, 1: 40.47}]
+
+
+def test_find_seams_rejects_a_gap(tmpdir, monkeypatch):
+    paths, timelines = three_parts(tmpdir)
+    # The first part was cut off before reaching where the second part's audio starts.
+    timelines[paths[0]][1] = packets(0.02, 17.5, 0.25)
+    FakeTimelines(monkeypatch, timelines)
+    with pytest.raises(StitchError, match='ends before'):
+        find_seams(paths)
+
+
+def test_find_seams_rejects_a_part_that_did_not_seek(tmpdir, monkeypatch):
+    paths, timelines = three_parts(tmpdir)
+    timelines[paths[2]] = {0: packets(0, 60, 0.5), 1: packets(0.02, 60, 0.25)}
+    FakeTimelines(monkeypatch, timelines)
+    with pytest.raises(StitchError, match='ignore seeking'):
+        find_seams(paths)
+
+
+def test_find_seams_rejects_different_streams(tmpdir, monkeypatch):
+    paths, timelines = three_parts(tmpdir)
+    del timelines[paths[1]][1]
+    FakeTimelines(monkeypatch, timelines)
+    with pytest.raises(StitchError, match='different streams'):
+        find_seams(paths)
+
+
+def fake_ffmpeg(monkeypatch, duration):
+    """
+    :return: List of the ffmpeg commands run, each with the contents of the concat files it read.
+    """
+    calls = []
+
+    def check_call(cmd):
+        concat_files = [open(cmd[i + 1]).read() for i, arg in enumerate(cmd) if arg == '-i']
+        calls.append((cmd, concat_files))
+        open(cmd[-1], 'wb').close()
+    monkeypatch.setattr(mms_capture, 'check_call', check_call)
+    monkeypatch.setattr(mms_capture, 'ffmpeg_duration', lambda path: duration)
+    return calls
+
+
+def test_stitch_parts_concatenates_each_stream_separately(tmpdir, monkeypatch):
+    paths, timelines = three_parts(tmpdir)
+    FakeTimelines(monkeypatch, timelines)
+    calls = fake_ffmpeg(monkeypatch, 60.0)
+    destination = str(tmpdir.join('video.wmv'))
+
+    stitch_parts(paths, destination, 60.2)
+
+    [(cmd, concat_files)] = calls
+    assert cmd[cmd.index('-map'):] == ['-map', '0:0', '-map', '1:1', '-c', 'copy', str(tmpdir.join('video.tmp.wmv'))]
+    assert 'outpoint 18.0\n' in concat_files[0] and 'inpoint 40.5\n' in concat_files[0]
+    assert 'outpoint 17.97\n' in concat_files[1] and 'inpoint 40.47\n' in concat_files[1]
+    assert sorted(os.listdir(str(tmpdir))) == ['video.wmv']
+
+
+def test_stitch_parts_checks_the_duration(tmpdir, monkeypatch):
+    paths, timelines = three_parts(tmpdir)
+    FakeTimelines(monkeypatch, timelines)
+    fake_ffmpeg(monkeypatch, 45.0)
+    destination = str(tmpdir.join('video.wmv'))
+
+    with pytest.raises(StitchError, match='45.0s long'):
+        stitch_parts(paths, destination, 60.0)
+    assert not os.path.exists(destination)
+
+
+def test_stream_concat_file_cuts_at_seams(tmpdir):
+    part_paths = [str(tmpdir.join('video.part{}.wmv'.format(i))) for i in range(3)]
+    seams = [{0: 18.046, 1: 17.972}, {0: 40.046, 1: 39.98}]
+    concat_file_path = str(tmpdir.join('concat.txt'))
+
+    write_stream_concat_file(part_paths, seams, 1, concat_file_path)
+    assert open(concat_file_path).read().splitlines() == [
+        "file '{}'".format(part_paths[0]),
+        "outpoint 17.972",
+        "file '{}'".format(part_paths[1]),
+        "inpoint 17.972",
+        "outpoint 39.98",
+        "file '{}'".format(part_paths[2]),
+        "inpoint 39.98",
+    ]
@@ -0,0 +1,32 @@
+from common import TimeCode
+from neulion import NeulionClipMetadata, NeulionScraperApi, adaptive_url_to_segment_urls
+
+API = NeulionScraperApi('http://civic.neulion.com/cityofburnaby/')
+
+ROOT_URL = 'adaptive://nlds2.insinc.neulion.com:443/nlds/cacivic/cityofburnaby1/as/live/' \
+           'cityofburnaby1_hd_pc_20160726020201_014407.mp4'
+
+
+def make_root():
+    return NeulionClipMetadata('123', '1', '1', 'Regular Council Meeting', '', '2016-07-25T19:00:00-07:00', ROOT_URL,
+                               'Council', [TimeCode('02:02:00', 'Call to Order', '02:10:00'),
+                                           TimeCode('02:10:00', 'Delegation', '02:20:30'),
+                                           TimeCode('02:20:30', 'Bylaws', '03:46:08')])
+
+
+def test_subclip_by_title():
+    subclip = API.subclip(make_root(), title='delegation')
+    assert subclip.video_id == '123-021000'
+    assert subclip.title == 'Delegation'
+    assert (subclip.start_ts, subclip.end_ts) == ('2016-07-26T02:10:00+00:00', '2016-07-26T02:20:30+00:00')
+    assert [tc.title for tc in subclip.timecodes] == ['Delegation']
+
+    segment_urls = list(adaptive_url_to_segment_urls(subclip.url))
+    assert len(segment_urls) == 315
+    assert segment_urls[0].endswith('/20160726/02/1000.mp4')
+
+
+def test_subclip_by_timecode_is_limited_to_root():
+    subclip = API.subclip(make_root(), timecode='01:40:00-02:00:00')
+    assert (subclip.start_ts, subclip.end_ts) == ('2016-07-26T03:42:01+00:00', '2016-07-26T03:46:08+00:00')
+    assert [tc.title for tc in subclip.timecodes] == []
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+import requests
+
+from journal import DownloadJournal, DONE, MISSING
+from scheduler import DownloadScheduler
+
+
+def serve_clip(server, name, num_segments, missing=(), failing=()):
+    urls = []
+    for i in range(num_segments):
+        if i in missing:
+            answer = 200, b''
+        elif i in failing:
+            answer = 500, b''
+        else:
+            answer = 200, '{}{}'.format(name, i).encode('utf8')
+        urls.append(server.serve('/{}/{:02d}.ts'.format(name, i), answer))
+    return urls
+
+
+def test_clips_share_the_pool(tmpdir, segment_server):
+    scheduler = DownloadScheduler(workers=1)
+    for name in ('a', 'b'):
+        urls = serve_clip(segment_server, name, 12, missing={3} if name == 'b' else ())
+        scheduler.add(name, lambda urls=urls: urls, str(tmpdir.mkdir(name)))
+    scheduler.run()
+
+    requested = segment_server.requested
+    assert len(requested) == 24
+    # Clip b started before clip a finished.
+    assert requested.index('/b/00.ts') < requested.index('/a/11.ts')
+
+    with DownloadJournal(str(tmpdir.join('a'))) as journal:
+        assert journal.count(DONE) == 12
+        assert open(str(tmpdir.join('a', '00005.ts')), 'rb').read() == b'a5'
+    with DownloadJournal(str(tmpdir.join('b'))) as journal:
+        assert journal.count(DONE) == 11
+        assert journal.count(MISSING) == 1
+    assert tmpdir.join('b', '_missing_segments.txt').read() == segment_server.url('/b/03.ts') + '\n'
+
+
+def test_clips_are_closed_when_a_segment_fails(tmpdir, segment_server):
+    scheduler = DownloadScheduler(workers=1)
+    urls = serve_clip(segment_server, 'a', 20, failing={10})
+    scheduler.add('a', lambda: urls, str(tmpdir.mkdir('a')))
+    with pytest.raises(requests.HTTPError):
+        scheduler.run()
+
+    # Segments finished before the failure were committed to the journal, though fewer than a commit's worth.
+    with DownloadJournal(str(tmpdir.join('a'))) as journal:
+        assert journal.count(DONE) >= 10
+    assert os.path.exists(str(tmpdir.join('a', '00009.ts')))
+
+
+def test_clips_are_closed_when_resolving_fails(tmpdir, segment_server):
+    scheduler = DownloadScheduler(workers=1, resolvers=1)
+    urls = serve_clip(segment_server, 'a', 5)
+    scheduler.add('a', lambda: urls, str(tmpdir.mkdir('a')))
+
+    def resolve_b():
+        raise ValueError("No streams")
+    scheduler.add('b', resolve_b, str(tmpdir.mkdir('b')))
+    with pytest.raises(ValueError):
+        scheduler.run()
+
+    # The clip that did start was closed, committing the segments planned so far.
+    with DownloadJournal(str(tmpdir.join('a'))) as journal:
+        assert len(journal) > 0
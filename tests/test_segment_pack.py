@@ -0,0 +1,71 @@
+import os
+
+from segment_pack import SegmentPack, PACK_FILENAME, INDEX_FILENAME
+
+
+def read_entry(pack, entry):
+    with open(pack.pack_path, 'rb') as inf:
+        inf.seek(entry.offset)
+        return inf.read(entry.length)
+
+
+def test_append_and_reopen(tmpdir):
+    download_dir = str(tmpdir)
+    with SegmentPack(download_dir) as pack:
+        pack.append(1, b'second')
+        pack.append(0, b'first')
+
+    assert SegmentPack.exists(download_dir)
+    with SegmentPack(download_dir) as pack:
+        assert len(pack) == 2
+        assert 0 in pack and 2 not in pack
+        entries = pack.entries()
+        assert [entry.index for entry in entries] == [0, 1]
+        assert [read_entry(pack, entry) for entry in entries] == [b'first', b'second']
+        assert pack.total_size() == 11
+
+
+def test_recover_from_interrupted_append(tmpdir):
+    download_dir = str(tmpdir)
+    with SegmentPack(download_dir) as pack:
+        pack.append(0, b'first')
+    # Data written without its index record, and half an index record.
+    with open(os.path.join(download_dir, PACK_FILENAME), 'ab') as f:
+        f.write(b'partial')
+    with open(os.path.join(download_dir, INDEX_FILENAME), 'ab') as f:
+        f.write(b'\x01\x00')
+
+    with SegmentPack(download_dir) as pack:
+        assert len(pack) == 1
+        assert os.path.getsize(pack.pack_path) == 5
+        entry = pack.append(1, b'second')
+        assert entry.offset == 5
+        assert read_entry(pack, entry) == b'second'
+
+
+def test_recover_drops_segments_with_bad_data(tmpdir):
+    download_dir = str(tmpdir)
+    with SegmentPack(download_dir) as pack:
+        pack.append(0, b'first')
+        pack.append(1, b'second')
+        pack.append(2, b'third')
+    # The second segment's data never made it to disk, but its index record did.
+    with open(os.path.join(download_dir, PACK_FILENAME), 'r+b') as f:
+        f.seek(5)
+        f.write(bytes(6))
+
+    with SegmentPack(download_dir) as pack:
+        assert [entry.index for entry in pack.entries()] == [0]
+        assert os.path.getsize(pack.pack_path) == 5
+        assert os.path.getsize(pack.index_path) == 28
+
+
+def test_syncs_in_batches(tmpdir, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, 'fsync', synced.append)
+    with SegmentPack(str(tmpdir)) as pack:
+        for i in range(SegmentPack.SYNC_EVERY * 2 + 1):
+            pack.append(i, b'data')
+        # The pack and its index are synced together, once per batch.
+        assert len(synced) == 4
+    assert len(synced) == 6
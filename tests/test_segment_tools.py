@@ -0,0 +1,189 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pytest
+
+import segment_tools
+from journal import DownloadJournal, DONE, MISSING, STREAMED
+from segment_pack import SegmentPack
+from segment_tools import SegmentStreamer, bounded_as_completed, concat_segments, download_clip, plan_segments, \
+    stream_clip
+
+
+def test_concat_segments_from_files(tmpdir):
+    download_dir = tmpdir.mkdir('segments')
+    for i, data in enumerate([b'one', b'two', b'three']):
+        download_dir.join('{:05d}.ts'.format(i)).write_binary(data)
+    video_out = str(tmpdir.join('video.ts'))
+
+    assert concat_segments(str(download_dir), video_out) == 11
+    assert open(video_out, 'rb').read() == b'onetwothree'
+
+
+def test_concat_segments_from_pack_without_kernel_copy(tmpdir, monkeypatch):
+    download_dir = str(tmpdir.mkdir('segments'))
+    with SegmentPack(download_dir) as pack:
+        pack.append(1, b'two')
+        pack.append(0, b'one')
+    monkeypatch.setattr(segment_tools, '_kernel_copies', lambda: iter(()))
+    video_out = str(tmpdir.join('video.ts'))
+
+    assert concat_segments(download_dir, video_out) == 6
+    assert open(video_out, 'rb').read() == b'onetwo'
+    assert not os.path.exists(str(tmpdir.join('video.tmp.ts')))
+
+
+def test_segment_streamer_writes_in_timeline_order(tmpdir):
+    paths = []
+    for i in range(4):
+        tmpdir.join(str(i)).write_binary(str(i).encode('utf8'))
+        paths.append(str(tmpdir.join(str(i))))
+    stream = io.BytesIO()
+    streamer = SegmentStreamer(stream, keep_segments=True)
+    streamer.add(2, paths[2])
+    streamer.add(1, None)
+    assert stream.getvalue() == b'' and len(streamer) == 2
+    streamer.add(0, paths[0])
+    streamer.add(3, paths[3])
+    assert stream.getvalue() == b'023' and len(streamer) == 0
+
+
+@contextmanager
+def fake_pipe_concat(video_out, mono=False):
+    with open(video_out, 'wb') as outf:
+        yield outf
+
+
+def test_stream_clip_resumes_from_journal(tmpdir, segment_server, monkeypatch):
+    monkeypatch.setattr(segment_tools, 'ffmpeg_pipe_concat', fake_pipe_concat)
+    download_dir = tmpdir.mkdir('segments')
+    urls = [segment_server.serve('/{:02d}.ts'.format(i), (200, b'' if i == 4 else str(i).encode('utf8')))
+            for i in range(10)]
+    # An earlier run downloaded the first segment, and streamed and deleted the second.
+    download_dir.join('00000.ts').write_binary(b'0')
+    with DownloadJournal(str(download_dir)) as journal:
+        journal.plan_segment(0, urls[0], '00000.ts')
+        journal.mark_done(0, 1)
+        journal.plan_segment(1, urls[1], '00001.ts')
+        journal.mark_streamed(1)
+
+    video_out = str(tmpdir.join('video.ts'))
+    stream_clip(iter(urls), str(download_dir), video_out, workers=2, buffer_size=3)
+
+    assert open(video_out, 'rb').read() == b'012356789'
+    assert '/00.ts' not in segment_server.requested
+    assert '/01.ts' in segment_server.requested
+    assert sorted(os.listdir(str(download_dir))) == ['_journal.sqlite', '_missing_segments.txt']
+    with DownloadJournal(str(download_dir)) as journal:
+        assert journal.count(STREAMED) == 9
+        assert journal.count(MISSING) == 1
+        assert journal.count(DONE) == 0
+
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_download_clip_retries_throttles_and_records_missing_segments(tmpdir, segment_server, engine):
+    download_dir = str(tmpdir.mkdir('segments'))
+    urls = [
+        segment_server.serve('/0.ts', (200, b'zero')),
+        segment_server.serve('/1.ts', (429, b''), (200, b'one')),
+        segment_server.url('/2.ts'),
+    ]
+
+    download_clip(urls, download_dir, workers=2, engine=engine, adaptive=True)
+
+    assert segment_server.requested.count('/1.ts') == 2
+    with DownloadJournal(download_dir) as journal:
+        assert journal.count(DONE) == 2
+        assert journal.missing_urls() == [urls[2]]
+        segments = [open(os.path.join(download_dir, name), 'rb').read() for name in journal.segment_files()]
+        assert segments == [b'zero', b'one']
+    assert open(os.path.join(download_dir, '_missing_segments.txt')).read() == urls[2] + '\n'
+
+
+def test_asyncio_engine_starts_a_worker_per_segment_at_most(tmpdir, monkeypatch):
+    tasks = []
+
+    async def fake_download(http, clip_url, dest, gate=None):
+        tasks.append(len(asyncio.all_tasks()))
+        await asyncio.sleep(0)
+        return 1
+    monkeypatch.setattr(segment_tools, 'download_segment_async', fake_download)
+    urls = ['http://example.com/{}.ts'.format(i) for i in range(3)]
+
+    download_clip(urls, str(tmpdir), engine='asyncio')
+    # One worker per segment, besides the task running the download.
+    assert tasks == [4, 4, 4]
+
+
+def test_segment_ranges_come_from_journal(tmpdir, monkeypatch):
+    download_dir = str(tmpdir)
+    with DownloadJournal(download_dir) as journal:
+        for i, size in enumerate([3, 5]):
+            journal.plan_segment(i, 'http://a/{}.ts'.format(i), '{:05d}.ts'.format(i))
+            journal.mark_done(i, size)
+    monkeypatch.setattr(os.path, 'getsize', None)
+    assert segment_tools.segment_ranges(download_dir) == [
+        (os.path.join(download_dir, '00000.ts'), 0, 3), (os.path.join(download_dir, '00001.ts'), 0, 5)]
+
+
+def plan(download_dir, urls, pack=None):
+    skipped = []
+    with DownloadJournal(download_dir) as journal:
+        to_fetch = [i for i, _, _ in plan_segments(urls, journal, lambda i, dest: skipped.append(i), pack)]
+    return to_fetch, skipped
+
+
+def test_plan_adopts_segments_downloaded_before_the_journal(tmpdir):
+    tmpdir.join('00000.ts').write_binary(b'zero')
+    tmpdir.join('00002.ts').write_binary(b'')
+    urls = ['http://a/{}.ts'.format(i) for i in range(3)]
+
+    assert plan(str(tmpdir), urls) == ([1, 2], [0])
+    with DownloadJournal(str(tmpdir)) as journal:
+        assert journal.segment_sizes() == [('00000.ts', 4)]
+
+
+def test_plan_only_adopts_into_an_empty_journal(tmpdir):
+    urls = ['http://a/{}.ts'.format(i) for i in range(2)]
+    with DownloadJournal(str(tmpdir)) as journal:
+        journal.plan_segment(0, urls[0], '00000.ts')
+    # Files that appear after the journal was started aren't trusted.
+    tmpdir.join('00000.ts').write_binary(b'zero')
+    assert plan(str(tmpdir), urls) == ([0, 1], [])
+
+
+def test_plan_does_not_adopt_files_into_a_pack(tmpdir):
+    tmpdir.join('00000.ts').write_binary(b'zero')
+    with SegmentPack(str(tmpdir)) as pack:
+        assert plan(str(tmpdir), ['http://a/0.ts'], pack) == ([0], [])
+
+
+def test_bounded_as_completed_limits_outstanding_futures():
+    pulled = []
+
+    def items():
+        for i in range(50):
+            pulled.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = []
+        for item, future in bounded_as_completed(executor, lambda item: item * 2, items(), 4):
+            # At most 4 items were submitted and not yet yielded, plus the one pulled that waits for room.
+            assert len(pulled) - len(results) <= 5
+            results.append((item, future.result()))
+    assert sorted(results) == [(i, i * 2) for i in range(50)]
+
+
+def test_bounded_as_completed_waits_for_admission():
+    submitted = []
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        completed = []
+        for item, future in bounded_as_completed(executor, submitted.append, range(10), 10,
+                                                 admit=lambda item: item < len(completed) + 2):
+            completed.append(item)
+            assert len(submitted) <= len(completed) + 2
+    assert sorted(completed) == list(range(10))
@@ -0,0 +1,69 @@
+import os
+
+import smart_cut
+from keyframe_index import KeyframeIndex
+
+
+def test_falls_back_to_copy_cut_for_codecs_without_encoder(monkeypatch):
+    cuts = []
+    monkeypatch.setattr(smart_cut, 'ffprobe_video_stream', lambda video_path: {'codec_name': 'wmv3'})
+    monkeypatch.setattr(smart_cut, 'clip_video', lambda *args: cuts.append(args))
+
+    keyframes = KeyframeIndex([0.0, 10.0, 20.0])
+    assert smart_cut.smart_clip_video('in.wmv', 12.5, 30, 'out.wmv', keyframes) == 10.0
+    assert smart_cut.smart_clip_video('in.wmv', 20.0, 30, 'out.wmv', keyframes) == 20.0
+    assert cuts == [('in.wmv', 10.0, 30, 'out.wmv'), ('in.wmv', 20.0, 30, 'out.wmv')]
+
+
+def fake_tools(monkeypatch, head_stream):
+    """
+    Stand in for ffmpeg, probing the source as wmv2 and a re-encoded head as ``head_stream``.
+
+    :return: List of the calls made, by name.
+    """
+    calls = []
+    source = {'codec_name': 'wmv2', 'extradata_hash': 'CRC32:6c45d970'}
+
+    def touch(name, path, *args):
+        calls.append((name,) + args)
+        open(path, 'wb').close()
+    monkeypatch.setattr(smart_cut, 'ffprobe_video_stream',
+                        lambda video_path: head_stream if '.head.' in video_path else source)
+    monkeypatch.setattr(smart_cut, 'encode_range',
+                        lambda video_path, ss, to, encoder, path: touch('encode', path, ss, to, encoder))
+    monkeypatch.setattr(smart_cut, 'clip_video', lambda video_path, ss, to, path: touch('copy', path, ss, to))
+    monkeypatch.setattr(smart_cut, 'ffmpeg_append', lambda video_path, tail_path, duration: calls.append(
+        ('append', os.path.basename(video_path), os.path.basename(tail_path), duration)))
+    return calls
+
+
+def test_reencodes_the_head_when_the_codec_setup_matches(tmpdir, monkeypatch):
+    calls = fake_tools(monkeypatch, {'codec_name': 'wmv2', 'extradata_hash': 'CRC32:6c45d970'})
+    destination = str(tmpdir.join('out.wmv'))
+
+    keyframes = KeyframeIndex([0.0, 10.0, 20.0])
+    assert smart_cut.smart_clip_video('in.wmv', 12.5, 30, destination, keyframes) == 12.5
+    assert calls == [('encode', 12.5, 20.0, 'wmv2'), ('copy', 20.0, 30),
+                     ('append', 'out.head.wmv', 'out.body.wmv', 7.5)]
+    assert os.listdir(str(tmpdir)) == ['out.wmv']
+
+
+def test_reencodes_a_clip_within_one_group_of_pictures(tmpdir, monkeypatch):
+    calls = fake_tools(monkeypatch, None)
+    destination = str(tmpdir.join('out.wmv'))
+
+    keyframes = KeyframeIndex([0.0, 10.0, 20.0])
+    assert smart_cut.smart_clip_video('in.wmv', 12.5, 15, destination, keyframes) == 12.5
+    assert calls == [('encode', 12.5, 15, 'wmv2')]
+    assert os.listdir(str(tmpdir)) == ['out.wmv']
+
+
+def test_falls_back_to_copy_cut_when_the_codec_setup_differs(tmpdir, monkeypatch):
+    # ffmpeg's wmv2 encoder writes different extradata than the encoders InsInc's videos come from.
+    calls = fake_tools(monkeypatch, {'codec_name': 'wmv2', 'extradata_hash': 'CRC32:e0e11714'})
+    destination = str(tmpdir.join('out.wmv'))
+
+    keyframes = KeyframeIndex([0.0, 10.0, 20.0])
+    assert smart_cut.smart_clip_video('in.wmv', 12.5, 30, destination, keyframes) == 10.0
+    assert calls == [('encode', 12.5, 20.0, 'wmv2'), ('copy', 10.0, 30)]
+    assert os.listdir(str(tmpdir)) == ['out.wmv']
@@ -0,0 +1,51 @@
+import socket
+
+from requests.adapters import HTTPAdapter
+
+from transport import API_RETRY, DEFAULT_TIMEOUT, Transport, _CachingResolver, get_transport
+
+
+def test_connections_are_reused(segment_server):
+    url = segment_server.serve('/page', (200, b'page'))
+    transport = Transport(pool_size=2)
+    for _ in range(5):
+        assert transport.session.get(url).content == b'page'
+    assert transport.stats() == {'requests': 5, 'connections': 1, 'reused': 4}
+
+
+def test_default_timeout(segment_server, monkeypatch):
+    url = segment_server.serve('/page', (200, b'page'))
+    timeouts = []
+    send = HTTPAdapter.send
+
+    def recording_send(adapter, request, **kwargs):
+        timeouts.append(kwargs['timeout'])
+        return send(adapter, request, **kwargs)
+    monkeypatch.setattr(HTTPAdapter, 'send', recording_send)
+    session = Transport().session
+    session.get(url)
+    session.get(url, timeout=1)
+    assert timeouts == [DEFAULT_TIMEOUT, 1]
+
+
+def test_only_idempotent_requests_are_retried():
+    assert API_RETRY.is_retry('GET', 503)
+    assert not API_RETRY.is_retry('POST', 503)
+
+
+def test_transports_leave_dns_alone():
+    get_transport()
+    assert not isinstance(socket.getaddrinfo, _CachingResolver)
+
+
+def test_dns_cache_is_bounded(monkeypatch):
+    lookups = []
+
+    def getaddrinfo(host, port):
+        lookups.append(host)
+        return [host]
+    resolver = _CachingResolver(getaddrinfo, ttl=60, max_entries=2)
+    for host in ('a', 'b', 'a', 'c', 'a', 'b'):
+        assert resolver(host, 80) == [host]
+    # 'b' was the least recently used when 'c' was added.
+    assert lookups == ['a', 'b', 'c', 'b']
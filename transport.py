@@ -0,0 +1,182 @@
+"""
+Shared HTTP transport for scrapers, the segment fetcher and OAuth.
+
+Every caller gets a session from here instead of making its own, so connections are pooled and kept alive
+across providers, clips and threads. Pools are sized to the concurrency of whoever uses them, and each transport
+has its own timeout and retry policy. Host name lookups can be cached too, by calling :func:`enable_dns_cache`.
+"""
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import aiohttp
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Seconds to wait for a connection, and for the server to send data.
+DEFAULT_TIMEOUT = (10, 60)
+DNS_CACHE_TTL = 300
+# Host names to remember lookups of.
+DNS_CACHE_SIZE = 256
+
+# Idempotent scraper and API requests are retried on throttling and server errors, honouring Retry-After.
+# A host that can't be reached is only tried once more.
+API_RETRY = Retry(total=3, connect=1, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  raise_on_status=False)
+# Segment requests are only retried on connection problems here.
+# Throttling responses are left to the concurrency controller, which needs to see them.
+SEGMENT_RETRY = Retry(total=3, connect=3, read=2, status=0, backoff_factor=0.2)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter that applies a default timeout and counts requests sent through it.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        self.num_requests = 0
+        self._lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        with self._lock:
+            self.num_requests += 1
+        return super().send(request, **kwargs)
+
+    def num_connections(self):
+        """
+        :return: Number of connections opened by the pools currently held by this adapter.
+        """
+        pools = self.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+
+class Transport(object):
+    def __init__(self, pool_size=10, timeout=DEFAULT_TIMEOUT, retry=API_RETRY):
+        """
+        :param pool_size: Connections kept alive per host. Should be at least the number of concurrent requests
+                          to a host, or connections beyond it are discarded and opened again.
+        :param timeout: Default (connect, read) timeout in seconds.
+        :param retry: urllib3 retry policy.
+        """
+        self.timeout = timeout
+        self.retry = retry
+        self.pool_size = pool_size
+        self.session = Session()
+        self._adapters = []
+        self.mount(self.session, pool_size)
+
+    def _make_adapter(self, pool_size):
+        adapter = PooledHTTPAdapter(timeout=self.timeout, max_retries=self.retry,
+                                    pool_connections=32, pool_maxsize=pool_size)
+        self._adapters.append(adapter)
+        return adapter
+
+    def mount(self, session, pool_size=None):
+        """
+        Route a session's requests through this transport's connection pools.
+        """
+        adapter = self._make_adapter(pool_size or self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def stats(self):
+        """
+        :return: Dict with the number of requests sent, connections opened, and requests that reused a connection.
+        """
+        num_requests = sum(adapter.num_requests for adapter in self._adapters)
+        num_connections = sum(adapter.num_connections() for adapter in self._adapters)
+        return {
+            'requests': num_requests,
+            'connections': num_connections,
+            'reused': max(0, num_requests - num_connections),
+        }
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(name='api', **kwargs):
+    """
+    Get the transport shared by everything in this process that uses ``name``, creating it with ``kwargs`` if needed.
+    """
+    with _transports_lock:
+        if name not in _transports:
+            _transports[name] = Transport(**kwargs)
+        return _transports[name]
+
+
+def get_session(name='api', **kwargs):
+    return get_transport(name, **kwargs).session
+
+
+def segment_session(concurrency):
+    """
+    Session for fetching video segments, with pools sized for ``concurrency`` requests per host.
+    """
+    transport = get_transport('segments', pool_size=concurrency, retry=SEGMENT_RETRY)
+    if concurrency > transport.pool_size:
+        transport.pool_size = concurrency
+        transport.mount(transport.session, concurrency)
+    return transport.session
+
+
+def async_session(per_host, max_in_flight):
+    """
+    aiohttp session for fetching video segments, using the same timeout and DNS cache policy as the other transports.
+    """
+    connector = aiohttp.TCPConnector(limit=max_in_flight, limit_per_host=per_host,
+                                     use_dns_cache=True, ttl_dns_cache=DNS_CACHE_TTL)
+    connect_timeout, read_timeout = DEFAULT_TIMEOUT
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+class _CachingResolver(object):
+    """
+    Wraps :func:`socket.getaddrinfo`, remembering results for a while so new connections don't wait on DNS.
+    """
+
+    def __init__(self, getaddrinfo, ttl, max_entries=DNS_CACHE_SIZE):
+        self.getaddrinfo = getaddrinfo
+        self._ttl = ttl
+        self._max_entries = max_entries
+        # Lookup arguments to (expiry time, result), least recently used first.
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        key = args + tuple(sorted(kwargs.items()))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(key)
+                return cached[1]
+        result = self.getaddrinfo(*args, **kwargs)
+        with self._lock:
+            self._cache[key] = now + self._ttl, result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+
+def enable_dns_cache(ttl=DNS_CACHE_TTL, max_entries=DNS_CACHE_SIZE):
+    """
+    Cache host name lookups for every connection this process makes, not just those of the transports.
+    Meant to be called once by the command line entry point, not by library code.
+    """
+    if not isinstance(socket.getaddrinfo, _CachingResolver):
+        socket.getaddrinfo = _CachingResolver(socket.getaddrinfo, ttl, max_entries)
+
+
+def disable_dns_cache():
+    if isinstance(socket.getaddrinfo, _CachingResolver):
+        socket.getaddrinfo = socket.getaddrinfo.getaddrinfo
@@ -5,7 +5,6 @@ import argparse
 import json
 import os
 import pytz
-import requests
 import yaml
 import time
 from datetime import datetime
@@ -14,6 +13,7 @@ from tqdm import tqdm
 
 from config import get_config, get_tz
 from oauth import load_client_credentials, obtain_user_code, poll_for_authorization, OAuth2Session
+from transport import get_session
 
 
 def parse_timestamp_naively(ts):
@@ -38,7 +38,7 @@ def get_minutes_url(config, metadata):
 
     minutes_url = metadata.get('minutes_url')
     if minutes_url:
-        requests.head(minutes_url).raise_for_status()
+        get_session().head(minutes_url).raise_for_status()
         return minutes_url
     elif config['id'] == 'vancouver':
         if not meeting_type:
@@ -47,7 +47,7 @@ def get_minutes_url(config, metadata):
             meeting_type = 'inau'
         mins = 'http://council.vancouver.ca/{dt:%Y%m%d}/{type}{dt:%Y%m%d}ag.htm'.format(
             type=meeting_type, dt=start_date)
-        requests.head(mins).raise_for_status()
+        get_session().head(mins).raise_for_status()
         return mins
 
     return 'N/A'